@@ -1,22 +1,40 @@
 from django.contrib import admin
+from django.contrib.contenttypes.admin import GenericTabularInline
+from .cache import bump_rated_versions
 from .models import *
 
 
+class VoteInline(GenericTabularInline):
+    model = Vote
+    raw_id_fields = ['user']
+    extra = 0
+
+
+class RatingAdminMixin:
+    """ Votes edited in inline bypass RatingAPI, so counters are recounted after save """
+    inlines = [VoteInline]
+    readonly_fields = ['likes_count', 'dislikes_count']
+
+    def save_related(self, request, form, formsets, change):
+        super(RatingAdminMixin, self).save_related(request, form, formsets, change)
+        type(form.instance).objects.filter(pk=form.instance.pk).refresh_rating_counters()
+        bump_rated_versions(type(form.instance), [form.instance.pk])
+
+
 @admin.register(Category)
 class CategoryAdminPanel(admin.ModelAdmin):
     list_display = ['title']
 
 
 @admin.register(Post)
-class PostAdminPanel(admin.ModelAdmin):
+class PostAdminPanel(RatingAdminMixin, admin.ModelAdmin):
     list_display_links = ['title']
     list_display = ['id', 'title', 'author', 'published_date']
-    filter_horizontal = ['likes', 'dislikes']
     raw_id_fields = ['author']
     search_fields = ['id']
     search_help_text = 'Search by id'
     sortable_by = ['published_date']
-    fields = ['title', 'category', 'content', 'author', 'likes', 'dislikes']
+    fields = ['title', 'category', 'content', 'author', 'likes_count', 'dislikes_count']
 
     class Media:
         js = (
@@ -30,12 +48,11 @@ class PostAdminPanel(admin.ModelAdmin):
 
 
 @admin.register(Comment)
-class CommentAdminPanel(admin.ModelAdmin):
+class CommentAdminPanel(RatingAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'get_post_id', 'author']
     list_select_related = ['post', 'author']
     raw_id_fields = ['post', 'author']
-    filter_horizontal = ['likes', 'dislikes']
-    fields = ['post', 'text', 'author', 'likes', 'dislikes']
+    fields = ['post', 'text', 'author', 'likes_count', 'dislikes_count']
 
     def save_model(self, request, obj, form, change):
         if not request.POST['author']:
@@ -0,0 +1,227 @@
+import functools
+import hashlib
+import math
+import random
+import time
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from .models import Post, Comment, Category
+
+CATEGORIES_CACHE_TIMEOUT = 60 * 60
+# Waiting for value computed by another process checks cache with this interval
+COMPUTE_WAIT_INTERVAL = 0.05
+
+
+def get_version_key(model, **scope):
+    """ Key of version of cached responses showing rows of model, e.g. get_version_key(Post, category_id=1) """
+    return 'versions:' + ':'.join([model._meta.db_table, *(f'{field}={scope[field]}' for field in sorted(scope))])
+
+
+def get_listing_version_key(**scope):
+    """
+    Version of pages listing post titles, e.g. get_listing_version_key(category_id=1).
+    Votes do not bump it, unlike versions of api listings which show ratings of posts
+    """
+    return get_version_key(Post, **scope) + ':titles'
+
+
+def get_rated_post_version_keys(post):
+    """ Post itself and api listings which show its rating """
+    return [
+        get_version_key(Post, pk=post.pk), get_version_key(Post),
+        get_version_key(Post, category_id=post.category_id), get_version_key(Post, author_id=post.author_id)
+    ]
+
+
+def get_post_version_keys(post):
+    """ Post itself and listings which show it """
+    return get_rated_post_version_keys(post) + [
+        get_listing_version_key(), get_listing_version_key(category_id=post.category_id)
+    ]
+
+
+def get_comment_version_keys(comment):
+    return [get_version_key(Comment, pk=comment.pk), get_version_key(Comment, post_id=comment.post_id)]
+
+
+def get_versions(keys):
+    """ Missing version starts from current time, so it never returns to a value of cached responses """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            cache.add(f'{key}:modified', time.time(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_last_modified(keys):
+    """ Time of the last bump of given versions, None when it is not known for some of them """
+    modified = cache.get_many([f'{key}:modified' for key in keys])
+    if len(modified) < len(keys):
+        return None
+    return max(modified.values())
+
+
+def bump_versions(keys):
+    """ Make responses cached under versions outdated after transaction is committed """
+    def bump():
+        now = time.time()
+        for key in set(keys):
+            try:
+                cache.incr(key)
+            except ValueError:
+                pass
+            cache.set(f'{key}:modified', now, None)
+
+    transaction.on_commit(bump)
+
+
+def bump_rated_versions(model, pks):
+    """ Bump versions of posts or comments which votes changed, fields of listings are read by one query """
+    if model is Post:
+        rows = Post.objects.filter(pk__in=pks).only('pk', 'category_id', 'author_id')
+        bump_versions([key for post in rows for key in get_rated_post_version_keys(post)])
+    else:
+        rows = Comment.objects.filter(pk__in=pks).only('pk', 'post_id')
+        bump_versions([key for comment in rows for key in get_comment_version_keys(comment)])
+
+
+def get_categories():
+    """ All categories, cached until any of them changes """
+    key = f'categories:{get_versions([get_version_key(Category)])[0]}'
+    categories = cache.get(key)
+    if categories is None:
+        categories = list(Category.objects.all())
+        cache.set(key, categories, CATEGORIES_CACHE_TIMEOUT)
+    return categories
+
+
+def get_or_compute(key, compute, timeout):
+    """
+    Return cached value of key or value of compute(), protected from cache stampede:
+    value is recomputed before it expires with probability growing near expiry and with compute time,
+    only the process holding short lock recomputes while others serve expired value for CACHE_STALE_TIMEOUT
+    or wait for the new one when there is no value at all.
+    compute() returning None is not cached
+    """
+    entry = cache.get(key)
+    # Lock key does not start with prefix of the value key, so it never uses local tier of two-tier cache
+    lock_key = f'locks:{key}'
+
+    if entry is not None:
+        value, expires, compute_time = entry
+        # Early expiration of XFetch, 1 - random() is never zero
+        early = compute_time * settings.CACHE_EARLY_EXPIRATION_BETA * -math.log(1 - random.random())
+        if time.time() + early < expires or not cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+            return value
+        return _compute_and_store(key, lock_key, compute, timeout)
+
+    if cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+        return _compute_and_store(key, lock_key, compute, timeout)
+
+    # Lock holder stores the value or releases the lock without it, lock timeout covers crashed holder
+    deadline = time.monotonic() + settings.CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline and cache.get(lock_key) is not None:
+        time.sleep(COMPUTE_WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    return compute()
+
+
+def _compute_and_store(key, lock_key, compute, timeout):
+    try:
+        started = time.time()
+        value = compute()
+        if value is not None:
+            finished = time.time()
+            cache.set(key, (value, finished + timeout, finished - started), timeout + settings.CACHE_STALE_TIMEOUT)
+        return value
+    finally:
+        cache.delete(lock_key)
+
+
+def has_pending_messages(request):
+    """ Check messages without marking them as shown """
+    storage = messages.get_messages(request)
+    pending = bool(list(storage))
+    storage.used = False
+    return pending
+
+
+def cache_response(method):
+    """
+    Cache successful response of view method for user under versions of view.get_version_keys(),
+    works for api views and for django views. Response is rendered before it is cached,
+    cached response is returned as rendered content. Recompute of expired response is protected from stampede.
+
+    ETag and Last-Modified are made of the versions, so conditional requests are answered with 304 before
+    anything is read from the database.
+    Pages of django views contain csrf tokens, forms and messages of the user, so they are cached only for
+    anonymous requests without pending messages. Anonymous pages are the same for every reader
+    """
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        is_api = hasattr(view, 'finalize_response')
+        if not is_api and (request.user.is_authenticated or has_pending_messages(request)):
+            return method(view, request, *args, **kwargs)
+
+        version_keys = view.get_version_keys()
+        versions = get_versions(version_keys)
+        request_key = '|'.join([
+            request.get_full_path(), request.accepted_renderer.media_type if is_api else 'text/html',
+            str(request.user.pk or 0), *map(str, versions)
+        ])
+        request_hash = hashlib.md5(request_key.encode()).hexdigest()
+        etag = f'"{request_hash}"'
+        last_modified = get_last_modified(version_keys)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified) if last_modified is not None else None
+        )
+        if response is None:
+            response = get_cached_response(
+                f'responses:{type(view).__name__}:{request_hash}', view, method, request, *args, **kwargs
+            )
+        if response.status_code in (200, 304):
+            set_validators(response, etag, last_modified)
+        return response
+
+    return wrapper
+
+
+def get_cached_response(key, view, method, request, *args, **kwargs):
+    is_api = hasattr(view, 'finalize_response')
+    computed = []
+
+    def compute():
+        response = method(view, request, *args, **kwargs)
+        if is_api:
+            response = view.finalize_response(request, response, *args, **kwargs)
+        computed.append(response)
+        if response.status_code != 200:
+            return None
+        if hasattr(response, 'render'):
+            response.render()
+        return response.content, response['Content-Type']
+
+    cached = get_or_compute(key, compute, settings.RESPONSE_CACHE_TIMEOUT)
+    if computed:
+        return computed[0]
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+def set_validators(response, etag, last_modified):
+    """ Response differs per user, so shared caches must not keep it and clients revalidate it every time """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie', 'Authorization'))
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+
+
+def get_count_key(model, **scope):
+    """ Key of rows amount of model table, scope narrows it, e.g. get_count_key(Post, category_id=1) """
+    return 'counts:' + ':'.join([model._meta.db_table, *(f'{field}={scope[field]}' for field in sorted(scope))])
+
+
+def get_count(queryset, key=None):
+    """
+    Return rows amount of queryset, cached under key when key is given.
+    Estimated amount from query plan is used instead of COUNT above COUNTS_ESTIMATE_THRESHOLD.
+    Inside transaction count may include not committed rows, so cache is neither read nor filled
+    """
+    use_cache = key is not None and not transaction.get_connection(queryset.db).in_atomic_block
+
+    if use_cache:
+        count = cache.get(key)
+        if count is not None:
+            return count
+
+    count = estimate_count(queryset)
+    if count is None or count < settings.COUNTS_ESTIMATE_THRESHOLD:
+        count = queryset.count()
+
+    if use_cache:
+        cache.add(key, count, settings.COUNTS_CACHE_TIMEOUT)
+    return count
+
+
+def estimate_count(queryset):
+    """ Rows estimate of query plan, None when database has no estimates """
+    connection = connections[queryset.db]
+    if connection.vendor not in ('mysql', 'postgresql'):
+        return None
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+
+        cursor.execute(f'EXPLAIN {sql}', params)
+        columns = [column[0] for column in cursor.description]
+        row = dict(zip(columns, cursor.fetchone()))
+        return int((row['rows'] or 0) * (row.get('filtered') or 100) / 100)
+
+
+def update_counts(keys, delta):
+    """ Change cached counts after transaction is committed, counts which are not cached are computed on demand """
+    def update():
+        for key in keys:
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                pass
+
+    transaction.on_commit(update)
@@ -0,0 +1,83 @@
+import datetime
+import json
+import zlib
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Post, Comment, Vote
+
+EXPORT_CHUNK_SIZE = 1000
+
+# Exported kind: (model, columns, annotations, {column: conversion}), votes have no change date
+EXPORTS = {
+    'posts': (Post, [
+        'id', 'title', 'content', 'category_id', 'author_id', 'likes_count', 'dislikes_count', 'published_date',
+        'last_change_date'
+    ], {}, {}),
+    'comments': (Comment, [
+        'id', 'text', 'post_id', 'author_id', 'likes_count', 'dislikes_count', 'published_date', 'last_change_date'
+    ], {}, {}),
+    'votes': (
+        Vote, ['id', 'user_id', 'object_id', 'value'], {'type': F('content_type__model')}, {'value': Vote.STATUSES.get}
+    ),
+}
+
+
+def parse_since(value):
+    """ Aware datetime of ISO datetime or date, naive values are in the current timezone """
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f'Invalid date "{value}", use ISO 8601 format')
+        since = datetime.datetime.combine(date, datetime.time())
+    return since if timezone.is_aware(since) else timezone.make_aware(since)
+
+
+def get_export_queryset(kind, since=None):
+    """ values() rows of exported kind, changed after since. Raise ValueError for unknown kind or filter """
+    if kind not in EXPORTS:
+        raise ValueError(f'Unknown export "{kind}", choices are {", ".join(EXPORTS)}')
+    model, columns, annotations = EXPORTS[kind][:3]
+
+    queryset = model.objects.values(*columns, **annotations)
+    if since is not None:
+        if not any(field.name == 'last_change_date' for field in model._meta.get_fields()):
+            raise ValueError(f'{model._meta.verbose_name_plural.capitalize()} can not be filtered by change date')
+        queryset = queryset.filter(last_change_date__gt=since)
+    return queryset
+
+
+def iter_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Chunks of rows in pk order. Every chunk is one short indexed query by pk range, so memory does not grow
+    with the table and no cursor stays open while a slow client reads the export
+    """
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_pk = rows[-1]['id']
+
+
+def iter_ndjson(kind, queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """ Newline-delimited JSON of rows of exported kind, one bytes block per chunk """
+    conversions = EXPORTS[kind][3]
+    for rows in iter_rows(queryset, chunk_size):
+        for row in rows:
+            for column, convert in conversions.items():
+                row[column] = convert(row[column])
+        yield ''.join(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in rows).encode()
+
+
+def gzip_chunks(chunks):
+    """ Compress bytes chunks into one gzip stream on the fly """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,53 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from forum.models import Post, Category, Comment
+from forum.views import PostPageView
+from users.models import CustomUserModel
+
+
+class Command(BaseCommand):
+    help = 'Compare render time of post page with cold and warm comment fragments, seeded comments are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--comments', type=int, nargs='+', default=[30, 300], help='Amounts of shown comments')
+        parser.add_argument('--repeat', type=int, default=5, help='Best of given amount of runs is reported')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"comments":>10} {"cold, ms":>10} {"warm, ms":>10}')
+        for amount in options['comments']:
+            with transaction.atomic():
+                post = self.seed(amount)
+                cold_time, warm_time = self.benchmark(post, amount, options['repeat'])
+                transaction.set_rollback(True)
+            self.stdout.write(f'{amount:>10} {cold_time * 1000:>10.2f} {warm_time * 1000:>10.2f}')
+
+    @staticmethod
+    def seed(amount):
+        author = CustomUserModel.objects.create(username='render_benchmark', email='benchmark@example.com')
+        category = Category.objects.create(title='Render benchmark')
+        post = Post.objects.create(title='Render benchmark', content='Benchmark', author=author, category=category)
+        Comment.objects.bulk_create(
+            [Comment(text=f'Comment {i}', author=author, post=post) for i in range(amount)], batch_size=1000
+        )
+        return post
+
+    @staticmethod
+    def benchmark(post, amount, repeat):
+        """ Page is rendered for logged in user, so full page cache of anonymous readers is not used """
+        factory = RequestFactory(SERVER_NAME=(settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.*') or 'localhost')
+        view = PostPageView.as_view(paginate_by=amount)
+
+        def render():
+            request = factory.get(post.get_absolute_url())
+            request.user = post.author
+            start = time.perf_counter()
+            view(request, post_pk=post.pk).render()
+            return time.perf_counter() - start
+
+        # The first render fills fragments of new comments
+        cold_time = render()
+        warm_time = min(render() for i in range(repeat))
+        return cold_time, warm_time
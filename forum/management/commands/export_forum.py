@@ -0,0 +1,37 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from forum import export
+
+
+class Command(BaseCommand):
+    help = 'Write all posts, comments or votes as newline-delimited JSON, rows are read in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(export.EXPORTS))
+        parser.add_argument('--since', help='Export posts and comments changed after ISO date or datetime')
+        parser.add_argument('--output', default='-', help='File to write, standard output by default')
+        parser.add_argument('--gzip', action='store_true', help='Compress output with gzip')
+        parser.add_argument('--chunk-size', type=int, default=export.EXPORT_CHUNK_SIZE, help='Rows read by one query')
+
+    def handle(self, *args, **options):
+        try:
+            since = export.parse_since(options['since']) if options['since'] else None
+            queryset = export.get_export_queryset(options['kind'], since)
+        except ValueError as error:
+            raise CommandError(error)
+
+        chunks = export.iter_ndjson(options['kind'], queryset, options['chunk_size'])
+        if options['gzip']:
+            chunks = export.gzip_chunks(chunks)
+
+        if options['output'] == '-':
+            self.write(chunks, sys.stdout.buffer)
+        else:
+            with open(options['output'], 'wb') as output:
+                self.write(chunks, output)
+
+    @staticmethod
+    def write(chunks, output):
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
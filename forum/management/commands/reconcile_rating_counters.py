@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from forum.cache import bump_rated_versions
+from forum.models import Post, Comment
+
+
+class Command(BaseCommand):
+    help = 'Recount likes_count and dislikes_count of posts and comments which drifted from votes table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Amount of rows checked per query')
+
+    def handle(self, *args, **options):
+        for model in [Post, Comment]:
+            repaired = self.reconcile(model, options['chunk_size'])
+            self.stdout.write(f'{model._meta.verbose_name_plural.capitalize()}: repaired {repaired} counters')
+
+    @staticmethod
+    def reconcile(model, chunk_size):
+        """ Walk table by pk ranges, so every chunk is one short indexed query """
+        repaired = 0
+        last_pk = 0
+
+        while True:
+            pks = list(
+                model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not pks:
+                return repaired
+
+            drifted = model.objects.filter(pk__in=pks).with_actual_rating_counts().filter(
+                ~Q(likes_count=F('actual_likes_count')) | ~Q(dislikes_count=F('actual_dislikes_count'))
+            ).values_list('pk', flat=True)
+            drifted = list(drifted)
+            if drifted:
+                repaired += model.objects.filter(pk__in=drifted).refresh_rating_counters()
+                bump_rated_versions(model, drifted)
+            last_pk = pks[-1]
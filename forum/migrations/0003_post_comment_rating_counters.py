@@ -0,0 +1,52 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_rating_counters(apps, schema_editor):
+    for model_name in ['Post', 'Comment']:
+        model = apps.get_model('forum', model_name)
+        counters = {}
+
+        for field_name in ['likes', 'dislikes']:
+            field = model._meta.get_field(field_name)
+            source_name = field.m2m_field_name()
+            votes = field.remote_field.through.objects.filter(**{source_name: OuterRef('pk')}).order_by()
+            counters[f'{field_name}_count'] = Coalesce(
+                Subquery(votes.values(source_name).annotate(total=Count('pk')).values('total')), 0
+            )
+
+        model.objects.update(**counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.1.4 on 2026-10-18 17:35
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+LIKE = 1
+DISLIKE = -1
+BATCH_SIZE = 1000
+rating_fields = [('likes', LIKE), ('dislikes', DISLIKE)]
+
+
+def get_content_type(apps, model_name):
+    content_type_model = apps.get_model('contenttypes', 'ContentType')
+    return content_type_model.objects.get_or_create(app_label='forum', model=model_name.lower())[0]
+
+
+def copy_ratings_to_votes(apps, schema_editor):
+    vote_model = apps.get_model('forum', 'Vote')
+
+    for model_name in ['Post', 'Comment']:
+        model = apps.get_model('forum', model_name)
+        content_type = get_content_type(apps, model_name)
+
+        # Likes are copied first, so user who is in likes and dislikes at once keeps like
+        for field_name, value in rating_fields:
+            field = model._meta.get_field(field_name)
+            rows = field.remote_field.through.objects.order_by('pk').values_list(
+                f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+            )
+            votes = []
+
+            for object_id, user_id in rows.iterator(chunk_size=BATCH_SIZE):
+                votes.append(vote_model(content_type=content_type, object_id=object_id, user_id=user_id, value=value))
+                if len(votes) == BATCH_SIZE:
+                    vote_model.objects.bulk_create(votes, ignore_conflicts=True)
+                    votes = []
+            vote_model.objects.bulk_create(votes, ignore_conflicts=True)
+
+        counters = {}
+        for field_name, value in rating_fields:
+            votes = vote_model.objects.filter(
+                content_type=content_type, object_id=OuterRef('pk'), value=value
+            ).order_by()
+            counters[f'{field_name}_count'] = Coalesce(
+                Subquery(votes.values('object_id').annotate(total=Count('pk')).values('total')), 0
+            )
+        model.objects.update(**counters)
+
+
+def copy_votes_to_ratings(apps, schema_editor):
+    vote_model = apps.get_model('forum', 'Vote')
+
+    for model_name in ['Post', 'Comment']:
+        model = apps.get_model('forum', model_name)
+        content_type = get_content_type(apps, model_name)
+
+        for field_name, value in rating_fields:
+            field = model._meta.get_field(field_name)
+            through = field.remote_field.through
+            votes = vote_model.objects.filter(content_type=content_type, value=value).values_list('object_id', 'user_id')
+            rows = []
+
+            for object_id, user_id in votes.iterator(chunk_size=BATCH_SIZE):
+                rows.append(through(**{
+                    f'{field.m2m_field_name()}_id': object_id, f'{field.m2m_reverse_field_name()}_id': user_id
+                }))
+                if len(rows) == BATCH_SIZE:
+                    through.objects.bulk_create(rows, ignore_conflicts=True)
+                    rows = []
+            through.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0004_vote'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_ratings_to_votes, copy_votes_to_ratings),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0006_remove_post_comment_likes_dislikes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ['-published_date', '-pk']},
+        ),
+        migrations.AlterModelOptions(
+            name='post',
+            options={'ordering': ['-published_date', '-pk']},
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'published_date', 'id'], name='comments_post_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['published_date', 'id'], name='posts_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['category', 'published_date', 'id'], name='posts_category_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'published_date', 'id'], name='posts_author_published_idx'),
+        ),
+    ]
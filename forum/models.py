@@ -1,15 +1,47 @@
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction, IntegrityError, OperationalError
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from users.models import CustomUserModel
 from ckeditor.fields import RichTextField
+import random
+import time
+
+VOTE_WRITE_ATTEMPTS = 5
+VOTE_WRITE_RETRY_DELAY = 0.01
+
+
+class RatingQuerySet(models.QuerySet):
+    def _rating_count(self, value):
+        votes = Vote.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.model), object_id=OuterRef('pk'), value=value
+        ).order_by()
+        return Coalesce(Subquery(votes.values('object_id').annotate(total=Count('pk')).values('total')), 0)
+
+    def with_actual_rating_counts(self):
+        """ Annotate rows with likes and dislikes counted from the votes table """
+        return self.annotate(
+            actual_likes_count=self._rating_count(Vote.LIKE), actual_dislikes_count=self._rating_count(Vote.DISLIKE)
+        )
+
+    def refresh_rating_counters(self):
+        """ Recount stored likes_count and dislikes_count in one UPDATE statement """
+        return self.update(
+            likes_count=self._rating_count(Vote.LIKE), dislikes_count=self._rating_count(Vote.DISLIKE)
+        )
 
 
 class AbstractDateAndRating(models.Model):
     published_date = models.DateTimeField(auto_now_add=True)
     last_change_date = models.DateTimeField(auto_now=True)
-    likes = models.ManyToManyField(CustomUserModel, related_name='%(class)ss_likes', blank=True)
-    dislikes = models.ManyToManyField(CustomUserModel, related_name='%(class)ss_dislikes', blank=True)
+    votes = GenericRelation('Vote')
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    dislikes_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = RatingQuerySet.as_manager()
 
     class Meta:
         abstract = True
@@ -40,7 +72,13 @@ class Post(AbstractDateAndRating):
 
     class Meta:
         db_table = 'posts'
-        ordering = ['-published_date']
+        ordering = ['-published_date', '-pk']
+        # Listings filter by one column and are ordered by (published_date, id), see QueryPlanTest
+        indexes = [
+            models.Index(fields=['published_date', 'id'], name='posts_published_idx'),
+            models.Index(fields=['category', 'published_date', 'id'], name='posts_category_published_idx'),
+            models.Index(fields=['author', 'published_date', 'id'], name='posts_author_published_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -56,10 +94,186 @@ class Comment(AbstractDateAndRating):
 
     class Meta:
         db_table = 'comments'
-        ordering = ['-published_date']
+        ordering = ['-published_date', '-pk']
+        indexes = [
+            models.Index(fields=['post', 'published_date', 'id'], name='comments_post_published_idx'),
+        ]
 
     def __str__(self):
         return self.text
 
     def get_absolute_url(self):
         return reverse('forum:post_page', kwargs={'post_pk': self.post.pk}) + f'#comment_{self.pk}'
+
+
+def get_object_ids_by_content_type(objects):
+    object_ids = {}
+    for obj in objects:
+        object_ids.setdefault(ContentType.objects.get_for_model(obj).pk, set()).add(obj.pk)
+    return object_ids
+
+
+class VoteQuerySet(models.QuerySet):
+    def for_object(self, obj):
+        return self.filter(content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk)
+
+    def _write_with_retries(self, write, *args):
+        """
+        Run write in its own transaction. Concurrent insert of the same vote fails on unique constraint
+        and deadlocks roll back the transaction, both are retried with random delay
+        """
+        # Rolled back transaction can be retried only when write owns it
+        can_retry_rollback = not transaction.get_connection(self.db).in_atomic_block
+
+        for attempt in range(1, VOTE_WRITE_ATTEMPTS + 1):
+            try:
+                with transaction.atomic(using=self.db):
+                    return write(*args)
+            except IntegrityError:
+                if attempt == VOTE_WRITE_ATTEMPTS:
+                    raise
+            except OperationalError:
+                if attempt == VOTE_WRITE_ATTEMPTS or not can_retry_rollback:
+                    raise
+            time.sleep(random.uniform(0, VOTE_WRITE_RETRY_DELAY * attempt))
+
+    def toggle(self, obj, user, value):
+        """
+        Set user vote on post or comment, the same vote sent again removes it.
+        Vote row is locked for the transaction, so toggles of one user are applied one after another.
+        Return new vote value or None when vote is removed
+        """
+        return self._write_with_retries(self._toggle, obj, user, value)
+
+    def toggle_many(self, user, operations):
+        """
+        Apply [(post or comment, value)] toggles of one user in given order.
+        Amount of queries depends on amount of content types, not on amount of operations
+        """
+        if operations:
+            self._write_with_retries(self._toggle_many, user, operations)
+
+    def get_user_values(self, user, objects):
+        """ Return {(content_type_id, object_id): value} of user votes on given posts and comments in one query """
+        return self.get_user_values_by_ids(user, get_object_ids_by_content_type(objects))
+
+    def get_user_values_by_ids(self, user, object_ids):
+        """ Like get_user_values for {content_type_id: object ids}, when rows are not model instances """
+        lookup = Q()
+        for content_type_id, ids in object_ids.items():
+            lookup |= Q(content_type_id=content_type_id, object_id__in=ids)
+
+        if not lookup:
+            return {}
+
+        votes = self.filter(lookup, user=user).values_list('content_type_id', 'object_id', 'value')
+        return {(content_type_id, object_id): value for content_type_id, object_id, value in votes}
+
+    def apply_values(self, values):
+        """
+        Write final vote values given as {(content_type_id, object_id, user_id): value or None},
+        None removes vote. Amount of queries depends on amount of content types, not on amount of votes.
+        Counters of touched posts and comments are recounted
+        """
+        if values:
+            self._write_with_retries(self._apply_values, values)
+
+    def _toggle(self, obj, user, value):
+        """ One INSERT, UPDATE or DELETE of the vote row plus one counters UPDATE """
+        votes = self.for_object(obj).filter(user=user)
+        current_value = votes.select_for_update().values_list('value', flat=True).first()
+
+        if current_value == value:
+            votes.delete()
+            new_value = None
+        elif current_value is None:
+            self.create(content_object=obj, user=user, value=value)
+            new_value = value
+        else:
+            votes.update(value=value)
+            new_value = value
+
+        type(obj).objects.filter(pk=obj.pk).update(**Vote.get_counters_changes(current_value, new_value))
+        return new_value
+
+    def _toggle_many(self, user, operations):
+        values = self.select_for_update().get_user_values(user, [obj for obj, value in operations])
+
+        for obj, value in operations:
+            key = (ContentType.objects.get_for_model(obj).pk, obj.pk)
+            values[key] = None if values.get(key) == value else value
+
+        self._apply_values({
+            (content_type_id, object_id, user.pk): value for (content_type_id, object_id), value in values.items()
+        })
+
+    def _apply_values(self, values):
+        values_by_content_type = {}
+        for (content_type_id, object_id, user_id), value in values.items():
+            values_by_content_type.setdefault(content_type_id, {})[(object_id, user_id)] = value
+
+        for content_type_id, content_type_values in values_by_content_type.items():
+            object_ids = {object_id for object_id, user_id in content_type_values}
+            user_ids = {user_id for object_id, user_id in content_type_values}
+            existing_votes = self.filter(
+                content_type_id=content_type_id, object_id__in=object_ids, user_id__in=user_ids
+            ).select_for_update().values_list('pk', 'object_id', 'user_id', 'value')
+
+            deleted_pks = []
+            updated_pks = {self.model.LIKE: [], self.model.DISLIKE: []}
+            for pk, object_id, user_id, current_value in existing_votes:
+                if (object_id, user_id) not in content_type_values:
+                    continue
+                value = content_type_values.pop((object_id, user_id))
+                if value is None:
+                    deleted_pks.append(pk)
+                elif value != current_value:
+                    updated_pks[value].append(pk)
+
+            if deleted_pks:
+                self.filter(pk__in=deleted_pks).delete()
+            for value, pks in updated_pks.items():
+                if pks:
+                    self.filter(pk__in=pks).update(value=value)
+            self.bulk_create([
+                self.model(content_type_id=content_type_id, object_id=object_id, user_id=user_id, value=value)
+                for (object_id, user_id), value in content_type_values.items() if value is not None
+            ])
+
+            rated_model = ContentType.objects.get_for_id(content_type_id).model_class()
+            rated_model.objects.filter(pk__in=object_ids).refresh_rating_counters()
+
+
+class Vote(models.Model):
+    LIKE = 1
+    DISLIKE = -1
+    VALUE_CHOICES = [(LIKE, 'Like'), (DISLIKE, 'Dislike')]
+    STATUSES = {LIKE: 'like', DISLIKE: 'dislike'}
+    COUNTER_FIELDS = {LIKE: 'likes_count', DISLIKE: 'dislikes_count'}
+
+    user = models.ForeignKey(CustomUserModel, on_delete=models.CASCADE, related_name='votes')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    content_object = GenericForeignKey()
+    value = models.SmallIntegerField(choices=VALUE_CHOICES)
+
+    objects = VoteQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'votes'
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id', 'user'], name='unique_user_vote'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.get_value_display()} {self.content_type_id}:{self.object_id}'
+
+    @classmethod
+    def get_counters_changes(cls, old_value, new_value):
+        """ Return F() expressions which move likes_count and dislikes_count from old vote to new one """
+        changes = {}
+        for value, field_name in cls.COUNTER_FIELDS.items():
+            difference = (new_value == value) - (old_value == value)
+            if difference:
+                changes[field_name] = F(field_name) + difference
+        return changes
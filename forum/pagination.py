@@ -0,0 +1,186 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, Page, InvalidPage
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+from .counts import get_count
+
+KEYSET_ORDERING = ('-published_date', '-pk')
+NUMBERED_PAGES = 10
+
+
+class CachedCountPaginator(Paginator):
+    """ Paginator taking count from the count cache when count_key is given, see forum.counts """
+
+    def __init__(self, object_list, per_page, count_key=None, **kwargs):
+        self.count_key = count_key
+        super(CachedCountPaginator, self).__init__(object_list, per_page, **kwargs)
+
+    @cached_property
+    def count(self):
+        return get_count(self.object_list, self.count_key)
+
+
+class KeysetPaginator(CachedCountPaginator):
+    """
+    Numbered pages are kept for the first numbered_pages pages, deeper pages are reached with opaque
+    next and previous cursors, which filter by the last seen (published_date, pk) instead of using OFFSET.
+    Without count_key count is bounded by numbered pages, so the whole table is never counted
+    """
+
+    def __init__(self, object_list, per_page, ordering=KEYSET_ORDERING, numbered_pages=NUMBERED_PAGES, **kwargs):
+        self.ordering = ordering
+        self.numbered_pages = numbered_pages
+        self.ordering_fields = [field.lstrip('-') for field in ordering]
+
+        # Rows of values() querysets need ordering fields for cursors, they are removed from page rows
+        values_fields = list(object_list.query.values_select)
+        self.extra_fields = [field for field in self.ordering_fields if values_fields and field not in values_fields]
+        if self.extra_fields:
+            object_list = object_list.values(*values_fields, *self.extra_fields)
+
+        super(KeysetPaginator, self).__init__(object_list.order_by(*ordering), per_page, **kwargs)
+
+    @cached_property
+    def count(self):
+        if self.count_key is not None:
+            return super(KeysetPaginator, self).count
+        return self.object_list[:self.numbered_pages * self.per_page + 1].count()
+
+    @property
+    def page_range(self):
+        return range(1, min(self.num_pages, self.numbered_pages) + 1)
+
+    def validate_number(self, number):
+        number = super(KeysetPaginator, self).validate_number(number)
+        if number > self.numbered_pages:
+            raise InvalidPage('Page is too deep, use cursor')
+        return number
+
+    def get_page_from_params(self, params):
+        """ Return cursor page when cursor is given, otherwise numbered page. Raise Http404 for invalid page """
+        try:
+            if params.get('cursor'):
+                page = self.cursor_page(params['cursor'])
+            else:
+                page = self.page(params.get('page', 1))
+        except InvalidPage:
+            raise Http404('Invalid page')
+
+        # Other parameters, like search query, are kept in page links
+        other_params = params.copy()
+        for key in ('page', 'cursor'):
+            other_params.pop(key, None)
+        page.query_string = f'{other_params.urlencode()}&' if other_params else ''
+        return page
+
+    def cursor_page(self, cursor):
+        values, backwards = self.decode_cursor(cursor)
+        queryset = self.object_list.filter(self.get_keyset_lookup(values, backwards))
+
+        if backwards:
+            queryset = queryset.reverse()
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            return KeysetPage(rows, None, self, has_previous=has_more, has_next=True)
+        return KeysetPage(rows, None, self, has_previous=True, has_next=has_more)
+
+    def get_keyset_lookup(self, values, backwards=False):
+        """
+        Rows after (or before) given ordering values: a <= x and (a < x or (a = x and b < y)) for descending fields.
+        Leading a <= x is a range of the index, so database does not merge OR branches and sort them
+        """
+        lookup = Q()
+        for i, field in enumerate(self.ordering):
+            descending = field.startswith('-') != backwards
+            condition = Q(**{f'{self.ordering_fields[i]}__{"lt" if descending else "gt"}': values[i]})
+            for previous_field, previous_value in zip(self.ordering_fields[:i], values):
+                condition &= Q(**{previous_field: previous_value})
+            lookup |= condition
+
+        first_descending = self.ordering[0].startswith('-') != backwards
+        return Q(**{f'{self.ordering_fields[0]}__{"lte" if first_descending else "gte"}': values[0]}) & lookup
+
+    def get_row_values(self, row):
+        if isinstance(row, dict):
+            return [row[field] for field in self.ordering_fields]
+        return [getattr(row, field) for field in self.ordering_fields]
+
+    def encode_cursor(self, row, backwards=False):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in self.get_row_values(row)]
+        return base64.urlsafe_b64encode(json.dumps([values, backwards]).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values, backwards = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            model = self.object_list.model
+            values = [
+                model._meta.pk.to_python(value) if field == 'pk' else model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.ordering_fields, values)
+            ]
+        except (ValueError, TypeError, binascii.Error, ValidationError):
+            raise InvalidPage('Invalid cursor')
+
+        if len(values) != len(self.ordering_fields) or None in values:
+            raise InvalidPage('Invalid cursor')
+        return values, bool(backwards)
+
+    def _get_page(self, *args, **kwargs):
+        return KeysetPage(*args, **kwargs)
+
+
+class KeysetPage(Page):
+    """ Numbered page has number, cursor page has number None and is navigated only with cursors """
+
+    def __init__(self, object_list, number, paginator, has_previous=None, has_next=None):
+        rows = list(object_list)
+        self.next_cursor = paginator.encode_cursor(rows[-1]) if rows else None
+        self.previous_cursor = paginator.encode_cursor(rows[0], backwards=True) if rows else None
+        self.query_string = ''
+
+        if paginator.extra_fields:
+            rows = [{key: value for key, value in row.items() if key not in paginator.extra_fields} for row in rows]
+
+        super(KeysetPage, self).__init__(rows, number, paginator)
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    @property
+    def uses_cursors(self):
+        """ Next page of cursor page and of the last numbered page is reached with next cursor """
+        return self.number is None or self.number == self.paginator.numbered_pages
+
+    def has_next(self):
+        if self.number is None:
+            return self._has_next
+        return super(KeysetPage, self).has_next()
+
+    def has_previous(self):
+        if self.number is None:
+            return self._has_previous
+        return super(KeysetPage, self).has_previous()
+
+
+class KeysetPaginationMixin:
+    """ ListView mixin paginating with KeysetPaginator """
+    paginator_class = KeysetPaginator
+
+    def get_count_key(self):
+        return None
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        return super(KeysetPaginationMixin, self).get_paginator(
+            queryset, per_page, count_key=self.get_count_key(), **kwargs
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator(queryset, page_size)
+        page = paginator.get_page_from_params(self.request.GET)
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,133 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import pre_delete, post_delete, pre_save, post_save
+from django.dispatch import receiver
+from users.models import CustomUserModel
+from .cache import (
+    get_version_key, get_listing_version_key, get_post_version_keys, get_comment_version_keys, bump_versions,
+    bump_rated_versions
+)
+from .counts import get_count_key, update_counts
+from .models import Vote, Post, Comment, Category
+
+
+@receiver(pre_delete, sender=CustomUserModel)
+def collect_user_votes(sender, instance, **kwargs):
+    """ Cascade deletes user votes without touching counters, so remember what to recount """
+    instance._voted_pks = {}
+    for content_type_id, object_id in Vote.objects.filter(user=instance).values_list('content_type', 'object_id'):
+        instance._voted_pks.setdefault(content_type_id, []).append(object_id)
+
+
+@receiver(post_delete, sender=CustomUserModel)
+def update_user_votes_counters(sender, instance, **kwargs):
+    for content_type_id, pks in getattr(instance, '_voted_pks', {}).items():
+        rated_model = ContentType.objects.get_for_id(content_type_id).model_class()
+        rated_model.objects.filter(pk__in=pks).refresh_rating_counters()
+        bump_rated_versions(rated_model, pks)
+
+
+# Cached amounts of posts and comments used by paginators
+def get_post_count_keys(category_id, author_id):
+    return [
+        get_count_key(Post), get_count_key(Post, category_id=category_id), get_count_key(Post, author_id=author_id)
+    ]
+
+
+def get_comment_count_keys(post_id):
+    return [get_count_key(Comment, post_id=post_id)]
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_counted_fields(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._counted_fields = Post.objects.filter(pk=instance.pk).values('category_id', 'author_id').first()
+
+
+@receiver(post_save, sender=Post)
+def update_post_counts(sender, instance, created, **kwargs):
+    new_keys = get_post_count_keys(instance.category_id, instance.author_id)
+    old_fields = getattr(instance, '_counted_fields', None)
+
+    if created or old_fields is None:
+        update_counts(new_keys, 1)
+    else:
+        old_keys = get_post_count_keys(**old_fields)
+        update_counts([key for key in old_keys if key not in new_keys], -1)
+        update_counts([key for key in new_keys if key not in old_keys], 1)
+
+
+@receiver(post_delete, sender=Post)
+def decrease_post_counts(sender, instance, **kwargs):
+    update_counts(get_post_count_keys(instance.category_id, instance.author_id), -1)
+
+
+@receiver(pre_save, sender=Comment)
+def remember_comment_post(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._counted_fields = Comment.objects.filter(pk=instance.pk).values('post_id').first()
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_counts(sender, instance, created, **kwargs):
+    old_fields = getattr(instance, '_counted_fields', None)
+
+    if created or old_fields is None:
+        update_counts(get_comment_count_keys(instance.post_id), 1)
+    elif old_fields['post_id'] != instance.post_id:
+        update_counts(get_comment_count_keys(old_fields['post_id']), -1)
+        update_counts(get_comment_count_keys(instance.post_id), 1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrease_comment_counts(sender, instance, **kwargs):
+    update_counts(get_comment_count_keys(instance.post_id), -1)
+
+
+# Versions of cached api responses, see forum.cache
+@receiver([post_save, post_delete], sender=Post)
+def bump_post_versions(sender, instance, **kwargs):
+    keys = get_post_version_keys(instance)
+    old_fields = getattr(instance, '_counted_fields', None)
+    if old_fields is not None:
+        keys += [get_version_key(Post, **{field: value}) for field, value in old_fields.items()]
+        if 'category_id' in old_fields:
+            keys.append(get_listing_version_key(category_id=old_fields['category_id']))
+    bump_versions(keys)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def bump_comment_versions(sender, instance, **kwargs):
+    keys = get_comment_version_keys(instance)
+    old_fields = getattr(instance, '_counted_fields', None)
+    if old_fields is not None:
+        keys.append(get_version_key(Comment, post_id=old_fields['post_id']))
+    bump_versions(keys)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def bump_categories_version(sender, instance, **kwargs):
+    bump_versions([get_version_key(Category)])
+
+
+@receiver(pre_save, sender=CustomUserModel)
+def remember_user_shown_fields(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is not None and (update_fields is None or {'username', 'profile_image'} & set(update_fields)):
+        instance._shown_fields = CustomUserModel.objects.filter(pk=instance.pk).values(
+            'username', 'profile_image'
+        ).first()
+
+
+@receiver(post_save, sender=CustomUserModel)
+def bump_user_content_versions(sender, instance, created, **kwargs):
+    """ Cached pages and responses show username and avatar of authors of posts and comments """
+    old_fields = getattr(instance, '_shown_fields', None)
+    if created or old_fields is None or \
+            old_fields == {'username': instance.username, 'profile_image': instance.profile_image.name}:
+        return
+
+    keys = [get_version_key(Post), get_version_key(Post, author_id=instance.pk)]
+    for pk, category_id in Post.objects.filter(author=instance).values_list('pk', 'category_id'):
+        keys += [get_version_key(Post, pk=pk), get_version_key(Post, category_id=category_id)]
+    for pk, post_id in Comment.objects.filter(author=instance).values_list('pk', 'post_id'):
+        keys += [get_version_key(Comment, pk=pk), get_version_key(Comment, post_id=post_id)]
+    bump_versions(keys)
@@ -0,0 +1,15 @@
+from celery.signals import worker_ready
+from project.celery import app
+from .vote_buffer import get_vote_buffer
+
+
+@app.task(ignore_result=True)
+def flush_vote_buffer():
+    """ Scheduled only with VOTES_WRITE_BEHIND, but votes buffered before it was turned off are flushed too """
+    get_vote_buffer().flush()
+
+
+@worker_ready.connect
+def flush_vote_buffer_on_start(sender, **kwargs):
+    """ Votes claimed by crashed flush or left after VOTES_WRITE_BEHIND was turned off are written on start """
+    flush_vote_buffer.delay()
@@ -1,6 +1,28 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from threading import Barrier, Thread
+from unittest import mock
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.http import Http404, QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .models import Post, Category, Comment
+from django.utils import timezone
+from freezegun import freeze_time
+from project.cache_backends import TwoTierCache
+from .cache import get_categories, get_or_compute
+from .counts import get_count, get_count_key
+from .models import Post, Category, Comment, Vote
+from .pagination import KeysetPaginator
+from .vote_buffer import RedisVoteBuffer, get_vote_buffer
 from users.tests import create_user
 
 
@@ -18,8 +40,15 @@ def create_comment(author, post, text='CommentText'):
     return Comment.objects.create(author=author, post=post, text=text)
 
 
+def create_vote(user, obj, value=Vote.LIKE):
+    vote = Vote.objects.create(user=user, content_object=obj, value=value)
+    type(obj).objects.filter(pk=obj.pk).refresh_rating_counters()
+    return vote
+
+
 class PostPageViewTest(TestCase):
     def setUp(self) -> None:
+        cache.clear()
         self.user = create_user()
         self.post = create_post(author=self.user)
 
@@ -35,6 +64,42 @@ class PostPageViewTest(TestCase):
         response = self.client.get(reverse('forum:post_page', kwargs={'post_pk': self.post.pk}))
         self.assertEqual(response.context['page_obj'].object_list[0].text, 'comment1')
 
+    def test_user_votes_of_page(self):
+        voter = create_user(username='voter', email='voter@gmail.com')
+        comments = [create_comment(author=self.user, post=self.post, text=f'comment{i}') for i in range(5)]
+        create_vote(voter, self.post, Vote.DISLIKE)
+        create_vote(voter, comments[1], Vote.LIKE)
+        create_vote(self.user, comments[2], Vote.LIKE)
+
+        self.client.force_login(voter)
+        response = self.client.get(reverse('forum:post_page', kwargs={'post_pk': self.post.pk}))
+        self.assertEqual(response.context['post'].my_vote, 'dislike')
+        self.assertEqual(
+            {comment.text: comment.my_vote for comment in response.context['page_obj'].object_list},
+            {'comment0': None, 'comment1': 'like', 'comment2': None, 'comment3': None, 'comment4': None}
+        )
+
+    def test_comment_fragments(self):
+        other = create_user(username='other', email='other@gmail.com')
+        comment = create_comment(author=other, post=self.post, text='first text')
+        url = reverse('forum:post_page', kwargs={'post_pk': self.post.pk})
+
+        self.client.force_login(other)
+        self.assertContains(self.client.get(url), 'first text')
+        # Fragments are shared by users, buttons of comment author are not
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertContains(response, 'first text')
+        self.assertNotContains(response, reverse('forum:comment_delete', args=[comment.pk]))
+
+        comment.text = 'second text'
+        comment.save()
+        other.username = 'renamed'
+        other.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'second text')
+        self.assertContains(response, reverse('users:profile', args=['renamed']))
+
 
 class PostCreateViewTest(TestCase):
     def setUp(self) -> None:
@@ -124,6 +189,7 @@ class CommentDeleteViewTest(TestCase):
 
 class CategoryPostsViewTest(TestCase):
     def setUp(self) -> None:
+        cache.clear()
         self.user = create_user()
         self.category1 = create_category('Category1')
         self.category2 = create_category('Category2')
@@ -143,3 +209,462 @@ class CategoryPostsViewTest(TestCase):
         self.assertQuerysetEqual(
             response_category_2.context['posts'], [{'title': self.post2.title, 'pk': self.post2.pk}]
         )
+
+
+class VoteTest(TestCase):
+    def setUp(self) -> None:
+        self.user = create_user()
+        self.post = create_post(author=self.user)
+        self.comment = create_comment(self.user, self.post)
+
+    def test_toggle(self):
+        self.assertEqual(Vote.objects.toggle(self.post, self.user, Vote.LIKE), Vote.LIKE)
+        self.assertEqual(Vote.objects.toggle(self.post, self.user, Vote.DISLIKE), Vote.DISLIKE)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count), (0, 1))
+        self.assertIsNone(Vote.objects.toggle(self.post, self.user, Vote.DISLIKE))
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count), (0, 0))
+        self.assertFalse(Vote.objects.all())
+
+    def test_toggle_queries(self):
+        create_vote(self.user, self.comment, Vote.DISLIKE)
+        Vote.objects.toggle(self.comment, self.user, Vote.LIKE)
+        # Savepoint, select of current vote, one write of vote row, counters update and savepoint release
+        with self.assertNumQueries(5):
+            Vote.objects.toggle(self.comment, self.user, Vote.DISLIKE)
+
+    def test_counters_after_user_deletion(self):
+        voter = create_user(username='voter', email='voter@gmail.com')
+        create_vote(voter, self.post, Vote.LIKE)
+        create_vote(voter, self.comment, Vote.DISLIKE)
+        voter.delete()
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+        self.assertEqual(self.comment.dislikes_count, 0)
+
+    def test_reconcile_rating_counters(self):
+        create_vote(self.user, self.post, Vote.LIKE)
+        Post.objects.filter(pk=self.post.pk).update(likes_count=10, dislikes_count=3)
+        out = StringIO()
+        call_command('reconcile_rating_counters', chunk_size=1, stdout=out)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count), (1, 0))
+        self.assertIn('Posts: repaired 1 counters', out.getvalue())
+
+
+class KeysetPaginatorTest(TestCase):
+    @freeze_time('2022-01-01', auto_tick_seconds=5)
+    def setUp(self) -> None:
+        self.user = create_user()
+        self.category = create_category('Category1')
+        self.posts = [create_post(author=self.user, category=self.category, title=f'Post{i}') for i in range(7)]
+        self.posts.reverse()
+        # Two posts with the same published date are ordered by pk, the second page ends between them
+        Post.objects.filter(pk=self.posts[4].pk).update(published_date=self.posts[3].published_date)
+
+    def test_walk_pages_with_cursors(self):
+        paginator = KeysetPaginator(Post.objects.all(), 2, numbered_pages=1)
+        page = paginator.get_page_from_params(QueryDict('page=1'))
+        self.assertEqual(list(page), self.posts[:2])
+        self.assertTrue(page.uses_cursors and page.has_next())
+        self.assertRaises(Http404, paginator.get_page_from_params, QueryDict('page=2'))
+
+        pages = []
+        while page.has_next():
+            page = paginator.get_page_from_params(QueryDict(f'cursor={page.next_cursor}'))
+            pages.append(list(page))
+        self.assertEqual(pages, [self.posts[2:4], self.posts[4:6], self.posts[6:]])
+
+        page = paginator.get_page_from_params(QueryDict(f'cursor={page.previous_cursor}'))
+        self.assertEqual(list(page), self.posts[4:6])
+        self.assertTrue(page.has_previous() and page.has_next())
+        page = paginator.get_page_from_params(QueryDict(f'cursor={page.previous_cursor}'))
+        page = paginator.get_page_from_params(QueryDict(f'cursor={page.previous_cursor}'))
+        self.assertEqual(list(page), self.posts[:2])
+        self.assertFalse(page.has_previous())
+
+    def test_count_is_bounded_by_numbered_pages(self):
+        paginator = KeysetPaginator(Post.objects.all(), 2, numbered_pages=2)
+        self.assertEqual(paginator.count, 5)
+        self.assertEqual(list(paginator.page_range), [1, 2])
+
+    def test_values_rows_and_invalid_cursor(self):
+        paginator = KeysetPaginator(Post.objects.values('title'), 3)
+        page = paginator.get_page_from_params(QueryDict('page=1&q=Post'))
+        self.assertEqual(list(page), [{'title': post.title} for post in self.posts[:3]])
+        self.assertEqual(page.query_string, 'q=Post&')
+        page = paginator.get_page_from_params(QueryDict(f'cursor={page.next_cursor}'))
+        self.assertEqual(list(page), [{'title': post.title} for post in self.posts[3:6]])
+        self.assertRaises(Http404, paginator.get_page_from_params, QueryDict('cursor=invalid'))
+
+
+class QueryPlanTest(TestCase):
+    """ Listing queries of posts, comments and votes must use indexes, without full table scan and filesort """
+    checked_tables = ['posts', 'comments', 'votes']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(username=f'user{i}', email=f'user{i}@gmail.com') for i in range(2)]
+        cls.categories = [create_category(f'Category{i}') for i in range(2)]
+        now = timezone.now()
+        Post.objects.bulk_create([
+            Post(title=f'Post{i}', content='Post text', author=cls.users[i % 2], category=cls.categories[i % 2],
+                 published_date=now - timedelta(minutes=i), last_change_date=now - timedelta(minutes=i))
+            for i in range(200)
+        ])
+        cls.post = Post.objects.first()
+        Comment.objects.bulk_create([
+            Comment(text=f'Comment{i}', author=cls.users[i % 2], post=cls.post,
+                    published_date=now - timedelta(minutes=i), last_change_date=now - timedelta(minutes=i))
+            for i in range(100)
+        ])
+
+    def get_plan_problems(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return [
+                    detail for *ids, detail in cursor.fetchall()
+                    if 'USE TEMP B-TREE' in detail or (
+                        detail.split(' ')[:2] in [['SCAN', table] for table in self.checked_tables]
+                        and 'INDEX' not in detail
+                    )
+                ]
+            if connection.vendor == 'mysql':
+                cursor.execute(f'EXPLAIN {sql}')
+                columns = [column[0] for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                return [
+                    row for row in rows if row['table'] in self.checked_tables
+                    and (row['type'] == 'ALL' or 'filesort' in (row['Extra'] or ''))
+                ]
+        self.skipTest(f'Query plans of {connection.vendor} are not checked')
+
+    def assertIndexedQueries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        checked = [
+            query['sql'] for query in queries if query['sql'].startswith('SELECT')
+            and any(f'{connection.ops.quote_name(table)}' in query['sql'] for table in self.checked_tables)
+        ]
+        self.assertTrue(checked, f'{url} made no listing queries')
+        for sql in checked:
+            problems = self.get_plan_problems(sql)
+            self.assertFalse(problems, f'{url}\n{sql}\n{problems}')
+        return response
+
+    def test_html_listings(self):
+        self.client.force_login(self.users[0])
+        response = self.assertIndexedQueries(reverse('main:homepage'))
+        self.assertIndexedQueries(reverse('main:homepage') + f'?cursor={response.context["page_obj"].next_cursor}')
+        self.assertIndexedQueries(reverse('forum:category_posts', kwargs={'category_title': 'Category1'}))
+        self.assertIndexedQueries(reverse('users:profile', kwargs={'username': 'user1'}))
+        response = self.assertIndexedQueries(reverse('forum:post_page', kwargs={'post_pk': self.post.pk}))
+        self.assertIndexedQueries(
+            reverse('forum:post_page', kwargs={'post_pk': self.post.pk}) +
+            f'?cursor={response.context["page_obj"].previous_cursor}'
+        )
+
+    def test_api_listings(self):
+        # Query string keeps responses cached by other tests away
+        self.assertIndexedQueries(reverse('api:posts_all') + '?page_size=20')
+        response = self.client.get(reverse('api:posts_all') + '?page_size=20&cursor=')
+        self.assertIndexedQueries(json.loads(response.content)['next'])
+        self.assertIndexedQueries(reverse('api:post_comments', kwargs={'pk': self.post.pk}) + '?page_size=20')
+        self.assertIndexedQueries(reverse('api:category_posts', kwargs={'pk': self.categories[0].pk}) + '?page_size=20')
+        self.assertIndexedQueries(reverse('api:user_posts', kwargs={'username': 'user0'}) + '?page_size=20')
+
+
+class CountCacheTest(TransactionTestCase):
+    """ Counts are cached only outside transactions, so TestCase can not be used """
+
+    def setUp(self) -> None:
+        self.user = create_user()
+        self.category = create_category('Category1')
+        self.other_category = create_category('Category2')
+        self.keys = [
+            get_count_key(Post), get_count_key(Post, category_id=self.category.pk),
+            get_count_key(Post, category_id=self.other_category.pk), get_count_key(Post, author_id=self.user.pk)
+        ]
+        cache.delete_many(self.keys)
+
+    def tearDown(self) -> None:
+        cache.delete_many(self.keys)
+
+    def test_counts_follow_posts(self):
+        all_posts, category_posts, other_category_posts, author_posts = [
+            (Post.objects.all(), self.keys[0]),
+            (Post.objects.filter(category=self.category), self.keys[1]),
+            (Post.objects.filter(category=self.other_category), self.keys[2]),
+            (Post.objects.filter(author=self.user), self.keys[3]),
+        ]
+        for queryset, key in [all_posts, category_posts, other_category_posts, author_posts]:
+            self.assertEqual(get_count(queryset, key), 0)
+
+        post = create_post(author=self.user, category=self.category)
+        create_post(author=self.user, category=self.category)
+        post.category = self.other_category
+        post.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [get_count(*args) for args in [all_posts, category_posts, other_category_posts, author_posts]],
+                [2, 1, 1, 2]
+            )
+
+        post.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [get_count(*args) for args in [all_posts, category_posts, other_category_posts, author_posts]],
+                [1, 1, 0, 1]
+            )
+
+    def test_paginator_uses_cached_count(self):
+        post = create_post(author=self.user, category=self.category)
+        paginator = KeysetPaginator(Post.objects.all(), 10, count_key=self.keys[0])
+        self.assertEqual(paginator.count, 1)
+        paginator = KeysetPaginator(Post.objects.all(), 10, count_key=self.keys[0])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(paginator.page(1).object_list), [post])
+            self.assertEqual(paginator.count, 1)
+
+
+class TwoTierCacheTest(TransactionTestCase):
+    """ Two nodes share remote locmem cache and local invalidation channel like two processes share redis """
+
+    def setUp(self) -> None:
+        self.nodes = [self.create_cache(f'node{i}') for i in range(2)]
+
+    def tearDown(self) -> None:
+        self.nodes[0].clear()
+
+    @staticmethod
+    def create_cache(node, **options):
+        return TwoTierCache('two-tier-test', {'OPTIONS': {
+            'REMOTE_BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'INVALIDATION_CHANNEL': 'project.cache_backends.LocalInvalidationChannel',
+            'CHANNEL_NAME': 'two-tier-test', 'NODE': node, 'LOCAL_KEY_PREFIXES': ['key'], **options
+        }})
+
+    def test_reads_are_served_by_local_tier(self):
+        first, second = self.nodes
+        first.set('key', {'value': 1})
+        self.assertEqual(second.get('key'), {'value': 1})
+        value = second.get('key')
+        value['value'] = 2
+        self.assertEqual(second.get('key'), {'value': 1})
+        self.assertEqual(second.get('key_missing', 'default'), 'default')
+        self.assertEqual(
+            {name: value for name, value in second.get_stats().items() if name.endswith(('hits', 'misses'))},
+            {'local_hits': 2, 'local_misses': 2, 'remote_hits': 1, 'remote_misses': 1}
+        )
+
+    def test_writes_invalidate_other_nodes(self):
+        first, second = self.nodes
+        first.set_many({'key': 1, 'counter': 1})
+        self.assertEqual(second.get_many(['key', 'counter']), {'key': 1, 'counter': 1})
+
+        first.set('key', 2)
+        first.incr('counter')
+        self.assertEqual(second.get_many(['key', 'counter']), {'key': 2, 'counter': 2})
+
+        first.delete('key')
+        self.assertIsNone(second.get('key'))
+        first.clear()
+        self.assertIsNone(second.get('counter'))
+
+    def test_remote_keys_are_seen_immediately(self):
+        # Separate channel loses every invalidation message
+        first = self.nodes[0]
+        second = self.create_cache('lost-messages', CHANNEL_NAME='two-tier-lost')
+        first.set_many({'key': 1, 'versions:posts': 1})
+        self.assertEqual(second.get_many(['key', 'versions:posts']), {'key': 1, 'versions:posts': 1})
+
+        first.set('key', 2)
+        first.incr('versions:posts')
+        self.assertEqual(second.get('versions:posts'), 2)
+        self.assertTrue(second.add('locks:key', 1))
+        self.assertFalse(first.add('locks:key', 1))
+        # Local value waits for invalidation or LOCAL_TIMEOUT
+        self.assertEqual(second.get('key'), 1)
+        self.assertEqual(second.get_stats()['local_keys'], 1)
+
+    def test_local_tier_size_is_bounded(self):
+        node = self.create_cache('small', LOCAL_MAX_SIZE=1000)
+        for i in range(10):
+            node.set(f'key{i}', 'x' * 200)
+            node.get(f'key{i}')
+
+        stats = node.get_stats()
+        self.assertLessEqual(stats['local_size'], 1000)
+        self.assertEqual(stats['local_keys'] + stats['evictions'], 10)
+        # Evicted keys are read from the remote tier
+        self.assertEqual(node.get('key0'), 'x' * 200)
+
+    def test_categories_are_cached(self):
+        create_category('Category1')
+        get_categories()
+        with self.assertNumQueries(0):
+            self.assertEqual([category.title for category in get_categories()], ['Category1'])
+
+        create_category('Category2')
+        self.assertCountEqual([category.title for category in get_categories()], ['Category1', 'Category2'])
+
+
+class StampedeProtectionTest(TransactionTestCase):
+    threads_amount = 8
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.computed = 0
+
+    def compute(self):
+        self.computed += 1
+        time.sleep(0.2)
+        return f'value{self.computed}'
+
+    def get_concurrently(self):
+        barrier = Barrier(self.threads_amount)
+        values = []
+
+        def get():
+            barrier.wait()
+            values.append(get_or_compute('key', self.compute, 60))
+
+        threads = [Thread(target=get) for i in range(self.threads_amount)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return values
+
+    def test_missing_value_is_computed_once(self):
+        self.assertEqual(self.get_concurrently(), ['value1'] * self.threads_amount)
+        self.assertEqual(self.computed, 1)
+
+    def test_expired_value_is_recomputed_once_and_served_meanwhile(self):
+        cache.set('key', ('old', time.time() - 1, 0.2), 60)
+        values = self.get_concurrently()
+
+        self.assertEqual(self.computed, 1)
+        self.assertEqual(sorted(values), ['old'] * (self.threads_amount - 1) + ['value1'])
+        self.assertEqual(get_or_compute('key', self.compute, 60), 'value1')
+
+    def test_early_expiration(self):
+        cache.set('key', ('old', time.time() + 1, 10), 60)
+        with mock.patch('forum.cache.random.random', return_value=0.01):
+            self.assertEqual(get_or_compute('key', self.compute, 60), 'old')
+        with mock.patch('forum.cache.random.random', return_value=0.99):
+            self.assertEqual(get_or_compute('key', self.compute, 60), 'value1')
+
+    def test_post_page_is_cached(self):
+        user = create_user()
+        post = create_post(author=user)
+        url = reverse('forum:post_page', kwargs={'post_pk': post.pk})
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), post.title)
+        create_comment(author=user, post=post, text='New comment')
+        self.assertContains(self.client.get(url), 'New comment')
+
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class ExportCommandTest(TestCase):
+    def test_export_in_chunks(self):
+        user = create_user()
+        posts = [create_post(user, category=create_category(f'Category{i}')) for i in range(3)]
+        comment = create_comment(user, posts[0], text='Тест')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'posts.ndjson.gz')
+            with CaptureQueriesContext(connection) as queries:
+                call_command('export_forum', 'posts', output=path, gzip=True, chunk_size=2)
+            # Two full chunks and empty one
+            self.assertEqual(len(queries), 3)
+            with gzip.open(path, 'rt') as output:
+                self.assertEqual([json.loads(line)['id'] for line in output], [post.pk for post in posts])
+
+            path = os.path.join(directory, 'comments.ndjson')
+            call_command('export_forum', 'comments', output=path, since='2000-01-01T00:00:00')
+            with open(path, encoding='utf-8') as output:
+                self.assertEqual([json.loads(line)['text'] for line in output], [comment.text])
+
+        with self.assertRaises(CommandError):
+            call_command('export_forum', 'votes', since='2000-01-01')
+
+
+@override_settings(VOTES_BUFFER_BACKEND='forum.vote_buffer.LocalVoteBuffer')
+class VoteBufferTest(TestCase):
+    def setUp(self) -> None:
+        self.user = create_user()
+        self.voter = create_user(username='voter', email='voter@gmail.com')
+        self.post = create_post(author=self.user)
+        self.buffer = get_vote_buffer()
+
+    def test_toggle_is_not_written_before_flush(self):
+        create_vote(self.voter, self.post, Vote.DISLIKE)
+        self.post.refresh_from_db()
+        self.assertEqual(self.buffer.toggle(self.post, self.voter, Vote.LIKE), Vote.LIKE)
+        self.assertEqual(self.buffer.toggle(self.post, self.user, Vote.LIKE), Vote.LIKE)
+        self.assertEqual(self.buffer.get_counts(self.post), (2, 0))
+        self.assertEqual(Vote.objects.for_object(self.post).get().value, Vote.DISLIKE)
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count), (2, 0))
+        self.assertEqual(set(Vote.objects.for_object(self.post).values_list('user', 'value')),
+                         {(self.user.pk, Vote.LIKE), (self.voter.pk, Vote.LIKE)})
+        self.assertEqual(self.buffer.get_counts(self.post), (2, 0))
+
+    def test_toggle_twice_removes_vote(self):
+        create_vote(self.voter, self.post, Vote.LIKE)
+        self.post.refresh_from_db()
+        self.assertIsNone(self.buffer.toggle(self.post, self.voter, Vote.LIKE))
+        self.assertEqual(self.buffer.get_counts(self.post), (0, 0))
+        self.buffer.flush()
+        self.assertFalse(Vote.objects.all())
+
+    def test_redis_flush_lock_is_released_by_its_holder(self):
+        client = mock.Mock()
+        redis_buffer = RedisVoteBuffer(client=client)
+        client.set.return_value = True
+        token = redis_buffer.acquire_flush_lock()
+        self.assertEqual(client.set.call_args.args[1], token)
+
+        redis_buffer.release_flush_lock(token)
+        client.register_script.return_value.assert_called_with(keys=[redis_buffer._flush_lock_key], args=[token])
+        client.delete.assert_not_called()
+
+        client.set.return_value = None
+        self.assertIsNone(redis_buffer.acquire_flush_lock())
+
+    def test_claimed_votes_are_flushed_after_crash(self):
+        self.buffer.toggle(self.post, self.voter, Vote.LIKE)
+        # Flush crashed after claiming votes, new vote of the same user is based on claimed one
+        self.buffer.claim()
+        self.assertIsNone(self.buffer.toggle(self.post, self.voter, Vote.LIKE))
+        self.buffer.toggle(self.post, self.user, Vote.DISLIKE)
+        self.assertEqual(self.buffer.get_counts(self.post), (0, 1))
+
+        self.buffer.flush()
+        self.assertEqual(Vote.objects.for_object(self.post).get(user=self.voter).value, Vote.LIKE)
+        self.buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count), (0, 1))
+        self.assertEqual(list(Vote.objects.for_object(self.post).values_list('user', 'value')),
+                         [(self.user.pk, Vote.DISLIKE)])
+
+    def test_user_values_include_buffered_votes(self):
+        create_vote(self.voter, self.post, Vote.LIKE)
+        comment = create_comment(author=self.user, post=self.post)
+        self.buffer.toggle(self.post, self.voter, Vote.LIKE)
+        self.buffer.toggle(comment, self.voter, Vote.DISLIKE)
+        comment_type_id = ContentType.objects.get_for_model(Comment).pk
+        self.assertEqual(self.buffer.get_user_values(self.voter, [self.post, comment]),
+                         {(comment_type_id, comment.pk): Vote.DISLIKE})
@@ -1,12 +1,50 @@
-from .models import Category
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from .cache import get_categories
+from .models import Vote
+from .vote_buffer import get_vote_buffer
 
 
 class CategoryContextMixin:
 	def get_category_context(self, **kwargs):
 		context = kwargs
-		context['categories'] = Category.objects.all()
+		context['categories'] = get_categories()
 
 		if 'selected_category' not in context:
 			context['selected_category'] = None
 
 		return context
+
+
+def attach_user_votes(user, objects):
+	"""
+	Set my_vote attribute of posts and comments to 'like', 'dislike' or None.
+	Votes of the whole page are read in one query, nothing is read for anonymous user
+	"""
+	objects = [obj for obj in objects if obj is not None]
+	values = {}
+
+	if user.is_authenticated and objects:
+		if settings.VOTES_WRITE_BEHIND:
+			values = get_vote_buffer().get_user_values(user, objects)
+		else:
+			values = Vote.objects.get_user_values(user, objects)
+
+	for obj in objects:
+		value = values.get((ContentType.objects.get_for_model(obj).pk, obj.pk))
+		obj.my_vote = Vote.STATUSES.get(value)
+
+	return objects
+
+
+def get_user_votes(user, model, pks):
+	""" Return {pk: 'like' or 'dislike'} of user votes on rows of model, for rows which are not model instances """
+	if not user.is_authenticated or not pks:
+		return {}
+
+	object_ids = {ContentType.objects.get_for_model(model).pk: set(pks)}
+	if settings.VOTES_WRITE_BEHIND:
+		values = get_vote_buffer().get_user_values_by_ids(user, object_ids)
+	else:
+		values = Vote.objects.get_user_values_by_ids(user, object_ids)
+	return {object_id: Vote.STATUSES.get(value) for (content_type_id, object_id), value in values.items()}
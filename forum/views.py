@@ -1,5 +1,5 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 from django.http import HttpResponseRedirect
@@ -12,7 +12,10 @@ from django.views.generic.edit import FormMixin
 from .models import Post, Comment, Category
 from .forms import CreateAndEditPostForm, CommentForm
 from django.contrib import messages
-from .utils import CategoryContextMixin
+from .cache import cache_response, get_categories, get_listing_version_key, get_version_key
+from .counts import get_count_key
+from .pagination import KeysetPaginator, KeysetPaginationMixin
+from .utils import CategoryContextMixin, attach_user_votes
 
 
 @method_decorator(login_required, name='post')
@@ -32,6 +35,11 @@ class PostPageView(FormMixin, DetailView):
         else:
             return self.form_invalid(form)
 
+    def get_version_keys(self):
+        post_id = self.kwargs[self.pk_url_kwarg]
+        return [get_version_key(Post, pk=post_id), get_version_key(Comment, post_id=post_id)]
+
+    @cache_response
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
         context = self.get_context_data(object=self.object)
@@ -39,15 +47,20 @@ class PostPageView(FormMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super(PostPageView, self).get_context_data(**kwargs)
-        context['paginator'] = Paginator(
-            self.object.comment_set.all().select_related('author').prefetch_related('likes', 'dislikes'),
-            self.paginate_by
+        context['paginator'] = KeysetPaginator(
+            self.object.comment_set.all().select_related('author'),
+            self.paginate_by,
+            count_key=get_count_key(Comment, post_id=self.object.pk)
         )
-        context['page_obj'] = self.get_page_obj(context['paginator'], self.request.GET.get('page', 1))
+        context['page_obj'] = self.get_page_obj(context['paginator'], self.request.GET)
+        context['page_obj'].object_list = attach_user_votes(
+            self.request.user, [self.object, *context['page_obj'].object_list]
+        )[1:]
+        context['fragment_timeout'] = settings.FRAGMENT_CACHE_TIMEOUT
         return context
 
-    def get_page_obj(self, paginator, page_number):
-        page_obj = paginator.page(page_number)
+    def get_page_obj(self, paginator, params):
+        page_obj = paginator.get_page_from_params(params)
         return page_obj
 
     def form_valid(self, form):
@@ -149,19 +162,32 @@ class CommentDeleteView(DeleteView):
         return HttpResponseRedirect(self.object.get_absolute_url())
 
 
-class CategoryPostsView(CategoryContextMixin, ListView):
+class CategoryPostsView(KeysetPaginationMixin, CategoryContextMixin, ListView):
     context_object_name = 'posts'
     template_name = 'index.html'
     paginate_by = 30
 
     def get_queryset(self):
-        return Post.objects.filter(
-            category__title=self.kwargs['category_title'], published_date__lte=timezone.now()
-        ).values('title', 'pk')
+        self.category = get_object_or_404(Category, title=self.kwargs['category_title'])
+        return Post.objects.filter(category=self.category, published_date__lte=timezone.now()).values('title', 'pk')
+
+    def get_count_key(self):
+        return get_count_key(Post, category_id=self.category.pk)
+
+    def get_version_keys(self):
+        """ Category is found among cached categories, so cached page is served without queries """
+        category_ids = [
+            category.pk for category in get_categories() if category.title == self.kwargs['category_title']
+        ]
+        return [get_listing_version_key(category_id=category_id) for category_id in category_ids] + \
+            [get_version_key(Category)]
+
+    @cache_response
+    def get(self, request, *args, **kwargs):
+        return super(CategoryPostsView, self).get(request, *args, **kwargs)
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(CategoryPostsView, self).get_context_data(**kwargs)
-        category_context = self.get_category_context(
-            selected_category=get_object_or_404(Category, title=self.kwargs['category_title']))
+        category_context = self.get_category_context(selected_category=self.category)
         context = dict(list(context.items()) + list(category_context.items()))
         return context
@@ -0,0 +1,353 @@
+import functools
+import secrets
+import threading
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .cache import bump_rated_versions
+from .models import Vote, get_object_ids_by_content_type
+
+NO_VOTE = 0
+FLUSH_BATCH_SIZE = 1000
+FLUSH_LOCK_TIMEOUT = 60
+
+
+class BaseVoteBuffer:
+    """
+    Keeps votes which are not written to the database yet.
+    Pending votes of post or comment are stored per user as (value, base value), where base value is the vote
+    which database has, or will have after claimed votes are flushed. NO_VOTE stands for removed vote.
+
+    Flush claims pending votes and releases them only after they are written, so votes claimed by crashed flush
+    are written by the next one. Buffer keeps final values instead of toggles, so writing them twice is harmless.
+    """
+
+    def record(self, content_type_id, object_id, user_id, value, db_value=None):
+        """
+        Toggle buffered vote of user and return new value.
+        Return None when there is no buffered vote and db_value is not given
+        """
+        raise NotImplementedError
+
+    def get_pending(self, content_type_id, object_id):
+        """ Return list of (value, base value) of claimed and pending votes """
+        raise NotImplementedError
+
+    def get_user_pending(self, content_type_id, object_ids, user_id):
+        """ Return {object_id: value} of user votes which are pending or claimed """
+        raise NotImplementedError
+
+    def claim(self):
+        """ Move pending votes to claimed ones and return [(content_type_id, object_id)] of all claimed votes """
+        raise NotImplementedError
+
+    def get_claimed(self, content_type_id, object_id):
+        """ Return {user_id: value} of claimed votes """
+        raise NotImplementedError
+
+    def release(self, content_type_id, object_id):
+        raise NotImplementedError
+
+    def acquire_flush_lock(self):
+        """ Return token of acquired lock, None when another flush holds it """
+        raise NotImplementedError
+
+    def release_flush_lock(self, token):
+        raise NotImplementedError
+
+    def toggle(self, obj, user, value):
+        """ Toggle vote like Vote.objects.toggle does. Database is read only if user has no buffered vote """
+        content_type_id = ContentType.objects.get_for_model(obj).pk
+        new_value = self.record(content_type_id, obj.pk, user.pk, value)
+
+        if new_value is None:
+            db_value = Vote.objects.for_object(obj).filter(user=user).values_list('value', flat=True).first()
+            new_value = self.record(content_type_id, obj.pk, user.pk, value, db_value or NO_VOTE)
+
+        return new_value or None
+
+    def toggle_many(self, user, operations):
+        """ Toggle [(post or comment, value)] votes of user in given order, database is read once per content type """
+        db_values = Vote.objects.get_user_values(user, [obj for obj, value in operations])
+
+        for obj, value in operations:
+            content_type_id = ContentType.objects.get_for_model(obj).pk
+            self.record(content_type_id, obj.pk, user.pk, value, db_values.get((content_type_id, obj.pk), NO_VOTE))
+
+    def get_user_values(self, user, objects):
+        """ Return {(content_type_id, object_id): value} like Vote.objects.get_user_values including buffered votes """
+        return self.get_user_values_by_ids(user, get_object_ids_by_content_type(objects))
+
+    def get_user_values_by_ids(self, user, object_ids):
+        """ Like get_user_values for {content_type_id: object ids} """
+        values = Vote.objects.get_user_values_by_ids(user, object_ids)
+
+        for content_type_id, ids in object_ids.items():
+            for object_id, value in self.get_user_pending(content_type_id, ids, user.pk).items():
+                if value == NO_VOTE:
+                    values.pop((content_type_id, object_id), None)
+                else:
+                    values[(content_type_id, object_id)] = value
+
+        return values
+
+    def get_counts(self, obj):
+        """ Return likes and dislikes of post or comment including votes which are not flushed yet """
+        likes, dislikes = obj.likes_count, obj.dislikes_count
+
+        for value, base_value in self.get_pending(ContentType.objects.get_for_model(obj).pk, obj.pk):
+            likes += (value == Vote.LIKE) - (base_value == Vote.LIKE)
+            dislikes += (value == Vote.DISLIKE) - (base_value == Vote.DISLIKE)
+
+        return likes, dislikes
+
+    def flush(self):
+        """ Write claimed votes to the database in batches, return amount of written votes """
+        token = self.acquire_flush_lock()
+        if token is None:
+            return 0
+
+        flushed = 0
+        try:
+            values = {}
+            claimed_keys = []
+
+            for content_type_id, object_id in self.claim():
+                for user_id, value in self.get_claimed(content_type_id, object_id).items():
+                    values[(content_type_id, object_id, user_id)] = value or None
+                claimed_keys.append((content_type_id, object_id))
+
+                if len(values) >= FLUSH_BATCH_SIZE:
+                    flushed += self._write(values, claimed_keys)
+                    values, claimed_keys = {}, []
+
+            flushed += self._write(values, claimed_keys)
+        finally:
+            self.release_flush_lock(token)
+
+        return flushed
+
+    def _write(self, values, claimed_keys):
+        Vote.objects.apply_values(values)
+        for content_type_id, object_id in claimed_keys:
+            self.release(content_type_id, object_id)
+
+        # Written votes changed counters shown by cached responses
+        object_ids = {}
+        for content_type_id, object_id in claimed_keys:
+            object_ids.setdefault(content_type_id, []).append(object_id)
+        for content_type_id, pks in object_ids.items():
+            bump_rated_versions(ContentType.objects.get_for_id(content_type_id).model_class(), pks)
+        return len(values)
+
+
+class LocalVoteBuffer(BaseVoteBuffer):
+    """ In-memory buffer of one process, used by tests """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._claimed = {}
+
+    def record(self, content_type_id, object_id, user_id, value, db_value=None):
+        key = (content_type_id, object_id)
+
+        with self._lock:
+            if user_id in self._pending.get(key, {}):
+                current_value, base_value = self._pending[key][user_id]
+            elif user_id in self._claimed.get(key, {}):
+                current_value = base_value = self._claimed[key][user_id][0]
+            elif db_value is not None:
+                current_value = base_value = db_value
+            else:
+                return None
+
+            new_value = NO_VOTE if current_value == value else value
+            self._pending.setdefault(key, {})[user_id] = (new_value, base_value)
+            return new_value
+
+    def get_pending(self, content_type_id, object_id):
+        key = (content_type_id, object_id)
+        with self._lock:
+            return list(self._claimed.get(key, {}).values()) + list(self._pending.get(key, {}).values())
+
+    def get_user_pending(self, content_type_id, object_ids, user_id):
+        values = {}
+        with self._lock:
+            for object_id in object_ids:
+                key = (content_type_id, object_id)
+                if user_id in self._pending.get(key, {}):
+                    values[object_id] = self._pending[key][user_id][0]
+                elif user_id in self._claimed.get(key, {}):
+                    values[object_id] = self._claimed[key][user_id][0]
+        return values
+
+    def claim(self):
+        with self._lock:
+            for key in list(self._pending):
+                if key not in self._claimed:
+                    self._claimed[key] = self._pending.pop(key)
+            return list(self._claimed)
+
+    def get_claimed(self, content_type_id, object_id):
+        with self._lock:
+            return {
+                user_id: value for user_id, (value, base_value) in
+                self._claimed.get((content_type_id, object_id), {}).items()
+            }
+
+    def release(self, content_type_id, object_id):
+        with self._lock:
+            self._claimed.pop((content_type_id, object_id), None)
+
+    def acquire_flush_lock(self):
+        return True if self._flush_lock.acquire(blocking=False) else None
+
+    def release_flush_lock(self, token):
+        self._flush_lock.release()
+
+
+class RedisVoteBuffer(BaseVoteBuffer):
+    """
+    Buffer in the redis server of default cache, shared by all workers.
+    Votes of post or comment are kept in hashes {user_id: 'value:base_value'},
+    sets of keys with pending and claimed votes are used by flush
+    """
+    record_script = """
+        local entry = redis.call('HGET', KEYS[1], ARGV[1])
+        local current_value, base_value
+        if entry then
+            local separator = string.find(entry, ':', 1, true)
+            current_value = tonumber(string.sub(entry, 1, separator - 1))
+            base_value = string.sub(entry, separator + 1)
+        else
+            local claimed = redis.call('HGET', KEYS[2], ARGV[1])
+            if claimed then
+                current_value = tonumber(string.sub(claimed, 1, string.find(claimed, ':', 1, true) - 1))
+            elseif ARGV[3] ~= '' then
+                current_value = tonumber(ARGV[3])
+            else
+                return false
+            end
+            base_value = tostring(current_value)
+        end
+        local new_value = tonumber(ARGV[2])
+        if current_value == new_value then
+            new_value = 0
+        end
+        redis.call('HSET', KEYS[1], ARGV[1], new_value .. ':' .. base_value)
+        redis.call('SADD', KEYS[3], ARGV[4])
+        return new_value
+    """
+    # Votes claimed by crashed flush are written first, new pending votes of the same object wait for next flush
+    claim_script = """
+        if redis.call('EXISTS', KEYS[1]) == 1 and redis.call('EXISTS', KEYS[2]) == 0 then
+            redis.call('RENAME', KEYS[1], KEYS[2])
+            redis.call('SADD', KEYS[4], ARGV[1])
+        end
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            redis.call('SREM', KEYS[3], ARGV[1])
+        end
+    """
+    # Lock which expired during flush could be taken by another worker, only the own lock is deleted
+    release_lock_script = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, cache_alias='default', client=None):
+        # Redis client of two-tier cache is taken from its remote tier
+        self._cache = getattr(caches[cache_alias], 'remote', caches[cache_alias])
+        self._client = client or self._cache._cache.get_client(write=True)
+        self._record = self._client.register_script(self.record_script)
+        self._claim = self._client.register_script(self.claim_script)
+        self._release_lock = self._client.register_script(self.release_lock_script)
+        self._pending_keys = self._cache.make_key('votes:pending_keys')
+        self._claimed_keys = self._cache.make_key('votes:claimed_keys')
+        self._flush_lock_key = self._cache.make_key('votes:flush_lock')
+
+    def _get_keys(self, content_type_id, object_id):
+        return (
+            self._cache.make_key(f'votes:pending:{content_type_id}:{object_id}'),
+            self._cache.make_key(f'votes:claimed:{content_type_id}:{object_id}'),
+        )
+
+    @staticmethod
+    def _parse(entry):
+        value, base_value = entry.split(b':')
+        return int(value), int(base_value)
+
+    def record(self, content_type_id, object_id, user_id, value, db_value=None):
+        pending_key, claimed_key = self._get_keys(content_type_id, object_id)
+        return self._record(
+            keys=[pending_key, claimed_key, self._pending_keys],
+            args=[user_id, value, '' if db_value is None else db_value, f'{content_type_id}:{object_id}']
+        )
+
+    def get_pending(self, content_type_id, object_id):
+        pipeline = self._client.pipeline(transaction=False)
+        for key in self._get_keys(content_type_id, object_id):
+            pipeline.hvals(key)
+        pending, claimed = pipeline.execute()
+        return [self._parse(entry) for entry in claimed + pending]
+
+    def get_user_pending(self, content_type_id, object_ids, user_id):
+        object_ids = list(object_ids)
+        pipeline = self._client.pipeline(transaction=False)
+        for object_id in object_ids:
+            pending_key, claimed_key = self._get_keys(content_type_id, object_id)
+            pipeline.hget(pending_key, user_id)
+            pipeline.hget(claimed_key, user_id)
+        entries = pipeline.execute()
+
+        values = {}
+        for i, object_id in enumerate(object_ids):
+            entry = entries[2 * i] or entries[2 * i + 1]
+            if entry:
+                values[object_id] = self._parse(entry)[0]
+        return values
+
+    def claim(self):
+        for member in self._client.smembers(self._pending_keys):
+            content_type_id, object_id = member.decode().split(':')
+            self._claim(
+                keys=[*self._get_keys(content_type_id, object_id), self._pending_keys, self._claimed_keys],
+                args=[member]
+            )
+        return [tuple(map(int, member.decode().split(':'))) for member in self._client.smembers(self._claimed_keys)]
+
+    def get_claimed(self, content_type_id, object_id):
+        claimed = self._client.hgetall(self._get_keys(content_type_id, object_id)[1])
+        return {int(user_id): self._parse(entry)[0] for user_id, entry in claimed.items()}
+
+    def release(self, content_type_id, object_id):
+        pipeline = self._client.pipeline()
+        pipeline.delete(self._get_keys(content_type_id, object_id)[1])
+        pipeline.srem(self._claimed_keys, f'{content_type_id}:{object_id}')
+        pipeline.execute()
+
+    def acquire_flush_lock(self):
+        token = secrets.token_hex(16)
+        if self._client.set(self._flush_lock_key, token, nx=True, ex=FLUSH_LOCK_TIMEOUT):
+            return token
+        return None
+
+    def release_flush_lock(self, token):
+        self._release_lock(keys=[self._flush_lock_key], args=[token])
+
+
+@functools.lru_cache
+def get_vote_buffer(backend=None):
+    return import_string(backend or settings.VOTES_BUFFER_BACKEND)()
+
+
+@receiver(setting_changed)
+def reset_vote_buffer(setting, **kwargs):
+    if setting in ('VOTES_BUFFER_BACKEND', 'CACHES'):
+        get_vote_buffer.cache_clear()
@@ -1,13 +1,22 @@
 from forum.tests import create_category
-from django.test import TestCase
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, RequestFactory
 from django.urls import reverse
 from freezegun import freeze_time
-from forum.tests import create_post
+from forum.cache import bump_rated_versions
+from forum.models import Post
+from forum.tests import create_post, create_comment, create_vote
 from users.tests import create_user
+from search.tests import SearchTestMixin
 
 
 class HomepageViewTest(TestCase):
     def setUp(self) -> None:
+        cache.clear()
         self.user = create_user()
         self.category = create_category('Category1')
 
@@ -30,15 +39,18 @@ class HomepageViewTest(TestCase):
                                  [{'pk': post_2.pk, 'title': post_2.title}, {'pk': post_1.pk, 'title': post_1.title}])
 
 
-class SearchViewTest(TestCase):
+class SearchViewTest(SearchTestMixin, TransactionTestCase):
+    """ MySQL full-text indexes see only committed rows """
+
     def setUp(self) -> None:
+        super(SearchViewTest, self).setUp()
         self.user = create_user()
         self.category = create_category('Category1')
 
     def test_search_without_category(self):
         create_post(author=self.user, category=self.category)
         post = create_post(author=self.user, category=self.category, title='Post2')
-        response = self.client.get(reverse('main:search_posts'), data={'q': 'st2'})
+        response = self.client.get(reverse('main:search_posts'), data={'q': 'post2'})
         self.assertQuerysetEqual(response.context['posts'], [{'title': 'Post2', 'pk': post.pk}])
 
     def test_search_with_category(self):
@@ -50,3 +62,82 @@ class SearchViewTest(TestCase):
             reverse('main:search_category_posts', kwargs={'category_title': category2.title}), data={'q': 'Test'}
         )
         self.assertQuerysetEqual(response.context['posts'], [{'title': post3.title, 'pk': post3.pk}])
+
+    def test_search_pages_keep_query(self):
+        posts = [create_post(author=self.user, category=self.category, title=f'Topic {i}') for i in range(35)]
+        response = self.client.get(reverse('main:search_posts'), data={'q': 'topic', 'page': 2})
+        self.assertEqual(len(response.context['posts']), 5)
+        self.assertContains(response, 'href="?q=topic&amp;page=1"')
+
+
+class AnonymousPageCacheTest(TransactionTestCase):
+    """ Versions of cached pages are bumped after commit """
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = create_user()
+        self.category = create_category('Category1')
+        self.post = create_post(author=self.user, category=self.category, title='First post')
+        self.urls = [
+            reverse('main:homepage'), reverse('forum:category_posts', kwargs={'category_title': self.category.title})
+        ]
+
+    def test_pages_are_cached_until_posts_change(self):
+        for url in self.urls:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertContains(self.client.get(url), 'First post')
+
+        create_post(author=self.user, category=self.category, title='Second post')
+        for url in self.urls:
+            self.assertContains(self.client.get(url), 'Second post')
+
+        self.category.title = 'Renamed'
+        self.category.save()
+        self.assertContains(self.client.get(self.urls[0]), 'Renamed')
+        self.assertEqual(self.client.get(self.urls[1]).status_code, 404)
+
+    def test_votes_do_not_drop_cached_listings(self):
+        for url in self.urls:
+            self.client.get(url)
+
+        create_vote(create_user('voter', 'voter@gmail.com'), self.post)
+        bump_rated_versions(Post, [self.post.pk])
+        for url in self.urls:
+            with self.assertNumQueries(0):
+                self.client.get(url)
+
+        self.post.title = 'Edited post'
+        self.post.save()
+        for url in self.urls:
+            self.assertContains(self.client.get(url), 'Edited post')
+
+    def test_post_page_shows_changed_author(self):
+        url = reverse('forum:post_page', kwargs={'post_pk': self.post.pk})
+        create_comment(author=self.user, post=self.post, text='First comment')
+        self.assertContains(self.client.get(url), self.user.username)
+
+        self.user.username = 'renamedUser'
+        self.user.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'renamedUser')
+        self.assertNotContains(response, 'testUser')
+
+    def test_post_page_has_no_csrf_token_for_anonymous(self):
+        response = self.client.get(reverse('forum:post_page', kwargs={'post_pk': self.post.pk}))
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+    def test_authenticated_users_and_pending_messages_bypass_cache(self):
+        self.client.get(self.urls[0])
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(self.urls[0]), 'Logout')
+        self.client.logout()
+
+        request = RequestFactory().get(self.urls[0])
+        storage, response = CookieStorage(request), HttpResponse()
+        storage.add(messages.INFO, 'Pending message')
+        storage.update(response)
+        self.client.cookies['messages'] = response.cookies['messages'].value
+        self.assertContains(self.client.get(self.urls[0]), 'Pending message')
+        self.assertNotContains(self.client.get(self.urls[0]), 'Pending message')
@@ -1,11 +1,17 @@
 from django.shortcuts import get_object_or_404, render
 from django.utils import timezone
+from django.utils.http import urlencode
 from forum.models import Post, Category
 from django.views.generic import ListView
+from forum.cache import cache_response, get_listing_version_key, get_version_key
+from forum.counts import get_count_key
+from forum.pagination import KeysetPaginationMixin
 from forum.utils import CategoryContextMixin
+from search import cache as search_cache
+from search.backends import get_posts_by_ids
 
 
-class HomepageView(CategoryContextMixin, ListView):
+class HomepageView(KeysetPaginationMixin, CategoryContextMixin, ListView):
     model = Post
     template_name = 'index.html'
     context_object_name = 'posts'
@@ -14,6 +20,16 @@ class HomepageView(CategoryContextMixin, ListView):
     def get_queryset(self):
         return Post.objects.filter(published_date__lte=timezone.now()).values('title', 'pk')
 
+    def get_count_key(self):
+        return get_count_key(Post)
+
+    def get_version_keys(self):
+        return [get_listing_version_key(), get_version_key(Category)]
+
+    @cache_response
+    def get(self, request, *args, **kwargs):
+        return super(HomepageView, self).get(request, *args, **kwargs)
+
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(HomepageView, self).get_context_data(**kwargs)
         category_context = self.get_category_context()
@@ -28,21 +44,29 @@ class SearchView(CategoryContextMixin, ListView):
     paginate_by = 30
 
     def get_queryset(self):
-        queryset = Post.objects.filter(
-            title__icontains=self.request.GET['q'], published_date__lte=timezone.now()
-        ).values('title', 'pk')
-
+        """ Ids of found posts ordered by relevance, posts are fetched only for the shown page """
+        self.category = None
         if 'category_title' in self.kwargs:
-            queryset = queryset.filter(category__title=self.kwargs['category_title'])
+            self.category = get_object_or_404(Category, title=self.kwargs['category_title'])
+
+        return search_cache.search(
+            self.request.GET.get('q', ''), category_id=self.category.pk if self.category else None
+        )
 
-        return queryset
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, post_ids, is_paginated = super(SearchView, self).paginate_queryset(queryset, page_size)
+        page.object_list = get_posts_by_ids(
+            Post.objects.filter(published_date__lte=timezone.now()).values('title', 'pk'), post_ids
+        )
+        page.query_string = f'{urlencode({"q": self.request.GET.get("q", "")})}&'
+        return paginator, page, page.object_list, is_paginated
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(SearchView, self).get_context_data(**kwargs)
         category_context = self.get_category_context()
 
-        if 'category_title' in self.kwargs:
-            category_context['selected_category'] = get_object_or_404(Category, title=self.kwargs['category_title'])
+        if self.category is not None:
+            category_context['selected_category'] = self.category
 
         context = dict(list(context.items()) + list(category_context.items()))
         return context
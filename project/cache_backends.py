@@ -0,0 +1,332 @@
+import os
+import pickle
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.utils.module_loading import import_string
+
+CLEAR_ALL = '*'
+
+
+class LocalTier:
+    """
+    LRU of pickled values bounded by their total size, values are unpickled on every get,
+    so callers never share mutable objects
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """ Return (True, value) or (False, None) when key is missing or expired """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            data, expires = entry
+            if expires < time.monotonic():
+                self._pop(key)
+                return False, None
+            self._entries.move_to_end(key)
+        return True, pickle.loads(data)
+
+    def set(self, key, value, timeout=None):
+        """ Local entry lives at most tier timeout, so missed invalidation is corrected by the remote tier """
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_size:
+            self.delete(key)
+            return
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (data, time.monotonic() + timeout)
+            self._size += len(data)
+            while self._size > self.max_size:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LocalInvalidationChannel:
+    """ Channel between nodes of one process, stands in for redis channel in tests """
+    _channels = {}
+    _lock = threading.Lock()
+
+    def __init__(self, name, remote, callback):
+        self.callback = callback
+        with self._lock:
+            self._channels.setdefault(name, weakref.WeakSet()).add(self)
+        self.name = name
+
+    def publish(self, key):
+        with self._lock:
+            channels = list(self._channels.get(self.name, []))
+        for channel in channels:
+            if channel is not self:
+                channel.callback(key)
+
+
+class RedisInvalidationChannel:
+    """
+    Redis pub/sub channel listened by daemon thread of the process.
+    Messages carry process id of sender, so process does not drop its own keys twice
+    """
+    listen_timeout = 1.0
+
+    def __init__(self, name, remote, callback):
+        self.name = name
+        self.callback = callback
+        self._remote = remote
+        threading.Thread(target=self.listen, daemon=True).start()
+
+    def get_client(self):
+        return self._remote._cache.get_client(write=True)
+
+    def subscribe(self):
+        pubsub = self.get_client().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.name)
+        return pubsub
+
+    def listen(self):
+        pid = os.getpid()
+        pubsub = None
+        while True:
+            try:
+                pubsub = pubsub or self.subscribe()
+                message = pubsub.get_message(timeout=self.listen_timeout)
+            except Exception:
+                # Keys changed while connection was lost are not known, so everything is dropped
+                pubsub = None
+                self.callback(CLEAR_ALL)
+                time.sleep(self.listen_timeout)
+                continue
+
+            if message is not None:
+                sender_pid, key = message['data'].decode().split(':', 1)
+                if int(sender_pid) != pid:
+                    self.callback(key)
+
+    def publish(self, key):
+        self.get_client().publish(self.name, f'{os.getpid()}:{key}')
+
+
+class Node:
+    """ Local tier, invalidation channel and statistics shared by cache instances of all threads of the process """
+    _nodes = {}
+    _lock = threading.Lock()
+
+    def __init__(self, channel_class, channel_name, remote, max_size, timeout):
+        self.local = LocalTier(max_size, timeout)
+        self.stats = {'local_hits': 0, 'local_misses': 0, 'remote_hits': 0, 'remote_misses': 0}
+        self.stats_lock = threading.Lock()
+        self.channel = import_string(channel_class)(channel_name, remote, self.invalidate)
+
+    @classmethod
+    def get(cls, name, *args):
+        """ Nodes are looked up by process id, so forked worker does not use node of its parent """
+        key = (name, os.getpid())
+        with cls._lock:
+            if key not in cls._nodes:
+                cls._nodes[key] = cls(*args)
+            return cls._nodes[key]
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def invalidate(self, key):
+        if key == CLEAR_ALL:
+            self.local.clear()
+        else:
+            self.local.delete(key)
+
+
+class TwoTierCache(BaseCache):
+    """
+    Bounded in-process LRU in front of remote cache, e.g. redis. Reads are served by the local tier when possible,
+    writes go to the remote tier and drop the key from local tiers of every process through invalidation channel.
+    Other processes may see old value until invalidation message arrives, at most LOCAL_TIMEOUT seconds.
+
+    Only keys starting with one of LOCAL_KEY_PREFIXES use the local tier. They should name values which do not
+    change under the key, e.g. responses keyed by versions. Versions, locks and counters always go to the remote tier,
+    so every process sees their changes immediately.
+
+    OPTIONS: REMOTE_BACKEND, LOCAL_KEY_PREFIXES, LOCAL_MAX_SIZE in bytes, LOCAL_TIMEOUT, INVALIDATION_CHANNEL class,
+    CHANNEL_NAME and NODE, name of local tier which tests use to have several nodes in one process.
+    Other options are given to the remote backend
+    """
+
+    def __init__(self, location, params):
+        params = dict(params)
+        options = dict(params.pop('OPTIONS', None) or {})
+        remote_backend = options.pop('REMOTE_BACKEND', 'django.core.cache.backends.redis.RedisCache')
+        self.local_key_prefixes = tuple(options.pop('LOCAL_KEY_PREFIXES', ()))
+        local_max_size = options.pop('LOCAL_MAX_SIZE', 16 * 1024 * 1024)
+        local_timeout = options.pop('LOCAL_TIMEOUT', 60)
+        channel_class = options.pop('INVALIDATION_CHANNEL', 'project.cache_backends.RedisInvalidationChannel')
+        channel_name = options.pop('CHANNEL_NAME', 'cache:invalidations')
+        node_name = options.pop('NODE', channel_name)
+
+        super(TwoTierCache, self).__init__(params)
+        self.remote = import_string(remote_backend)(location, {**params, 'OPTIONS': options})
+        self._node_args = (node_name, channel_class, channel_name, self.remote, local_max_size, local_timeout)
+
+    @property
+    def node(self):
+        return Node.get(*self._node_args)
+
+    @property
+    def local(self):
+        return self.node.local
+
+    def is_local(self, key):
+        return key.startswith(self.local_key_prefixes)
+
+    def make_key(self, key, version=None):
+        return self.remote.make_key(key, version)
+
+    def validate_key(self, key):
+        self.remote.validate_key(key)
+
+    def get_stats(self):
+        """ Hits and misses of both tiers in this process, remote tier is asked only on local misses """
+        node = self.node
+        with node.stats_lock:
+            stats = dict(node.stats)
+        return {
+            **stats, 'local_size': node.local.size, 'local_keys': len(node.local), 'evictions': node.local.evictions
+        }
+
+    def _changed(self, keys, version=None):
+        """ Drop given keys from local tiers of every process, keys of the remote tier only are not sent """
+        node = self.node
+        for key in keys:
+            if self.is_local(key):
+                full_key = self.make_and_validate_key(key, version)
+                node.invalidate(full_key)
+                node.channel.publish(full_key)
+
+    def get(self, key, default=None, version=None):
+        node = self.node
+        if not self.is_local(key):
+            value = self.remote.get(key, self._missing_key, version)
+            node.count('remote_misses' if value is self._missing_key else 'remote_hits')
+            return default if value is self._missing_key else value
+
+        full_key = self.make_and_validate_key(key, version)
+        found, value = node.local.get(full_key)
+        if found:
+            node.count('local_hits')
+            return value
+        node.count('local_misses')
+
+        value = self.remote.get(key, self._missing_key, version)
+        if value is self._missing_key:
+            node.count('remote_misses')
+            return default
+        node.count('remote_hits')
+        node.local.set(full_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        node = self.node
+        found = {}
+        missing = {}
+        for key in keys:
+            if not self.is_local(key):
+                missing[key] = None
+                continue
+            full_key = self.make_and_validate_key(key, version)
+            is_found, value = node.local.get(full_key)
+            if is_found:
+                found[key] = value
+                node.count('local_hits')
+            else:
+                missing[key] = full_key
+                node.count('local_misses')
+
+        if missing:
+            remote_found = self.remote.get_many(list(missing), version)
+            for key, full_key in missing.items():
+                if key in remote_found:
+                    node.count('remote_hits')
+                    found[key] = remote_found[key]
+                    if full_key is not None:
+                        node.local.set(full_key, remote_found[key])
+                else:
+                    node.count('remote_misses')
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.remote.set(key, value, timeout, version)
+        self._changed([key], version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.remote.add(key, value, timeout, version)
+        if added:
+            self._changed([key], version)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.remote.set_many(data, timeout, version)
+        self._changed(data, version)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.remote.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        deleted = self.remote.delete(key, version)
+        self._changed([key], version)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        self.remote.delete_many(keys, version)
+        self._changed(keys, version)
+
+    def has_key(self, key, version=None):
+        if self.is_local(key) and self.local.get(self.make_and_validate_key(key, version))[0]:
+            return True
+        return self.remote.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.remote.incr(key, delta, version)
+        self._changed([key], version)
+        return value
+
+    def clear(self):
+        self.remote.clear()
+        node = self.node
+        node.invalidate(CLEAR_ALL)
+        node.channel.publish(CLEAR_ALL)
+
+    def close(self, **kwargs):
+        self.remote.close(**kwargs)
@@ -15,5 +15,11 @@ app.conf.beat_schedule = {
     'delete_expired_email_codes': {
         'task': 'users.tasks.delete_expired_email_codes',
         'schedule': 60.0,
-    }
+    },
 }
+
+if settings.VOTES_WRITE_BEHIND:
+    app.conf.beat_schedule['flush_vote_buffer'] = {
+        'task': 'forum.tasks.flush_vote_buffer',
+        'schedule': settings.VOTES_BUFFER_FLUSH_INTERVAL,
+    }
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
     'main',
     'forum',
     'users',
+    'search',
+    'rest_api',
     'debug_toolbar',
     'captcha',
     'ckeditor',
@@ -157,13 +159,58 @@ LOGIN_URL = 'users:login'
 
 # Cache
 
+# Local tier of every process is in front of redis, changed keys are dropped from it through redis pub/sub.
+# Only values which do not change under their keys use it, versions, locks and counters are read from redis
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'BACKEND': 'project.cache_backends.TwoTierCache',
         'LOCATION': f'redis://{os.getenv("REDIS_HOST")}:{os.getenv("REDIS_PORT")}/1',
+        'OPTIONS': {
+            'REMOTE_BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCAL_KEY_PREFIXES': [
+                'responses:', 'categories:', 'template.cache.', 'search:results:', 'search:suggestions:change:'
+            ],
+            'LOCAL_MAX_SIZE': 32 * 1024 * 1024,
+            'LOCAL_TIMEOUT': 30,
+        },
     }
 }
 
+# Responses cache
+# Responses are cached per user under versions of shown rows, which are bumped by writes, see forum.cache
+RESPONSE_CACHE_TIMEOUT = 60 * 10
+# Expired value is recomputed by one process holding lock, others serve it for stale timeout meanwhile.
+# Value is recomputed before expiry with probability growing with beta and compute time
+CACHE_LOCK_TIMEOUT = 10
+CACHE_STALE_TIMEOUT = 60
+CACHE_EARLY_EXPIRATION_BETA = 1.0
+# Template fragments of comments, their keys change with the comment and its author
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# Paginators counts
+# Counts of posts and comments are cached and updated on create and delete, counts of big listings are estimated
+COUNTS_CACHE_TIMEOUT = 60 * 60
+COUNTS_ESTIMATE_THRESHOLD = 100000
+
+# Search
+# None selects MySQL full-text search on MySQL and on-disk inverted index on other databases
+SEARCH_BACKEND = None
+SEARCH_RESULTS_LIMIT = 1000
+# Found ids are cached per query and category until posts of the category change
+SEARCH_CACHE_TIMEOUT = 60 * 60
+# Segment and change log of search.backends.InvertedIndexBackend
+SEARCH_INDEX_DIR = BASE_DIR / 'search_index'
+# Typeahead suggestions of post and category titles, kept in memory of every process
+SEARCH_SUGGESTIONS_LIMIT = 10
+SEARCH_SUGGESTIONS_SCAN_LIMIT = 200
+SEARCH_SUGGESTIONS_REFRESH_INTERVAL = 1
+
+# Votes write-behind buffer
+# Votes are kept in the cache and flushed to the database by celery beat
+VOTES_WRITE_BEHIND = False
+VOTES_BUFFER_BACKEND = 'forum.vote_buffer.RedisVoteBuffer'
+VOTES_BUFFER_FLUSH_INTERVAL = 5.0
+
 # Email config
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -222,13 +269,19 @@ CKEDITOR_CONFIGS = {
 }
 
 # Django rest framework
+# JSON is rendered and parsed by orjson when it is installed, by the standard json module otherwise
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-    )
+        'rest_api.renderers.FastJSONRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 if DEBUG:
     REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = (
-        'rest_framework.renderers.JSONRenderer', 'rest_framework.renderers.BrowsableAPIRenderer'
+        'rest_api.renderers.FastJSONRenderer', 'rest_framework.renderers.BrowsableAPIRenderer'
     )
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from forum.models import Post, Category
+from rest_api.pagination import CustomPagination
+from users.models import CustomUserModel
+
+
+class Command(BaseCommand):
+    help = 'Compare time of page number and cursor pages of posts at growing depth, seeded posts are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=20000, help='Amount of seeded posts')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=3, help='Best of given amount of runs is reported')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['posts'])
+            self.benchmark(options['page_size'], options['repeat'])
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def seed(amount):
+        author = CustomUserModel.objects.create(username='pagination_benchmark', email='benchmark@example.com')
+        category = Category.objects.create(title='Pagination benchmark')
+        now = timezone.now()
+        Post.objects.bulk_create([
+            Post(
+                title=f'Post {i}', content='Benchmark', author=author, category=category,
+                published_date=now - timedelta(seconds=i), last_change_date=now - timedelta(seconds=i)
+            )
+            for i in range(amount)
+        ], batch_size=1000)
+
+    def benchmark(self, page_size, repeat):
+        # Requests are built for allowed host, because cursor pagination returns absolute links
+        host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.*') or 'localhost'
+        factory = APIRequestFactory(SERVER_NAME=host)
+        queryset = Post.objects.select_related('author')
+        pages_amount = -(-queryset.count() // page_size)
+        depths = sorted({1, *(pages_amount * percent // 100 for percent in (10, 25, 50, 75)), pages_amount} - {0})
+
+        def get_page(params):
+            request = Request(factory.get('/api/posts/', {'page_size': page_size, **params}))
+            paginator = CustomPagination()
+            start = time.perf_counter()
+            page = paginator.paginate_queryset(queryset, request)
+            paginator.get_paginated_response([obj.pk for obj in page])
+            return time.perf_counter() - start, paginator
+
+        # Cursors of deep pages can only be reached by walking from the first page
+        cursors = {}
+        cursor = ''
+        for number in range(1, pages_amount + 1):
+            cursors[number] = cursor
+            paginator = get_page({'cursor': cursor})[1]
+            next_link = paginator.cursor_pagination.get_next_link()
+            if next_link is None:
+                break
+            cursor = Request(factory.get(next_link)).query_params['cursor']
+
+        self.stdout.write(f'{"page":>8} {"page number, ms":>16} {"cursor, ms":>12}')
+        for number in depths:
+            page_number_time = min(get_page({'page': number})[0] for i in range(repeat))
+            cursor_time = min(get_page({'cursor': cursors[number]})[0] for i in range(repeat))
+            self.stdout.write(f'{number:>8} {page_number_time * 1000:>16.2f} {cursor_time * 1000:>12.2f}')
@@ -0,0 +1,58 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from forum.models import Post, Category
+from rest_api import renderers
+from rest_api.views import PostAPI
+from users.models import CustomUserModel
+
+
+class Command(BaseCommand):
+    help = 'Compare stock and fast JSON renderers on a page of PostAPI.list, seeded posts are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--content-size', type=int, default=2000, help='Characters of content of every post')
+        parser.add_argument('--repeat', type=int, default=200, help='Best of given amount of runs is reported')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['page_size'], options['content_size'])
+            self.benchmark(options['page_size'], options['repeat'])
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def seed(amount, content_size):
+        author = CustomUserModel.objects.create(username='renderer_benchmark', email='benchmark@example.com')
+        category = Category.objects.create(title='Renderer benchmark')
+        content = ('<p>Benchmark текст</p>' * content_size)[:content_size]
+        Post.objects.bulk_create(
+            [Post(title=f'Post {i}', content=content, author=author, category=category) for i in range(amount)]
+        )
+
+    def benchmark(self, page_size, repeat):
+        host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.*') or 'localhost'
+        factory = APIRequestFactory(SERVER_NAME=host)
+        view = PostAPI.as_view({'get': 'list'})
+        data = view(factory.get('/api/posts/', {'page_size': page_size})).data
+
+        def measure(render):
+            times = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                render(data)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        stock_time = measure(JSONRenderer().render)
+        fast_time = measure(renderers.FastJSONRenderer().render)
+        size = len(JSONRenderer().render(data))
+
+        self.stdout.write(f'Page of {len(data["results"])} posts, {size / 1024:.0f} KiB of JSON')
+        self.stdout.write(f'{"renderer":>10} {"time, ms":>10}')
+        self.stdout.write(f'{"stock":>10} {stock_time * 1000:>10.3f}')
+        name = 'orjson' if renderers.orjson is not None else 'fallback'
+        self.stdout.write(f'{name:>10} {fast_time * 1000:>10.3f}')
@@ -0,0 +1,70 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from forum.models import Post, Category, Vote
+from rest_api.serializers import PostSerializer, PostValuesSerializer
+from users.models import CustomUserModel
+
+
+class Command(BaseCommand):
+    help = 'Compare model serializer and values() serializer of posts, seeded posts are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=10000, help='Amount of seeded posts')
+        parser.add_argument('--repeat', type=int, default=3, help='Best of given amount of runs is reported')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            author = self.seed(options['posts'])
+            self.benchmark(author, options['repeat'])
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def seed(amount):
+        author = CustomUserModel.objects.create(username='serializer_benchmark', email='benchmark@example.com')
+        category = Category.objects.create(title='Serializer benchmark')
+        Post.objects.bulk_create(
+            [Post(title=f'Post {i}', content='Benchmark', author=author, category=category) for i in range(amount)],
+            batch_size=1000
+        )
+        # Some posts have vote of the reader, so my_vote is not empty
+        Vote.objects.bulk_create(
+            [Vote(content_object=post, user=author, value=Vote.LIKE) for post in Post.objects.all()[:amount // 10]],
+            batch_size=1000
+        )
+        return author
+
+    def benchmark(self, author, repeat):
+        host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.*') or 'localhost'
+        factory = APIRequestFactory(SERVER_NAME=host)
+        request = Request(factory.get('/api/posts/'))
+        request.user = author
+        context = {'request': request}
+        renderer = JSONRenderer()
+
+        def serialize_models():
+            return PostSerializer(Post.objects.select_related('author'), many=True, context=context).data
+
+        def serialize_values():
+            rows = PostValuesSerializer.get_rows(Post.objects.all())
+            return PostValuesSerializer(rows, many=True, context=context).data
+
+        def measure(serialize):
+            start = time.perf_counter()
+            content = renderer.render(serialize())
+            return time.perf_counter() - start, content
+
+        rows = Post.objects.count()
+        self.stdout.write(f'{"serializer":>12} {"time, ms":>10} {"rows/s":>10}')
+        contents = []
+        for name, serialize in (('model', serialize_models), ('values', serialize_values)):
+            results = [measure(serialize) for i in range(repeat)]
+            best_time = min(result[0] for result in results)
+            contents.append(results[0][1])
+            self.stdout.write(f'{name:>12} {best_time * 1000:>10.2f} {rows / best_time:>10.0f}')
+
+        self.stdout.write(f'Rendered JSON is {"identical" if contents[0] == contents[1] else "DIFFERENT"}')
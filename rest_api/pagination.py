@@ -1,8 +1,64 @@
-from rest_framework.pagination import PageNumberPagination
+import functools
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from forum.pagination import CachedCountPaginator
+
+
+class PublishedCursorPagination(CursorPagination):
+	"""
+	Pages are filtered by published date of the last item instead of OFFSET and are not counted,
+	so every page costs the same. New posts and comments do not shift pages which are walked
+	"""
+	page_size = 50
+	page_size_query_param = 'page_size'
+	max_page_size = 100
+	ordering = ('-published_date', '-pk')
+
+	def get_ordering(self, request, queryset, view):
+		# Categories have no published date. Position is read from the first ordering field,
+		# values() rows have it under the column name, not as pk
+		if not any(field.name == 'published_date' for field in queryset.model._meta.get_fields()):
+			return ('-id',)
+		return super(PublishedCursorPagination, self).get_ordering(request, queryset, view)
 
 
 class CustomPagination(PageNumberPagination):
+	"""
+	Numbered pages, or cursor pages when cursor parameter is given, empty cursor stands for the first page.
+	Count of numbered pages is taken from the count cache under key returned by get_count_key() of the view
+	"""
 	page_size = 50
 	page_size_query_param = 'page_size'
 	max_page_size = 100
+	cursor_pagination_class = PublishedCursorPagination
+
+	def paginate_queryset(self, queryset, request, view=None):
+		self.cursor_pagination = None
+		if self.cursor_pagination_class.cursor_query_param in request.query_params:
+			self.cursor_pagination = self.cursor_pagination_class()
+			return self.cursor_pagination.paginate_queryset(queryset, request, view)
+
+		count_key = view.get_count_key() if hasattr(view, 'get_count_key') else None
+		self.django_paginator_class = functools.partial(CachedCountPaginator, count_key=count_key)
+		return super(CustomPagination, self).paginate_queryset(queryset, request, view)
 
+	def get_paginated_response(self, data):
+		if self.cursor_pagination is not None:
+			return self.cursor_pagination.get_paginated_response(data)
+		return super(CustomPagination, self).get_paginated_response(data)
+
+	def get_html_context(self):
+		if self.cursor_pagination is not None:
+			return self.cursor_pagination.get_html_context()
+		return super(CustomPagination, self).get_html_context()
+
+	def to_html(self):
+		if self.cursor_pagination is not None:
+			return self.cursor_pagination.to_html()
+		return super(CustomPagination, self).to_html()
+
+
+class SearchPagination(PageNumberPagination):
+	""" Numbered pages of search results ordered by relevance, which cursor can not follow """
+	page_size = 50
+	page_size_query_param = 'page_size'
+	max_page_size = 100
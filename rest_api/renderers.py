@@ -0,0 +1,48 @@
+from django.conf import settings
+from rest_framework import renderers, parsers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils import encoders
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+	"""
+	JSON renderer writing bytes straight with orjson when it is installed, otherwise it is the stock renderer.
+	Output is the same as of the stock renderer: Decimal, lazy strings and other types orjson does not know
+	are given to the encoder of rest framework, datetimes too, so they keep its format with milliseconds.
+	Indented output of browsable api is rendered by the stock renderer
+	"""
+	options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		is_stock_output = (
+			orjson is None or not self.compact or self.ensure_ascii or
+			self.get_indent(accepted_media_type, renderer_context or {}) is not None
+		)
+		if is_stock_output or data is None:
+			return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+		ret = orjson.dumps(data, default=encoders.JSONEncoder().default, option=self.options)
+		# Line and paragraph separators are escaped like the stock renderer does, so JSON is a javascript subset
+		if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+			ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+		return ret
+
+
+class FastJSONParser(parsers.JSONParser):
+	""" JSON parser reading bytes with orjson when it is installed, otherwise it is the stock parser """
+	renderer_class = FastJSONRenderer
+
+	def parse(self, stream, media_type=None, parser_context=None):
+		encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+		if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+			return super(FastJSONParser, self).parse(stream, media_type, parser_context)
+
+		try:
+			return orjson.loads(stream.read())
+		except (orjson.JSONDecodeError, UnicodeDecodeError) as error:
+			raise ParseError(f'JSON parse error - {error}')
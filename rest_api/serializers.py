@@ -1,7 +1,38 @@
+from html import unescape
+from django.db.models import F
+from django.db.models.functions import Left
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
 from rest_framework import serializers
 from forum.models import Post, Category, Comment
+from users.models import CustomUserModel
+from forum.utils import attach_user_votes, get_user_votes
 from django.utils import timezone
 
+EXCERPT_LENGTH = 200
+# Rich text of excerpt is cut in the database, markup takes part of it
+EXCERPT_SCAN_LENGTH = 2000
+
+
+class VoteListSerializer(serializers.ListSerializer):
+    """ Reads votes of request user for the whole page in one query """
+
+    def to_representation(self, data):
+        request = self.context.get('request')
+        if request is not None:
+            data = attach_user_votes(request.user, data)
+        return super(VoteListSerializer, self).to_representation(data)
+
+
+class MyVoteMixin:
+    def get_my_vote(self, obj):
+        request = self.context.get('request')
+        if request is None:
+            return None
+        if not hasattr(obj, 'my_vote'):
+            attach_user_votes(request.user, [obj])
+        return obj.my_vote
+
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -10,25 +41,21 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only = ['id', 'title']
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(MyVoteMixin, serializers.ModelSerializer):
     author_username = serializers.SerializerMethodField()
-    likes_amount = serializers.SerializerMethodField()
-    dislikes_amount = serializers.SerializerMethodField()
+    likes_amount = serializers.IntegerField(source='likes_count', read_only=True)
+    dislikes_amount = serializers.IntegerField(source='dislikes_count', read_only=True)
+    my_vote = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        exclude = ['likes', 'dislikes', 'author']
+        exclude = ['likes_count', 'dislikes_count', 'author']
         read_only = ['id', 'published_date', 'last_change_date', 'author_username', 'likes_amount', 'dislikes_amount']
+        list_serializer_class = VoteListSerializer
 
     def get_author_username(self, obj):
         return obj.author.username
 
-    def get_likes_amount(self, obj):
-        return obj.likes.count()
-
-    def get_dislikes_amount(self, obj):
-        return obj.dislikes.count()
-
     def create(self, validated_data):
         return Post.objects.create(**validated_data, author=self.context['author'])
 
@@ -41,25 +68,21 @@ class PostSerializer(serializers.ModelSerializer):
         return instance
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(MyVoteMixin, serializers.ModelSerializer):
     author_username = serializers.SerializerMethodField()
-    likes_amount = serializers.SerializerMethodField()
-    dislikes_amount = serializers.SerializerMethodField()
+    likes_amount = serializers.IntegerField(source='likes_count', read_only=True)
+    dislikes_amount = serializers.IntegerField(source='dislikes_count', read_only=True)
+    my_vote = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
-        exclude = ['author', 'dislikes', 'likes']
+        exclude = ['author', 'likes_count', 'dislikes_count']
         read_only = ['author_username', 'last_change_date', 'published_date']
+        list_serializer_class = VoteListSerializer
 
     def get_author_username(self, obj):
         return obj.author.username
 
-    def get_likes_amount(self, obj):
-        return obj.likes.count()
-
-    def get_dislikes_amount(self, obj):
-        return obj.dislikes.count()
-
     def create(self, validated_data):
         return Comment.objects.create(**validated_data, author=self.context['author'])
 
@@ -69,3 +92,150 @@ class CommentSerializer(serializers.ModelSerializer):
         instance.last_change_date = timezone.now()
         instance.save()
         return instance
+
+
+def get_excerpt(html):
+    """ Plain text beginning of rich text, tag cut by the database is dropped """
+    if html.rfind('<') > html.rfind('>'):
+        html = html[:html.rfind('<')]
+    return Truncator(' '.join(unescape(strip_tags(html)).split())).chars(EXCERPT_LENGTH)
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer of values() rows with the same representation as model_serializer_class.
+    Fields of the model serializer are set up once instead of being run for every row, method fields are
+    read from annotations of the same name, my_vote is read for the whole page in one query.
+
+    Extra fields are not shown by default, they are given as {name: (expression, conversion)}.
+    Only columns of shown fields and of ordering are selected by get_rows(queryset, fields)
+    """
+    model_serializer_class = None
+    annotations = {}
+    extra_fields = {}
+
+    def __init__(self, instance=None, many=False, context=None, fields=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+        self.field_names = self.get_default_field_names() if fields is None else fields
+
+    @classmethod
+    def get_fields(cls):
+        return cls.model_serializer_class().fields
+
+    @classmethod
+    def get_default_field_names(cls):
+        return list(cls.get_fields())
+
+    @classmethod
+    def get_field_names(cls):
+        """ Names of all fields, which may be selected """
+        return [*cls.get_fields(), *cls.extra_fields]
+
+    @classmethod
+    def get_rows(cls, queryset, fields=None, columns=()):
+        """ values() rows of shown fields, other columns needed by caller are given in columns """
+        fields = cls.get_default_field_names() if fields is None else fields
+        model_fields = cls.get_fields()
+        # Pagination and my_vote read primary key and ordering columns even if they are not shown
+        ordering = [
+            'id' if name == 'pk' else name
+            for name in (
+                name.lstrip('-') for name in queryset.query.order_by or queryset.model._meta.ordering
+                if isinstance(name, str)
+            )
+        ]
+        columns = ['id', *ordering, *columns]
+        annotations = {}
+
+        for name in fields:
+            if name in cls.extra_fields:
+                annotations[name] = cls.extra_fields[name][0]
+            elif name in cls.annotations:
+                annotations[name] = cls.annotations[name]
+            elif not isinstance(model_fields[name], serializers.SerializerMethodField):
+                columns.append(model_fields[name].source)
+        return queryset.values(*dict.fromkeys(columns), **annotations)
+
+    def get_converters(self):
+        """ [(name, key of row, conversion or None)], values of plain fields are taken as they are """
+        model_fields = self.get_fields()
+        converters = []
+        for name in self.field_names:
+            field = model_fields.get(name)
+            if field is None:
+                converters.append((name, name, self.extra_fields[name][1]))
+            elif isinstance(field, serializers.SerializerMethodField):
+                converters.append((name, name, None))
+            elif isinstance(field, (serializers.IntegerField, serializers.CharField, serializers.RelatedField)):
+                # Related field of values() row is already primary key
+                converters.append((name, field.source, None))
+            else:
+                if isinstance(field, serializers.DateTimeField) and not hasattr(field, 'timezone'):
+                    # Current timezone is looked up once instead of for every value
+                    field.timezone = field.default_timezone()
+                converters.append((name, field.source, field.to_representation))
+        return converters
+
+    def attach_my_votes(self, rows):
+        request = self.context.get('request')
+        votes = {}
+        if request is not None:
+            votes = get_user_votes(request.user, self.model_serializer_class.Meta.model, [row['id'] for row in rows])
+        for row in rows:
+            row['my_vote'] = votes.get(row['id'])
+
+    def to_representation_many(self, rows):
+        rows = list(rows)
+        if 'my_vote' in self.field_names:
+            self.attach_my_votes(rows)
+        converters = self.get_converters()
+        return [
+            {
+                name: row[key] if convert is None or row[key] is None else convert(row[key])
+                for name, key, convert in converters
+            }
+            for row in rows
+        ]
+
+    @property
+    def data(self):
+        if self.many:
+            return self.to_representation_many(self.instance)
+        return self.to_representation_many([self.instance])[0]
+
+
+class CategoryValuesSerializer(ValuesSerializer):
+    model_serializer_class = CategorySerializer
+
+
+class PostValuesSerializer(ValuesSerializer):
+    model_serializer_class = PostSerializer
+    annotations = {'author_username': F('author__username')}
+    # Excerpt is a cheap alternative to content, only the beginning of content is read
+    extra_fields = {'excerpt': (Left('content', EXCERPT_SCAN_LENGTH), get_excerpt)}
+
+
+class CommentValuesSerializer(ValuesSerializer):
+    model_serializer_class = CommentSerializer
+    annotations = {'author_username': F('author__username')}
+
+
+def get_author_summaries(author_ids):
+    """ Id, username and profile image url of users, read by one query """
+    storage = CustomUserModel._meta.get_field('profile_image').storage
+    rows = CustomUserModel.objects.filter(pk__in=set(author_ids)).order_by('pk').values(
+        'id', 'username', 'profile_image'
+    )
+    return [{**row, 'profile_image': storage.url(row['profile_image'])} for row in rows]
+
+
+class VoteOperationSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=['post', 'comment'])
+    pk = serializers.IntegerField(min_value=1)
+    status = serializers.ChoiceField(choices=['like', 'dislike'])
+
+
+class BatchVoteSerializer(serializers.Serializer):
+    votes = serializers.ListField(child=VoteOperationSerializer(), min_length=1, max_length=500)
@@ -1,10 +1,29 @@
+import datetime
+import decimal
 import freezegun
-from django.test import TestCase
+import gzip
+import io
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, Client, override_settings, skipUnlessDBFeature
 from django.urls import reverse
+from django.utils.translation import gettext_lazy as _
+from threading import Barrier, Thread
+from unittest import mock
 import json
+import time
 from users.tests import create_user
-from forum.tests import create_post, create_category, create_comment
-from forum.models import Post, Comment
+from forum.tests import create_post, create_category, create_comment, create_vote
+from forum.models import Post, Comment, Vote
+from forum.tasks import flush_vote_buffer
+from search.tests import SearchTestMixin
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from .renderers import FastJSONRenderer, FastJSONParser
+from .serializers import PostSerializer, CommentSerializer, PostValuesSerializer, CommentValuesSerializer
 
 
 def bytes_to_dict(content: bytes):
@@ -13,6 +32,7 @@ def bytes_to_dict(content: bytes):
 
 class CategoryAPITest(TestCase):
 	def setUp(self) -> None:
+		cache.clear()
 		self.author = create_user()
 		self.category1 = create_category('Category1')
 		self.category2 = create_category('Category2')
@@ -23,6 +43,15 @@ class CategoryAPITest(TestCase):
 		response_content_in_dict = bytes_to_dict(response.content)
 		self.assertEqual(response_content_in_dict['count'], 2)
 
+	def test_categories_cursor_pages(self):
+		response = self.client.get(reverse('api:categories_list'), {'cursor': '', 'page_size': 1})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([category['title'] for category in response.data['results']], ['Category2'])
+
+		response = self.client.get(response.data['next'])
+		self.assertEqual([category['title'] for category in response.data['results']], ['Category1'])
+		self.assertIsNone(response.data['next'])
+
 	def test_category_posts(self):
 		response1 = self.client.get(reverse('api:category_posts', kwargs={'pk': self.category1.pk}))
 		response2 = self.client.get(reverse('api:category_posts', kwargs={'pk': self.category2.pk}))
@@ -34,6 +63,7 @@ class CategoryAPITest(TestCase):
 
 class PostAPITest(TestCase):
 	def setUp(self) -> None:
+		cache.clear()
 		self.user = create_user()
 		self.category = create_category('Category1')
 
@@ -44,12 +74,82 @@ class PostAPITest(TestCase):
 		response_content_in_dict = bytes_to_dict(response.content)
 		self.assertEqual(response_content_in_dict['count'], 2)
 
+	@freezegun.freeze_time('2022-01-01', auto_tick_seconds=5)
+	def test_cursor_pagination(self):
+		posts = [create_post(self.user, category=self.category, title=f'Post{i}') for i in range(5)]
+		url = reverse('api:posts_all') + '?page_size=2&cursor='
+		titles = []
+
+		while url:
+			response = bytes_to_dict(self.client.get(url).content)
+			self.assertNotIn('count', response)
+			titles += [post['title'] for post in response['results']]
+			# Posts published during the walk do not shift next pages
+			create_post(self.user, category=self.category, title='New post')
+			url = response['next']
+
+		self.assertEqual(titles, [post.title for post in reversed(posts)])
+		response = self.client.get(reverse('api:posts_all') + '?cursor=invalid')
+		self.assertEqual(response.status_code, 404)
+
 	def test_get_post(self):
 		post = create_post(self.user, category=self.category)
 		response = self.client.get(reverse('api:post_get_edit_delete', kwargs={'pk': post.pk}))
 		response_content_in_dict = bytes_to_dict(response.content)
 		self.assertTrue('post' in response_content_in_dict)
 
+	def test_my_vote(self):
+		posts = [create_post(self.user, category=self.category) for i in range(3)]
+		create_vote(self.user, posts[0], Vote.DISLIKE)
+		self.client.force_login(self.user)
+
+		with CaptureQueriesContext(connection) as few_posts:
+			response = self.client.get(reverse('api:posts_all'))
+		self.assertEqual(
+			{post['id']: post['my_vote'] for post in bytes_to_dict(response.content)['results']},
+			{posts[0].pk: 'dislike', posts[1].pk: None, posts[2].pk: None}
+		)
+
+		posts += [create_post(self.user, category=self.category) for i in range(10)]
+		create_vote(self.user, posts[-1], Vote.LIKE)
+		with CaptureQueriesContext(connection) as many_posts:
+			response = self.client.get(reverse('api:posts_all') + '?page=1')
+		self.assertEqual(len(many_posts), len(few_posts))
+
+		response = self.client.get(reverse('api:post_get_edit_delete', kwargs={'pk': posts[-1].pk}))
+		self.assertEqual(bytes_to_dict(response.content)['post']['my_vote'], 'like')
+
+	def test_include(self):
+		other = create_user(username='other', email='other@gmail.com')
+		post = create_post(self.user, category=self.category)
+		comments = [create_comment(other if i % 2 else self.user, post, text=f'Comment{i}') for i in range(3)]
+		create_vote(self.user, comments[1], Vote.DISLIKE)
+		self.client.force_login(self.user)
+		url = reverse('api:post_get_edit_delete', kwargs={'pk': post.pk}) + '?include=comments,author,my_vote'
+
+		with CaptureQueriesContext(connection) as few_comments:
+			response = bytes_to_dict(self.client.get(url).content)
+		self.assertEqual(response['post']['id'], post.pk)
+		self.assertIsNone(response['comments']['next'])
+		self.assertEqual(
+			[(comment['text'], comment['my_vote']) for comment in response['comments']['results']],
+			[('Comment2', None), ('Comment1', 'dislike'), ('Comment0', None)]
+		)
+		self.assertEqual([author['username'] for author in response['authors']], [self.user.username, 'other'])
+
+		comments += [create_comment(other, post, text=f'Comment{i}') for i in range(3, 60)]
+		# Versions are bumped on commit, which does not happen in TestCase
+		cache.clear()
+		with CaptureQueriesContext(connection) as many_comments:
+			response = bytes_to_dict(self.client.get(url).content)
+		self.assertEqual(len(many_comments), len(few_comments))
+		self.assertEqual(len(response['comments']['results']), 50)
+		self.assertTrue(response['comments']['next'].endswith('?page=2'))
+
+		response = bytes_to_dict(self.client.get(url.replace(',my_vote', '')).content)
+		self.assertNotIn('my_vote', response['comments']['results'][0])
+		self.assertEqual(self.client.get(url + ',votes').status_code, 400)
+
 	def test_edit_post(self):
 		self.client.force_login(self.user)
 		post = create_post(self.user, category=self.category)
@@ -79,8 +179,140 @@ class PostAPITest(TestCase):
 		self.assertTrue(Post.objects.get(title='New post'))
 
 
+class ValuesSerializerTest(TestCase):
+	def setUp(self) -> None:
+		self.user = create_user()
+		self.post = create_post(self.user)
+		self.comments = [create_comment(self.user, self.post, text=f'Comment{i}') for i in range(3)]
+		create_vote(self.user, self.post, Vote.LIKE)
+		create_vote(self.user, self.comments[1], Vote.DISLIKE)
+
+	def assertSameJSON(self, serializer_class, values_serializer_class, queryset, user):
+		request = Request(APIRequestFactory().get('/'))
+		request.user = user
+		context = {'request': request}
+		expected = serializer_class(queryset, many=True, context=context).data
+		data = values_serializer_class(values_serializer_class.get_rows(queryset), many=True, context=context).data
+		self.assertEqual(JSONRenderer().render(data), JSONRenderer().render(expected))
+
+		expected = serializer_class(queryset.first(), context=context).data
+		data = values_serializer_class(values_serializer_class.get_rows(queryset).first(), context=context).data
+		self.assertEqual(JSONRenderer().render(data), JSONRenderer().render(expected))
+
+	def test_same_json_as_model_serializers(self):
+		for user in (self.user, AnonymousUser()):
+			self.assertSameJSON(PostSerializer, PostValuesSerializer, Post.objects.all(), user)
+			self.assertSameJSON(CommentSerializer, CommentValuesSerializer, Comment.objects.all(), user)
+
+
+class SparseFieldsTest(TestCase):
+	def setUp(self) -> None:
+		cache.clear()
+		self.user = create_user()
+		self.post = create_post(self.user, content='<p>Long &amp; <b>rich</b></p> ' + 'word ' * 1000)
+		create_comment(self.user, self.post)
+
+	def test_fields_and_exclude(self):
+		response = self.client.get(reverse('api:posts_all') + '?fields=id,title,excerpt&cursor=')
+		self.assertEqual(response.status_code, 200)
+		[post] = bytes_to_dict(response.content)['results']
+		self.assertEqual(list(post), ['id', 'title', 'excerpt'])
+		self.assertTrue(post['excerpt'].startswith('Long & rich word'))
+		self.assertLessEqual(len(post['excerpt']), 200)
+
+		response = self.client.get(reverse('api:post_comments', kwargs={'pk': self.post.pk}) + '?exclude=text,post')
+		[comment] = bytes_to_dict(response.content)['results']
+		self.assertNotIn('text', comment)
+		self.assertIn('author_username', comment)
+
+		response = self.client.get(reverse('api:categories_list') + '?fields=title')
+		self.assertEqual(bytes_to_dict(response.content)['results'], [{'title': self.post.category.title}])
+
+		response = self.client.get(reverse('api:post_get_edit_delete', kwargs={'pk': self.post.pk}) + '?fields=unknown')
+		self.assertEqual(response.status_code, 400)
+
+	def test_content_is_not_read(self):
+		content_column = connection.ops.quote_name('content')
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get(reverse('api:user_posts', kwargs={'username': self.user.username}) + '?exclude=content')
+		self.assertFalse([query for query in queries if content_column in query['sql']])
+
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get(reverse('api:user_posts', kwargs={'username': self.user.username}))
+		self.assertTrue([query for query in queries if content_column in query['sql']])
+
+
+class ExportAPITest(TestCase):
+	def setUp(self) -> None:
+		self.user = create_user()
+		with freezegun.freeze_time('2022-01-01'):
+			self.old_post = create_post(self.user, title='Old post')
+		with freezegun.freeze_time('2022-02-01'):
+			self.post = create_post(self.user, category=self.old_post.category, title='New post')
+		create_vote(self.user, self.post, Vote.DISLIKE)
+
+	def get_lines(self, content):
+		return [json.loads(line) for line in content.decode().splitlines()]
+
+	def test_export(self):
+		url = reverse('api:export', kwargs={'kind': 'posts'})
+		self.assertEqual(self.client.get(url).status_code, 403)
+		self.user.is_staff = True
+		self.user.save()
+		self.client.force_login(self.user)
+
+		response = self.client.get(url)
+		self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+		posts = self.get_lines(b''.join(response.streaming_content))
+		self.assertEqual([post['title'] for post in posts], ['Old post', 'New post'])
+		self.assertEqual(posts[1]['dislikes_count'], 1)
+
+		response = self.client.get(url, {'since': '2022-01-15'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+		self.assertEqual(response['Content-Encoding'], 'gzip')
+		posts = self.get_lines(gzip.decompress(b''.join(response.streaming_content)))
+		self.assertEqual([post['id'] for post in posts], [self.post.pk])
+
+		response = self.client.get(reverse('api:export', kwargs={'kind': 'votes'}))
+		self.assertEqual(
+			self.get_lines(b''.join(response.streaming_content)),
+			[{'id': Vote.objects.get().pk, 'user_id': self.user.pk, 'object_id': self.post.pk, 'value': 'dislike',
+			  'type': 'post'}]
+		)
+		response = self.client.get(reverse('api:export', kwargs={'kind': 'votes'}), {'since': '2022-01-15'})
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+		self.assertEqual(self.client.get(reverse('api:export', kwargs={'kind': 'users'})).status_code, 404)
+
+
+class FastJSONTest(TestCase):
+	data = {
+		'text': 'Тест \u2028 "quoted"', 'decimal': decimal.Decimal('1.50'), 'none': None, 'list': [1, 2.5, True],
+		'date': datetime.datetime(2022, 1, 1, 10, 0, 0, 123456, tzinfo=datetime.timezone.utc), 'lazy': _('Like'),
+	}
+
+	def test_same_output_as_stock_renderer(self):
+		expected = JSONRenderer().render(self.data)
+		self.assertEqual(FastJSONRenderer().render(self.data), expected)
+		with mock.patch('rest_api.renderers.orjson', None):
+			self.assertEqual(FastJSONRenderer().render(self.data), expected)
+		self.assertEqual(
+			FastJSONRenderer().render(self.data, 'application/json; indent=4'),
+			JSONRenderer().render(self.data, 'application/json; indent=4')
+		)
+
+	def test_parser(self):
+		content = FastJSONRenderer().render({'votes': [{'type': 'post', 'pk': 1}]})
+		self.assertEqual(FastJSONParser().parse(io.BytesIO(content)), {'votes': [{'type': 'post', 'pk': 1}]})
+
+		self.client.force_login(create_user())
+		response = self.client.post(reverse('api:votes_batch'), data='{"votes": [', content_type='application/json')
+		self.assertEqual(response.status_code, 400)
+		self.assertIn('JSON parse error', bytes_to_dict(response.content)['detail'])
+
+
 class PostRatingAPITest(TestCase):
 	def setUp(self) -> None:
+		cache.clear()
 		self.category = create_category('Category1')
 		self.user = create_user()
 		self.post = create_post(author=self.user, category=self.category)
@@ -89,37 +321,330 @@ class PostRatingAPITest(TestCase):
 		self.client.force_login(self.user)
 		response = self.client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'like'}))
 		response_content_in_dict = bytes_to_dict(response.content)
-		self.assertTrue(Post.objects.get(pk=self.post.pk).likes.filter(pk=self.user.pk))
-		self.assertEqual(Post.objects.get(pk=self.post.pk).likes.count(), 1)
+		self.assertTrue(Vote.objects.for_object(self.post).filter(user=self.user, value=Vote.LIKE))
+		self.assertEqual(Post.objects.get(pk=self.post.pk).likes_count, 1)
 		self.assertEqual(response_content_in_dict['likes'], 1)
 
 	def test_remove_like(self):
 		self.client.force_login(self.user)
-		self.post.likes.add(self.user)
+		create_vote(self.user, self.post, Vote.LIKE)
 		response = self.client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'like'}))
 		response_content_in_dict = bytes_to_dict(response.content)
-		self.assertEqual(Post.objects.get(pk=self.post.pk).likes.count(), 0)
+		self.assertEqual(Post.objects.get(pk=self.post.pk).likes_count, 0)
 		self.assertEqual(response_content_in_dict['likes'], 0)
 
 	def test_set_dislike(self):
 		self.client.force_login(self.user)
 		response = self.client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'dislike'}))
 		response_content_in_dict = bytes_to_dict(response.content)
-		self.assertTrue(Post.objects.get(pk=self.post.pk).dislikes.filter(pk=self.user.pk))
-		self.assertEqual(Post.objects.get(pk=self.post.pk).dislikes.count(), 1)
+		self.assertTrue(Vote.objects.for_object(self.post).filter(user=self.user, value=Vote.DISLIKE))
+		self.assertEqual(Post.objects.get(pk=self.post.pk).dislikes_count, 1)
 		self.assertEqual(response_content_in_dict['dislikes'], 1)
 
 	def test_remove_dislike(self):
 		self.client.force_login(self.user)
-		self.post.dislikes.add(self.user)
+		create_vote(self.user, self.post, Vote.DISLIKE)
 		response = self.client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'dislike'}))
 		response_content_in_dict = bytes_to_dict(response.content)
-		self.assertEqual(Post.objects.get(pk=self.post.pk).dislikes.count(), 0)
+		self.assertEqual(Post.objects.get(pk=self.post.pk).dislikes_count, 0)
 		self.assertEqual(response_content_in_dict['dislikes'], 0)
 
 
+class BatchRatingAPITest(TestCase):
+	def setUp(self) -> None:
+		cache.clear()
+		self.category = create_category('Category1')
+		self.user = create_user()
+		self.post = create_post(author=self.user, category=self.category)
+		self.comment = create_comment(self.user, self.post)
+		self.client.force_login(self.user)
+
+	def send_votes(self, votes):
+		return self.client.post(reverse('api:votes_batch'), data={'votes': votes}, content_type='application/json')
+
+	def test_batch_votes(self):
+		create_vote(self.user, self.comment, Vote.LIKE)
+		response = self.send_votes([
+			{'type': 'post', 'pk': self.post.pk, 'status': 'like'},
+			{'type': 'comment', 'pk': self.comment.pk, 'status': 'dislike'},
+			{'type': 'post', 'pk': self.post.pk, 'status': 'dislike'},
+		])
+		self.assertEqual(bytes_to_dict(response.content), {'votes': [
+			{'type': 'post', 'pk': self.post.pk, 'likes': 0, 'dislikes': 1},
+			{'type': 'comment', 'pk': self.comment.pk, 'likes': 0, 'dislikes': 1},
+		]})
+		self.assertEqual(
+			set(Vote.objects.values_list('object_id', 'value')), {(self.post.pk, Vote.DISLIKE), (self.comment.pk, Vote.DISLIKE)}
+		)
+
+	def test_queries_do_not_depend_on_batch_size(self):
+		queries = []
+		for size in [2, 20]:
+			votes = []
+			for i in range(size):
+				post = create_post(author=self.user, category=self.category)
+				create_vote(self.user, post, Vote.DISLIKE)
+				votes += [
+					{'type': 'post', 'pk': post.pk, 'status': 'like'},
+					{'type': 'comment', 'pk': create_comment(self.user, post).pk, 'status': 'like'},
+				]
+			with CaptureQueriesContext(connection) as context:
+				self.assertEqual(self.send_votes(votes).status_code, 200)
+			queries.append(len(context.captured_queries))
+		self.assertEqual(queries[0], queries[1])
+
+	def test_missing_object(self):
+		response = self.send_votes([
+			{'type': 'post', 'pk': self.post.pk, 'status': 'like'},
+			{'type': 'comment', 'pk': self.comment.pk + 1, 'status': 'like'},
+		])
+		self.assertEqual(response.status_code, 400)
+		self.assertFalse(Vote.objects.all())
+
+
+@override_settings(VOTES_WRITE_BEHIND=True, VOTES_BUFFER_BACKEND='forum.vote_buffer.LocalVoteBuffer')
+class WriteBehindRatingAPITest(TestCase):
+	def setUp(self) -> None:
+		cache.clear()
+		self.category = create_category('Category1')
+		self.user = create_user()
+		self.post = create_post(author=self.user, category=self.category)
+		self.client.force_login(self.user)
+
+	def test_counts_include_buffered_votes(self):
+		response = self.client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'like'}))
+		self.assertEqual(bytes_to_dict(response.content), {'likes': 1, 'dislikes': 0, 'my_vote': 'like'})
+		response = self.client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'dislike'}))
+		self.assertEqual(bytes_to_dict(response.content), {'likes': 0, 'dislikes': 1, 'my_vote': 'dislike'})
+		self.assertFalse(Vote.objects.all())
+
+		flush_vote_buffer()
+		self.assertEqual(Post.objects.get(pk=self.post.pk).dislikes_count, 1)
+		response = self.client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'dislike'}))
+		self.assertEqual(bytes_to_dict(response.content), {'likes': 0, 'dislikes': 0, 'my_vote': None})
+
+	def test_batch_votes_are_buffered(self):
+		response = self.client.post(reverse('api:votes_batch'), data={'votes': [
+			{'type': 'post', 'pk': self.post.pk, 'status': 'like'},
+			{'type': 'post', 'pk': self.post.pk, 'status': 'dislike'},
+		]}, content_type='application/json')
+		self.assertEqual(bytes_to_dict(response.content)['votes'], [{'type': 'post', 'pk': self.post.pk, 'likes': 0, 'dislikes': 1}])
+		self.assertFalse(Vote.objects.all())
+		flush_vote_buffer()
+		self.assertEqual(Vote.objects.get().value, Vote.DISLIKE)
+
+	def test_buffered_votes_are_flushed_after_write_behind_is_off(self):
+		self.client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'like'}))
+		with override_settings(VOTES_WRITE_BEHIND=False):
+			flush_vote_buffer()
+		self.assertEqual(Vote.objects.get().value, Vote.LIKE)
+
+
+class SearchAPITest(SearchTestMixin, TransactionTestCase):
+	def setUp(self) -> None:
+		super(SearchAPITest, self).setUp()
+		self.user = create_user()
+		self.category = create_category('Category1')
+		self.other_category = create_category('Category2')
+
+	def test_search(self):
+		post = create_post(self.user, category=self.category, title='Searched post')
+		create_post(self.user, category=self.other_category, title='Searched too')
+		create_post(self.user, category=self.category, title='Other')
+
+		response = bytes_to_dict(self.client.get(reverse('api:search'), {'q': 'searched'}).content)
+		self.assertEqual(response['count'], 2)
+		response = bytes_to_dict(
+			self.client.get(reverse('api:search'), {'q': 'searched', 'category': self.category.pk}).content
+		)
+		self.assertEqual([found['id'] for found in response['results']], [post.pk])
+		self.assertEqual(response['results'][0]['author_username'], self.user.username)
+
+		response = self.client.get(reverse('api:search'), {'q': 'searched', 'category': 'first'})
+		self.assertEqual(response.status_code, 400)
+
+	def test_cache_stats(self):
+		self.client.get(reverse('api:search'), {'q': 'searched'})
+		self.client.get(reverse('api:search'), {'q': 'Searched'})
+		self.client.force_login(self.user)
+		self.assertEqual(self.client.get(reverse('api:search_cache_stats')).status_code, 403)
+
+		self.user.is_staff = True
+		self.user.save()
+		response = bytes_to_dict(self.client.get(reverse('api:search_cache_stats')).content)
+		self.assertEqual(response, {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+	@override_settings(SEARCH_SUGGESTIONS_REFRESH_INTERVAL=0)
+	def test_suggest(self):
+		post = create_post(self.user, category=self.category, title='Category tips')
+
+		response = bytes_to_dict(self.client.get(reverse('api:search_suggest'), {'q': 'categ'}).content)
+		self.assertEqual(response['results'], [
+			{'type': 'category', 'id': self.category.pk, 'title': 'Category1', 'url': '/forum/category/Category1/'},
+			{'type': 'category', 'id': self.other_category.pk, 'title': 'Category2', 'url': '/forum/category/Category2/'},
+			{'type': 'post', 'id': post.pk, 'title': 'Category tips', 'url': f'/forum/post/{post.pk}/'},
+		])
+
+
+class ApiCacheTest(TransactionTestCase):
+	""" Versions are bumped after commit """
+
+	def setUp(self) -> None:
+		cache.clear()
+		self.user = create_user()
+		self.other_user = create_user(username='otherUser', email='other@gmail.com')
+		self.category = create_category('Category1')
+		self.post = create_post(self.user, category=self.category, title='Original')
+
+	def get_post(self, client=None):
+		url = reverse('api:post_get_edit_delete', kwargs={'pk': self.post.pk})
+		return bytes_to_dict((client or self.client).get(url).content)['post']
+
+	def test_cached_response(self):
+		self.get_post()
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(self.get_post()['title'], 'Original')
+		self.assertEqual(len(queries), 0)
+
+	def test_writes_are_seen_immediately(self):
+		listings = [
+			reverse('api:posts_all'), reverse('api:category_posts', kwargs={'pk': self.category.pk}),
+			reverse('api:user_posts', kwargs={'username': self.user.username})
+		]
+		for url in listings:
+			self.client.get(url)
+		self.get_post()
+
+		self.client.force_login(self.user)
+		self.client.put(
+			reverse('api:post_get_edit_delete', kwargs={'pk': self.post.pk}), {'title': 'Changed'},
+			content_type='application/json'
+		)
+		self.client.logout()
+		self.assertEqual(self.get_post()['title'], 'Changed')
+		for url in listings:
+			self.assertEqual(bytes_to_dict(self.client.get(url).content)['results'][0]['title'], 'Changed')
+
+		comments_url = reverse('api:post_comments', kwargs={'pk': self.post.pk})
+		compound_url = reverse('api:post_get_edit_delete', kwargs={'pk': self.post.pk}) + '?include=comments'
+		self.assertEqual(bytes_to_dict(self.client.get(comments_url).content)['count'], 0)
+		self.assertEqual(bytes_to_dict(self.client.get(compound_url).content)['comments']['results'], [])
+		create_comment(self.user, self.post)
+		self.assertEqual(bytes_to_dict(self.client.get(comments_url).content)['count'], 1)
+		self.assertEqual(len(bytes_to_dict(self.client.get(compound_url).content)['comments']['results']), 1)
+
+		self.post.delete()
+		for url in listings:
+			self.assertEqual(bytes_to_dict(self.client.get(url).content)['results'], [])
+
+	def test_recounted_votes_are_seen_immediately(self):
+		voter = create_user(username='voter', email='voter@gmail.com')
+		create_vote(voter, self.post)
+		self.assertEqual(self.get_post()['likes_amount'], 1)
+
+		voter.delete()
+		self.assertEqual(self.get_post()['likes_amount'], 0)
+
+	def test_conditional_get(self):
+		url = reverse('api:post_get_edit_delete', kwargs={'pk': self.post.pk})
+		response = self.client.get(url)
+		etag, last_modified = response['ETag'], response['Last-Modified']
+
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+			self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+		self.assertEqual(len(queries), 0)
+
+		# Vote of other user changes counters without changing the post
+		time.sleep(1)
+		other_client = Client()
+		other_client.force_login(self.other_user)
+		other_client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'like'}))
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+		self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+		# Validators depend on user
+		self.assertNotEqual(other_client.get(url)['ETag'], response['ETag'])
+
+	def test_rating_is_seen_immediately_and_per_user(self):
+		other_client = Client()
+		other_client.force_login(self.other_user)
+		self.client.force_login(self.user)
+		self.get_post(), self.get_post(other_client)
+
+		self.client.post(reverse('api:post_rating', kwargs={'pk': self.post.pk, 'status': 'like'}))
+		post = self.get_post()
+		self.assertEqual((post['likes_amount'], post['my_vote']), (1, 'like'))
+		post = self.get_post(other_client)
+		self.assertEqual((post['likes_amount'], post['my_vote']), (1, None))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class RatingAPIConcurrencyTest(TransactionTestCase):
+	users_amount = 8
+	threads_per_user = 3
+	toggles_per_thread = 125
+	min_toggles_per_second = 20
+
+	def setUp(self) -> None:
+		self.category = create_category('Category1')
+		self.users = [create_user(username=f'voter{i}', email=f'voter{i}@gmail.com') for i in range(self.users_amount)]
+		self.post = create_post(author=self.users[0], category=self.category)
+		self.comment = create_comment(self.users[0], self.post)
+		self.targets = [('api:post_rating', self.post), ('api:comment_rating', self.comment)]
+
+	def send_toggles(self, client, status, barrier, failures):
+		try:
+			barrier.wait()
+			for i in range(self.toggles_per_thread):
+				url_name, obj = self.targets[i % len(self.targets)]
+				response = client.post(reverse(url_name, kwargs={'pk': obj.pk, 'status': status}))
+				if response.status_code != 200:
+					failures.append(response.status_code)
+		finally:
+			connection.close()
+
+	def test_concurrent_toggles(self):
+		threads = []
+		failures = []
+		barrier = Barrier(self.users_amount * self.threads_per_user + 1)
+
+		for i, user in enumerate(self.users):
+			status = 'like' if i % 2 == 0 else 'dislike'
+			for _ in range(self.threads_per_user):
+				client = Client()
+				client.force_login(user)
+				threads.append(Thread(target=self.send_toggles, args=(client, status, barrier, failures)))
+
+		for thread in threads:
+			thread.start()
+		barrier.wait()
+		start = time.perf_counter()
+		for thread in threads:
+			thread.join()
+		toggles_per_second = len(threads) * self.toggles_per_thread / (time.perf_counter() - start)
+
+		self.assertEqual(failures, [])
+		self.assertGreater(toggles_per_second, self.min_toggles_per_second)
+
+		# Every toggle is applied exactly once, so vote stays only where user toggled odd amount of times
+		for target_index, (url_name, obj) in enumerate(self.targets):
+			toggles_per_user = self.threads_per_user * len(range(target_index, self.toggles_per_thread, len(self.targets)))
+			expected_votes = set()
+			if toggles_per_user % 2:
+				expected_votes = {(user.pk, Vote.LIKE if i % 2 == 0 else Vote.DISLIKE) for i, user in enumerate(self.users)}
+
+			obj.refresh_from_db()
+			self.assertEqual(set(Vote.objects.for_object(obj).values_list('user', 'value')), expected_votes)
+			self.assertEqual(obj.likes_count, len([vote for vote in expected_votes if vote[1] == Vote.LIKE]))
+			self.assertEqual(obj.dislikes_count, len([vote for vote in expected_votes if vote[1] == Vote.DISLIKE]))
+
+
 class CommentAPITest(TestCase):
 	def setUp(self) -> None:
+		cache.clear()
 		self.user = create_user()
 		self.category = create_category('Category1')
 		self.post = create_post(self.user, self.category)
@@ -176,6 +701,7 @@ class CommentAPITest(TestCase):
 
 class CommentRatingAPITest(TestCase):
 	def setUp(self) -> None:
+		cache.clear()
 		self.category = create_category('Category1')
 		self.user = create_user()
 		self.post = create_post(author=self.user, category=self.category)
@@ -185,37 +711,38 @@ class CommentRatingAPITest(TestCase):
 		self.client.force_login(self.user)
 		response = self.client.post(reverse('api:comment_rating', kwargs={'pk': self.comment.pk, 'status': 'like'}))
 		response_content_in_dict = bytes_to_dict(response.content)
-		self.assertTrue(Comment.objects.get(pk=self.comment.pk).likes.filter(pk=self.user.pk))
-		self.assertEqual(Comment.objects.get(pk=self.comment.pk).likes.count(), 1)
+		self.assertTrue(Vote.objects.for_object(self.comment).filter(user=self.user, value=Vote.LIKE))
+		self.assertEqual(Comment.objects.get(pk=self.comment.pk).likes_count, 1)
 		self.assertEqual(response_content_in_dict['likes'], 1)
 
 	def test_remove_like(self):
 		self.client.force_login(self.user)
-		self.comment.likes.add(self.user)
+		create_vote(self.user, self.comment, Vote.LIKE)
 		response = self.client.post(reverse('api:comment_rating', kwargs={'pk': self.comment.pk, 'status': 'like'}))
 		response_content_in_dict = bytes_to_dict(response.content)
-		self.assertEqual(Comment.objects.get(pk=self.comment.pk).likes.count(), 0)
+		self.assertEqual(Comment.objects.get(pk=self.comment.pk).likes_count, 0)
 		self.assertEqual(response_content_in_dict['likes'], 0)
 
 	def test_set_dislike(self):
 		self.client.force_login(self.user)
 		response = self.client.post(reverse('api:comment_rating', kwargs={'pk': self.comment.pk, 'status': 'dislike'}))
 		response_content_in_dict = bytes_to_dict(response.content)
-		self.assertTrue(Comment.objects.get(pk=self.comment.pk).dislikes.filter(pk=self.user.pk))
-		self.assertEqual(Comment.objects.get(pk=self.comment.pk).dislikes.count(), 1)
+		self.assertTrue(Vote.objects.for_object(self.comment).filter(user=self.user, value=Vote.DISLIKE))
+		self.assertEqual(Comment.objects.get(pk=self.comment.pk).dislikes_count, 1)
 		self.assertEqual(response_content_in_dict['dislikes'], 1)
 
 	def test_remove_dislike(self):
 		self.client.force_login(self.user)
-		self.comment.dislikes.add(self.user)
+		create_vote(self.user, self.comment, Vote.DISLIKE)
 		response = self.client.post(reverse('api:comment_rating', kwargs={'pk': self.comment.pk, 'status': 'dislike'}))
 		response_content_in_dict = bytes_to_dict(response.content)
-		self.assertEqual(Comment.objects.get(pk=self.comment.pk).dislikes.count(), 0)
+		self.assertEqual(Comment.objects.get(pk=self.comment.pk).dislikes_count, 0)
 		self.assertEqual(response_content_in_dict['dislikes'], 0)
 
 
 class UserPostsAPITest(TestCase):
 	def setUp(self) -> None:
+		cache.clear()
 		self.user = create_user()
 		self.category = create_category('Category1')
 
@@ -226,3 +753,13 @@ class UserPostsAPITest(TestCase):
 		response = self.client.get(reverse('api:user_posts', kwargs={'username': self.user.username}))
 		response_content_in_dict = bytes_to_dict(response.content)
 		self.assertEqual(response_content_in_dict['count'], 2)
+
+	def test_author_is_read_once(self):
+		create_post(self.user, category=self.category)
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('api:user_posts', kwargs={'username': self.user.username}))
+		self.assertEqual(response.data['count'], 1)
+		self.assertEqual(len([query for query in queries if self.user.username in query['sql']]), 1)
+
+		response = self.client.get(reverse('api:user_posts', kwargs={'username': 'missing'}))
+		self.assertEqual((response.data['count'], response.data['results']), (0, []))
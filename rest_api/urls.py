@@ -20,8 +20,17 @@ urlpatterns = [
     path('comment/<int:pk>/<str:status>/', views.CommentRatingAPI.as_view(), name='comment_rating'),
     path('comment/create/', views.CommentAPI.as_view({'post': 'create'}), name='comment_create'),
 
+    path('votes/', views.BatchRatingAPI.as_view(), name='votes_batch'),
+
     path('categories/', views.CategoryAPI.as_view({'get': 'list'}), name='categories_list'),
     path('category/<int:pk>/', views.CategoryAPI.as_view({'get': 'retrieve'}), name='category_posts'),
 
     path('user/<str:username>/posts/', views.UserPostsAPI.as_view(), name='user_posts'),
+
+    path('search/', views.SearchAPI.as_view(), name='search'),
+    path('search/suggest/', views.SearchSuggestAPI.as_view(), name='search_suggest'),
+    path('search/cache/stats/', views.SearchCacheStatsAPI.as_view(), name='search_cache_stats'),
+    path('cache/stats/', views.CacheStatsAPI.as_view(), name='cache_stats'),
+
+    path('export/<str:kind>/', views.ExportAPI.as_view(), name='export'),
 ]
@@ -1,29 +1,91 @@
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, IsAdminUser
 from .permissions import UpdateIfAuthorOrAdmin
-from forum.models import Post, Category, Comment
-from .serializers import PostSerializer, CategorySerializer, CommentSerializer
-from .pagination import CustomPagination
+from users.models import CustomUserModel
+from forum.cache import cache_response, get_version_key, bump_rated_versions
+from forum.counts import get_count_key
+from forum import export
+from forum.models import Post, Category, Comment, Vote
+from forum.vote_buffer import get_vote_buffer
+from search import cache as search_cache
+from search.backends import get_posts_by_ids
+from search.suggestions import get_suggestion_index
+from .serializers import (
+	PostSerializer, CategorySerializer, CommentSerializer, BatchVoteSerializer, CategoryValuesSerializer,
+	PostValuesSerializer, CommentValuesSerializer, get_author_summaries
+)
+from .pagination import CustomPagination, SearchPagination
 from rest_framework.generics import GenericAPIView
+from django.core.cache import cache
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.urls import reverse
 
 
-class CategoryAPI(ModelViewSet):
+class SparseFieldsMixin:
+	"""
+	Comma separated ?fields= selects fields of returned objects and ?exclude= drops some of them.
+	Objects are serialized from values() rows by get_values_serializer_class(),
+	so columns of fields which are not shown are not read from the database
+	"""
+	values_serializer_class = None
+
+	def get_values_serializer_class(self):
+		return self.values_serializer_class
+
+	def get_field_names(self):
+		serializer_class = self.get_values_serializer_class()
+		fields = [name.strip() for name in self.request.query_params.get('fields', '').split(',') if name.strip()]
+		exclude = [name.strip() for name in self.request.query_params.get('exclude', '').split(',') if name.strip()]
+
+		available = serializer_class.get_field_names()
+		unknown = [name for name in [*fields, *exclude] if name not in available]
+		if unknown:
+			raise ValidationError({'fields': [f'Unknown fields: {", ".join(unknown)}. Available: {", ".join(available)}']})
+
+		return [name for name in fields or serializer_class.get_default_field_names() if name not in exclude]
+
+	def get_values_rows(self, queryset, columns=()):
+		return self.get_values_serializer_class().get_rows(queryset, self.get_field_names(), columns)
+
+	def get_values_serializer(self, rows, many=False):
+		return self.get_values_serializer_class()(
+			rows, many=many, context=self.get_serializer_context(), fields=self.get_field_names()
+		)
+
+
+class CategoryAPI(SparseFieldsMixin, ModelViewSet):
 	queryset = Category.objects.all()
 	pagination_class = CustomPagination
 	serializer_class = CategorySerializer
 
-	@method_decorator(cache_page(60 * 10))
+	def get_values_serializer_class(self):
+		if self.action == 'retrieve':
+			return PostValuesSerializer
+		return CategoryValuesSerializer
+
+	def get_count_key(self):
+		if self.action == 'retrieve':
+			return get_count_key(Post, category_id=self.kwargs['pk'])
+		return None
+
+	def get_version_keys(self):
+		return [get_version_key(Post, category_id=self.kwargs['pk'])]
+
+	def list(self, request, *args, **kwargs):
+		page = self.paginate_queryset(self.get_values_rows(self.get_queryset()))
+		return self.get_paginated_response(self.get_values_serializer(page, many=True).data)
+
+	@cache_response
 	def retrieve(self, request, *args, **kwargs):
 		category = self.get_object()
-		queryset = category.post_set.all()
-		page = self.paginate_queryset(queryset)
-		serializer = PostSerializer(page, many=True)
-		return self.paginator.get_paginated_response(serializer.data)
+		page = self.paginate_queryset(self.get_values_rows(category.post_set.all()))
+		return self.paginator.get_paginated_response(self.get_values_serializer(page, many=True).data)
 
 
 class RatingAPI(APIView):
@@ -40,52 +102,166 @@ class RatingAPI(APIView):
 		instance = self.get_object()
 
 		if kwargs['status'] == 'like':
-			self.set_like(instance, request.user)
+			value = self.set_like(instance, request.user)
 		else:
-			self.set_dislike(instance, request.user)
+			value = self.set_dislike(instance, request.user)
 
-		return Response({'likes': instance.likes.count(), 'dislikes': instance.dislikes.count()})
+		bump_rated_versions(self.model, [instance.pk])
+		return Response({**self.get_counts(instance), 'my_vote': Vote.STATUSES.get(value)})
 
 	def get_object(self):
 		obj = get_object_or_404(self.model, pk=self.kwargs['pk'])
 		return obj
 
 	@staticmethod
-	def set_like(obj, user):
-		if obj.likes.filter(pk=user.pk):
-			obj.likes.remove(user)
+	def toggle(obj, user, value):
+		if settings.VOTES_WRITE_BEHIND:
+			return get_vote_buffer().toggle(obj, user, value)
+		return Vote.objects.toggle(obj, user, value)
+
+	@staticmethod
+	def get_counts(obj):
+		if settings.VOTES_WRITE_BEHIND:
+			likes, dislikes = get_vote_buffer().get_counts(obj)
+		else:
+			obj.refresh_from_db(fields=['likes_count', 'dislikes_count'])
+			likes, dislikes = obj.likes_count, obj.dislikes_count
+		return {'likes': likes, 'dislikes': dislikes}
+
+	def set_like(self, obj, user):
+		return self.toggle(obj, user, Vote.LIKE)
+
+	def set_dislike(self, obj, user):
+		return self.toggle(obj, user, Vote.DISLIKE)
+
+
+class BatchRatingAPI(APIView):
+	""" Apply list of like and dislike toggles of posts and comments in order they are given """
+	models = {'post': Post, 'comment': Comment}
+	values = {'like': Vote.LIKE, 'dislike': Vote.DISLIKE}
+	permission_classes = [IsAuthenticated]
+
+	def post(self, request, *args, **kwargs):
+		serializer = BatchVoteSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		operations = serializer.validated_data['votes']
+
+		objects = self.get_objects(operations)
+		toggles = [
+			(objects[(operation['type'], operation['pk'])], self.values[operation['status']])
+			for operation in operations
+		]
+
+		if settings.VOTES_WRITE_BEHIND:
+			get_vote_buffer().toggle_many(request.user, toggles)
 		else:
-			if obj.dislikes.filter(pk=user.pk):
-				obj.dislikes.remove(user)
-			obj.likes.add(user)
+			Vote.objects.toggle_many(request.user, toggles)
+			objects = self.get_objects(operations)
+
+		for object_type, model in self.models.items():
+			pks = [pk for key_type, pk in objects if key_type == object_type]
+			if pks:
+				bump_rated_versions(model, pks)
+
+		return Response({'votes': [
+			{'type': object_type, 'pk': pk, **self.get_counts(obj)} for (object_type, pk), obj in objects.items()
+		]})
 
 	@staticmethod
-	def set_dislike(obj, user):
-		if obj.dislikes.filter(pk=user.pk):
-			obj.dislikes.remove(user)
+	def get_counts(obj):
+		if settings.VOTES_WRITE_BEHIND:
+			likes, dislikes = get_vote_buffer().get_counts(obj)
 		else:
-			if obj.likes.filter(pk=user.pk):
-				obj.likes.remove(user)
-			obj.dislikes.add(user)
+			likes, dislikes = obj.likes_count, obj.dislikes_count
+		return {'likes': likes, 'dislikes': dislikes}
+
+	def get_objects(self, operations):
+		""" Return {(type, pk): post or comment} in order of first operation, one query per type """
+		keys = list(dict.fromkeys((operation['type'], operation['pk']) for operation in operations))
+		found = {}
+
+		for object_type, model in self.models.items():
+			pks = [pk for key_type, pk in keys if key_type == object_type]
+			if pks:
+				for obj in model.objects.filter(pk__in=pks).only('pk', 'likes_count', 'dislikes_count'):
+					found[(object_type, obj.pk)] = obj
+
+		missing = [f'{object_type} {pk}' for object_type, pk in keys if (object_type, pk) not in found]
+		if missing:
+			raise ValidationError({'votes': [f'Objects do not exist: {", ".join(missing)}']})
+
+		return {key: found[key] for key in keys}
 
 
-class PostAPI(ModelViewSet):
+class PostAPI(SparseFieldsMixin, ModelViewSet):
 	queryset = Post.objects.all()
 	serializer_class = PostSerializer
+	values_serializer_class = PostValuesSerializer
 	pagination_class = CustomPagination
 	permission_classes = [IsAuthenticatedOrReadOnly, UpdateIfAuthorOrAdmin]
-
-	@method_decorator(cache_page(60 * 10))
+	includes = ['comments', 'author', 'my_vote']
+
+	def get_count_key(self):
+		return get_count_key(Post)
+
+	def get_version_keys(self):
+		if self.action == 'retrieve':
+			keys = [get_version_key(Post, pk=self.kwargs['pk'])]
+			if 'comments' in self.get_includes():
+				keys.append(get_version_key(Comment, post_id=self.kwargs['pk']))
+			return keys
+		return [get_version_key(Post)]
+
+	def get_includes(self):
+		""" Comma separated ?include= of retrieve, e.g. comments,author,my_vote """
+		includes = [name.strip() for name in self.request.query_params.get('include', '').split(',') if name.strip()]
+		unknown = [name for name in includes if name not in self.includes]
+		if unknown:
+			raise ValidationError({'include': [
+				f'Unknown includes: {", ".join(unknown)}. Available: {", ".join(self.includes)}'
+			]})
+		return includes
+
+	@cache_response
 	def list(self, request, *args, **kwargs):
-		page = self.paginate_queryset(self.queryset.select_related('author').prefetch_related('likes', 'dislikes'))
-		serializer = self.get_serializer(page, many=True)
-		return self.get_paginated_response(serializer.data)
+		page = self.paginate_queryset(self.get_values_rows(self.queryset))
+		return self.get_paginated_response(self.get_values_serializer(page, many=True).data)
 
-	@method_decorator(cache_page(60 * 10))
+	@cache_response
 	def retrieve(self, request, *args, **kwargs):
-		instance = self.get_object()
-		serializer = self.serializer_class(instance)
-		return Response({'post': serializer.data})
+		row = get_object_or_404(self.get_values_rows(self.queryset, columns=['author_id']), pk=self.kwargs['pk'])
+		return Response({'post': self.get_values_serializer(row).data, **self.get_included(row, self.get_includes())})
+
+	def get_included(self, post, includes):
+		"""
+		First page of comments, authors of the post and of the comments and vote states of the user on the comments.
+		Every include costs one query whatever amount of comments is
+		"""
+		included = {}
+		author_ids = [post['author_id']]
+
+		if 'comments' in includes:
+			page_size = self.paginator.page_size
+			fields = [
+				name for name in CommentValuesSerializer.get_default_field_names()
+				if name != 'my_vote' or 'my_vote' in includes
+			]
+			queryset = Comment.objects.filter(post_id=post['id'])
+			rows = list(CommentValuesSerializer.get_rows(queryset, fields, columns=['author_id'])[:page_size + 1])
+			next_url = None
+			if len(rows) > page_size:
+				next_url = self.request.build_absolute_uri(
+					reverse('api:post_comments', kwargs={'pk': post['id']}) + '?page=2'
+				)
+			serializer = CommentValuesSerializer(
+				rows[:page_size], many=True, context=self.get_serializer_context(), fields=fields
+			)
+			included['comments'] = {'next': next_url, 'results': serializer.data}
+			author_ids += [row['author_id'] for row in rows[:page_size]]
+
+		if 'author' in includes:
+			included['authors'] = get_author_summaries(author_ids)
+		return included
 
 	def destroy(self, request, *args, **kwargs):
 		instance = self.get_object()
@@ -112,24 +288,31 @@ class PostRatingAPI(RatingAPI):
 	model = Post
 
 
-class CommentAPI(ModelViewSet):
+class CommentAPI(SparseFieldsMixin, ModelViewSet):
 	queryset = Comment.objects.all()
 	pagination_class = CustomPagination
 	serializer_class = CommentSerializer
+	values_serializer_class = CommentValuesSerializer
 	permission_classes = [IsAuthenticatedOrReadOnly, UpdateIfAuthorOrAdmin]
 
-	@method_decorator(cache_page(60 * 10))
+	def get_count_key(self):
+		return get_count_key(Comment, post_id=self.kwargs['pk'])
+
+	def get_version_keys(self):
+		if self.action == 'retrieve':
+			return [get_version_key(Comment, pk=self.kwargs['pk'])]
+		return [get_version_key(Comment, post_id=self.kwargs['pk'])]
+
+	@cache_response
 	def list(self, request, *args, **kwargs):
-		queryset = get_object_or_404(Post, pk=self.kwargs['pk']).comment_set.select_related('author').prefetch_related('likes', 'dislikes')
-		page = self.paginate_queryset(queryset)
-		serializer = self.serializer_class(page, many=True)
-		return self.paginator.get_paginated_response(serializer.data)
+		queryset = get_object_or_404(Post, pk=self.kwargs['pk']).comment_set.all()
+		page = self.paginate_queryset(self.get_values_rows(queryset))
+		return self.paginator.get_paginated_response(self.get_values_serializer(page, many=True).data)
 
-	@method_decorator(cache_page(60 * 10))
+	@cache_response
 	def retrieve(self, request, *args, **kwargs):
-		instance = self.get_object()
-		serializer = self.serializer_class(instance)
-		return Response({'comment': serializer.data})
+		row = get_object_or_404(self.get_values_rows(self.queryset), pk=self.kwargs['pk'])
+		return Response({'comment': self.get_values_serializer(row).data})
 
 	def destroy(self, request, *args, **kwargs):
 		instance = self.get_object()
@@ -156,14 +339,108 @@ class CommentRatingAPI(RatingAPI):
 	model = Comment
 
 
-class UserPostsAPI(GenericAPIView):
+class UserPostsAPI(SparseFieldsMixin, GenericAPIView):
 	queryset = Post.objects.all()
 	pagination_class = CustomPagination
 	serializer_class = PostSerializer
+	values_serializer_class = PostValuesSerializer
+
+	def get_author_id(self):
+		""" Pk of user given by username, None when there is no such user. It is read once per request """
+		if not hasattr(self, '_author_id'):
+			authors = CustomUserModel.objects.filter(username=self.kwargs.get('username'))
+			self._author_id = authors.values_list('pk', flat=True).first()
+		return self._author_id
+
+	def get_count_key(self):
+		if self.get_author_id() is None:
+			return None
+		return get_count_key(Post, author_id=self.get_author_id())
+
+	def get_version_keys(self):
+		return [get_version_key(Post, author_id=self.get_author_id())]
+
+	@cache_response
+	def get(self, request, *args, **kwargs):
+		page = self.paginate_queryset(self.get_values_rows(self.queryset.filter(author_id=self.get_author_id())))
+		return self.paginator.get_paginated_response(self.get_values_serializer(page, many=True).data)
+
+
+class SearchAPI(SparseFieldsMixin, GenericAPIView):
+	""" Posts found by title, content and comments, ordered by relevance. Optional category parameter is category pk """
+	queryset = Post.objects.all()
+	pagination_class = SearchPagination
+	serializer_class = PostSerializer
+	values_serializer_class = PostValuesSerializer
+
+	def get(self, request, *args, **kwargs):
+		category_id = request.query_params.get('category')
+		if category_id and not category_id.isdigit():
+			raise ValidationError({'category': ['Category must be a number']})
+
+		post_ids = search_cache.search(
+			request.query_params.get('q', ''), category_id=int(category_id) if category_id else None
+		)
+		post_ids = self.paginate_queryset(post_ids)
+		rows = get_posts_by_ids(self.get_values_rows(self.get_queryset()), post_ids)
+		return self.get_paginated_response(self.get_values_serializer(rows, many=True).data)
+
+
+class SearchCacheStatsAPI(APIView):
+	""" Hits and misses of cached search results, for monitoring """
+	permission_classes = [IsAdminUser]
+
+	def get(self, request, *args, **kwargs):
+		return Response(search_cache.get_stats())
+
+
+class CacheStatsAPI(APIView):
+	""" Hits and misses of local and remote tiers of two-tier cache in the process serving the request """
+	permission_classes = [IsAdminUser]
+
+	def get(self, request, *args, **kwargs):
+		return Response(cache.get_stats() if hasattr(cache, 'get_stats') else {})
+
+
+class SearchSuggestAPI(APIView):
+	""" Post and category titles with words starting with typed words, served from memory of the process """
+
+	def get(self, request, *args, **kwargs):
+		suggestions = get_suggestion_index().suggest(request.query_params.get('q', ''))
+		return Response({'results': [
+			{
+				'type': kind, 'id': pk, 'title': title,
+				'url': reverse('forum:category_posts', kwargs={'category_title': title}) if kind == 'category' else
+				reverse('forum:post_page', kwargs={'post_pk': pk})
+			}
+			for kind, pk, title in suggestions
+		]})
+
+
+class ExportAPI(APIView):
+	"""
+	All posts, comments or votes as newline-delimited JSON streamed in chunks, for analytics.
+	Optional since parameter selects posts and comments changed after given ISO date or datetime.
+	Stream is gzipped on the fly when client accepts it
+	"""
+	permission_classes = [IsAdminUser]
 
-	@method_decorator(cache_page(60 * 10))
 	def get(self, request, *args, **kwargs):
-		queryset = self.queryset.filter(author__username=kwargs.get('username'))
-		page = self.paginate_queryset(queryset)
-		serializer = self.serializer_class(page, many=True)
-		return self.paginator.get_paginated_response(serializer.data)
+		if kwargs['kind'] not in export.EXPORTS:
+			raise Http404
+		try:
+			since = request.query_params.get('since')
+			queryset = export.get_export_queryset(kwargs['kind'], export.parse_since(since) if since else None)
+		except ValueError as error:
+			raise ValidationError({'since': [str(error)]})
+
+		chunks = export.iter_ndjson(kwargs['kind'], queryset)
+		is_gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+		response = StreamingHttpResponse(
+			export.gzip_chunks(chunks) if is_gzipped else chunks, content_type='application/x-ndjson'
+		)
+		if is_gzipped:
+			response['Content-Encoding'] = 'gzip'
+		response['Content-Disposition'] = f'attachment; filename="{kwargs["kind"]}.ndjson"'
+		patch_vary_headers(response, ('Accept-Encoding',))
+		return response
@@ -0,0 +1,126 @@
+import functools
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Sum
+from django.db.models.expressions import RawSQL
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from forum.models import Post, Comment
+from .index import MAX_LOG_SIZE, SearchIndex, tokenize
+
+
+class BaseSearchBackend:
+    """
+    Search of posts by title, content and comments. Every query word has to be found, words match as prefixes.
+    Posts are ranked by relevance, where title matches weigh more than content and comments
+    """
+    title_weight = 3.0
+    content_weight = 1.0
+    comment_weight = 0.5
+
+    def search(self, query, category_id=None, limit=None):
+        """ Return ids of found posts ordered by relevance, at most limit or SEARCH_RESULTS_LIMIT ids """
+        raise NotImplementedError
+
+    def update(self, post_ids):
+        """ Called after posts or comments of given posts are created, changed or deleted """
+
+    @staticmethod
+    def get_limit(limit):
+        return limit or settings.SEARCH_RESULTS_LIMIT
+
+    @staticmethod
+    def rank(scores, limit):
+        """ Ids of the best scores, newer posts go first among equal scores """
+        return [post_id for post_id, score in sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[:limit]]
+
+
+class MySQLFulltextBackend(BaseSearchBackend):
+    """ FULLTEXT indexes of posts and comments in boolean mode, indexes are created by search migrations """
+
+    @staticmethod
+    def get_boolean_query(query):
+        return ' '.join(f'+{word}*' for word in tokenize(query))
+
+    def search(self, query, category_id=None, limit=None):
+        boolean_query = self.get_boolean_query(query)
+        if not boolean_query:
+            return []
+        limit = self.get_limit(limit)
+
+        posts = Post.objects.filter(
+            RawSQL('MATCH (posts.title, posts.content) AGAINST (%s IN BOOLEAN MODE)', [boolean_query], BooleanField())
+        ).annotate(score=RawSQL(
+            'MATCH (posts.title, posts.content) AGAINST (%s IN BOOLEAN MODE) * %s + '
+            'MATCH (posts.title) AGAINST (%s IN BOOLEAN MODE) * %s',
+            [boolean_query, self.content_weight, boolean_query, self.title_weight - self.content_weight],
+            FloatField()
+        ))
+        comments = Comment.objects.filter(
+            RawSQL('MATCH (comments.text) AGAINST (%s IN BOOLEAN MODE)', [boolean_query], BooleanField())
+        ).values('post_id').annotate(score=Sum(RawSQL(
+            'MATCH (comments.text) AGAINST (%s IN BOOLEAN MODE) * %s', [boolean_query, self.comment_weight],
+            FloatField()
+        )))
+
+        if category_id is not None:
+            posts = posts.filter(category_id=category_id)
+            comments = comments.filter(post__category_id=category_id)
+
+        scores = dict(posts.order_by('-score').values_list('pk', 'score')[:limit])
+        for post_id, score in comments.order_by('-score').values_list('post_id', 'score')[:limit]:
+            scores[post_id] = scores.get(post_id, 0) + score
+        return self.rank(scores, limit)
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """
+    Inverted index in SEARCH_INDEX_DIR for databases without full-text search, see search.index.
+    Index is built by rebuild_search_index command, changes are applied incrementally and merged by search.tasks
+    """
+
+    def __init__(self, directory=None):
+        self.index = SearchIndex(
+            directory or settings.SEARCH_INDEX_DIR, (self.title_weight, self.content_weight, self.comment_weight)
+        )
+
+    def update(self, post_ids):
+        if self.index.mark_changed(post_ids) >= MAX_LOG_SIZE:
+            # Tasks use backends, so they are imported on use
+            from .tasks import merge_search_index
+            merge_search_index.delay()
+
+    def rebuild(self, chunk_size=1000):
+        return self.index.rebuild(chunk_size)
+
+    def merge(self):
+        return self.index.merge()
+
+    def search(self, query, category_id=None, limit=None):
+        return self.index.search(query, category_id, self.get_limit(limit))
+
+
+def get_posts_by_ids(queryset, post_ids):
+    """ Posts of queryset in order of given ids, posts deleted after search are skipped """
+    posts = {
+        post.get('pk', post.get('id')) if isinstance(post, dict) else post.pk: post
+        for post in queryset.filter(pk__in=post_ids)
+    }
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+@functools.lru_cache
+def get_search_backend(backend=None):
+    """ Backend from SEARCH_BACKEND setting, MySQL full-text search is used by default on MySQL """
+    backend = backend or settings.SEARCH_BACKEND
+    if backend is None:
+        backend = 'search.backends.MySQLFulltextBackend' if connection.vendor == 'mysql' else \
+            'search.backends.InvertedIndexBackend'
+    return import_string(backend)()
+
+
+@receiver(setting_changed)
+def reset_search_backend(setting, **kwargs):
+    if setting in ('SEARCH_BACKEND', 'SEARCH_INDEX_DIR'):
+        get_search_backend.cache_clear()
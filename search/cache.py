@@ -0,0 +1,80 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .backends import get_search_backend
+from .index import tokenize
+
+HITS_KEY = 'search:cache:hits'
+MISSES_KEY = 'search:cache:misses'
+
+
+def normalize_query(query):
+    """ Every word is required and scores are summed, so order and repeats of words do not change results """
+    return ' '.join(sorted(set(tokenize(query))))
+
+
+def get_generation_key(category_id=None):
+    return 'search:generation' if category_id is None else f'search:generation:{category_id}'
+
+
+def get_generation(category_id=None):
+    """ Evicted generation starts from current time, so it never returns to a value of cached results """
+    key = get_generation_key(category_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def get_results_key(query, category_id, generation):
+    query_hash = hashlib.md5(query.encode()).hexdigest()
+    return f'search:results:{category_id or "all"}:{generation}:{query_hash}'
+
+
+def search(query, category_id=None):
+    """
+    Ids of found posts like backend search, results are cached per normalized query and category.
+    Generation is read before search, so results of search running during a change are stored under old generation
+    """
+    query = normalize_query(query)
+    if not query:
+        return []
+
+    key = get_results_key(query, category_id, get_generation(category_id))
+    post_ids = cache.get(key)
+    if post_ids is not None:
+        count_request(HITS_KEY)
+        return post_ids
+
+    count_request(MISSES_KEY)
+    post_ids = get_search_backend().search(query, category_id=category_id)
+    cache.set(key, post_ids, settings.SEARCH_CACHE_TIMEOUT)
+    return post_ids
+
+
+def count_request(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_stats():
+    hits, misses = cache.get(HITS_KEY, 0), cache.get(MISSES_KEY, 0)
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses) if hits + misses else None}
+
+
+def invalidate(category_ids):
+    """ Drop cached results of given categories and of searches in all categories after commit """
+    def bump():
+        for category_id in [None, *set(category_ids)]:
+            try:
+                cache.incr(get_generation_key(category_id))
+            except ValueError:
+                pass
+
+    transaction.on_commit(bump)
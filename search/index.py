@@ -0,0 +1,481 @@
+import array
+import bisect
+import heapq
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from pathlib import Path
+from django.utils.html import strip_tags
+from forum.models import Post, Comment
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Segment file: header, words joined by new lines, then arrays of word offsets, posting ids, posting weights,
+# document ids and document categories. Every part is padded to 8 bytes
+SEGMENT_MAGIC = b'FSIDX001'
+SEGMENT_HEADER = struct.Struct('<8sQQQQ')
+OFFSET_TYPE, ID_TYPE, WEIGHT_TYPE = 'q', 'q', 'f'
+
+# Query word matches at most this amount of indexed words as prefix, short prefixes of more words
+# keep the words found in the most posts, posts having only rarer words are not found
+MAX_PREFIX_WORDS = 64
+# Sorts after every word starting with prefix, words are made of \w characters
+PREFIX_END = '\U0010ffff'
+# Log of this size is merged into new segment by search.tasks, so changes kept in memory of processes are bounded
+MAX_LOG_SIZE = 64 * 1024
+# Candidates found by previous query words are looked up in postings by binary search
+# when postings are this many times longer than candidates
+LOOKUP_RATIO = 16
+
+
+def tokenize(text):
+    """ Lowercase words of text, html tags of post content are dropped """
+    return TOKEN_RE.findall(strip_tags(text).lower())
+
+
+def get_word_weights(texts):
+    """ Return {word: weight} of document given as [(text, weight)] """
+    weights = {}
+    for text, weight in texts:
+        for word in tokenize(text):
+            weights[word] = weights.get(word, 0) + weight
+    return weights
+
+
+def iter_documents(weights, post_ids=None, chunk_size=1000):
+    """
+    Yield (post_id, category_id, [(text, weight)]) in pk order, document of post includes its comments.
+    Posts are walked by pk ranges, so memory does not depend on amount of posts
+    """
+    title_weight, content_weight, comment_weight = weights
+    posts = Post.objects.order_by('pk').values_list('pk', 'category_id', 'title', 'content')
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    last_pk = 0
+
+    while True:
+        chunk = list(posts.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+
+        comments = {}
+        for post_id, text in Comment.objects.filter(
+            post_id__in=[pk for pk, *fields in chunk]
+        ).order_by().values_list('post_id', 'text'):
+            comments.setdefault(post_id, []).append((text, comment_weight))
+
+        for pk, category_id, title, content in chunk:
+            yield pk, category_id, [(title, title_weight), (content, content_weight), *comments.get(pk, [])]
+        last_pk = chunk[-1][0]
+
+
+def write_segment(path, documents):
+    """ Write segment of documents given in increasing post id order, return amount of documents """
+    postings = {}
+    doc_ids = array.array(ID_TYPE)
+    doc_categories = array.array(ID_TYPE)
+
+    for post_id, category_id, texts in documents:
+        doc_ids.append(post_id)
+        doc_categories.append(category_id)
+        for word, weight in get_word_weights(texts).items():
+            if word not in postings:
+                postings[word] = (array.array(ID_TYPE), array.array(WEIGHT_TYPE))
+            postings[word][0].append(post_id)
+            postings[word][1].append(weight)
+    return write_postings(path, postings, doc_ids, doc_categories)
+
+
+def write_postings(path, postings, doc_ids, doc_categories):
+    """ Write segment of {word: (ids, weights)} and arrays of documents, ids increase, return amount of documents """
+    words = sorted(postings)
+    offsets = array.array(OFFSET_TYPE, [0])
+    posting_ids = array.array(ID_TYPE)
+    posting_weights = array.array(WEIGHT_TYPE)
+    for word in words:
+        ids, weights = postings.pop(word)
+        posting_ids.extend(ids)
+        posting_weights.extend(weights)
+        offsets.append(len(posting_ids))
+
+    blob = '\n'.join(words).encode()
+    parts = [
+        SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(words), len(posting_ids), len(doc_ids), len(blob)), blob,
+        offsets.tobytes(), posting_ids.tobytes(), posting_weights.tobytes(), doc_ids.tobytes(), doc_categories.tobytes()
+    ]
+
+    # Segment appears under its name only when it is completely written
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=Path(path).parent, suffix='.tmp')
+    with os.fdopen(file_descriptor, 'wb') as file:
+        for part in parts:
+            file.write(part)
+            file.write(b'\0' * (-len(part) % 8))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    return len(doc_ids)
+
+
+class Segment:
+    """ Read-only segment file mapped into memory, postings are read from the file without copying """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        magic, words_count, postings_count, docs_count, blob_size = SEGMENT_HEADER.unpack_from(view)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f'{path} is not a search index segment')
+        position = SEGMENT_HEADER.size
+
+        def take(size, typecode=None):
+            nonlocal position
+            part = view[position:position + size]
+            position += size + (-size % 8)
+            return part.cast(typecode) if typecode else part
+
+        blob = bytes(take(blob_size))
+        self.words = blob.decode().split('\n') if words_count else []
+        self.offsets = take((words_count + 1) * array.array(OFFSET_TYPE).itemsize, OFFSET_TYPE)
+        self.ids = take(postings_count * array.array(ID_TYPE).itemsize, ID_TYPE)
+        self.weights = take(postings_count * array.array(WEIGHT_TYPE).itemsize, WEIGHT_TYPE)
+        self.doc_ids = take(docs_count * array.array(ID_TYPE).itemsize, ID_TYPE)
+        self.doc_categories = take(docs_count * array.array(ID_TYPE).itemsize, ID_TYPE)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def get_prefix_words(self, prefix):
+        """ Return indexes of words starting with prefix, at most MAX_PREFIX_WORDS with the longest postings """
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + PREFIX_END, start)
+        if end - start <= MAX_PREFIX_WORDS:
+            return range(start, end)
+        offsets = self.offsets
+        return sorted(heapq.nlargest(MAX_PREFIX_WORDS, range(start, end), key=lambda i: offsets[i + 1] - offsets[i]))
+
+    def get_postings(self, word_index):
+        start, end = self.offsets[word_index], self.offsets[word_index + 1]
+        return self.ids[start:end], self.weights[start:end]
+
+    def get_category(self, post_id):
+        i = bisect.bisect_left(self.doc_ids, post_id)
+        if i < len(self.doc_ids) and self.doc_ids[i] == post_id:
+            return self.doc_categories[i]
+        return None
+
+
+class SearchIndex:
+    """
+    Index stored in directory as segment-<generation>.seg built by rebuild() and changes-<generation>.log
+    with ids of posts changed after it. CURRENT file names the generation in use.
+
+    Every process maps the segment and replays new lines of the log before search: documents of changed posts
+    are read from the database into memory and replace their segment documents.
+
+    Index is built only by rebuild(), i.e. rebuild_search_index command, search finds nothing until it is built.
+    Log longer than MAX_LOG_SIZE is merged into segment of new generation by merge().
+    Concurrent rebuilds and merges claim different generations and the newest one stays in use.
+    """
+
+    def __init__(self, directory, weights):
+        self.directory = Path(directory)
+        self.weights = weights
+        self._lock = threading.RLock()
+        self._generation = None
+        self._segment = None
+        self._log_position = 0
+        # {post_id: (category_id, {word: weight})} of changed posts, None for deleted ones
+        self._changed = {}
+        self._changed_postings = {}
+        self._changed_words = []
+        self._documents_count = 0
+
+    def get_generation(self):
+        try:
+            return int((self.directory / 'CURRENT').read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def get_log_path(self, generation):
+        return self.directory / f'changes-{generation}.log'
+
+    def mark_changed(self, post_ids):
+        """ Append ids of changed posts to the log and return its size, nothing is written before index is built """
+        generation = self.get_generation()
+        if generation is None:
+            return 0
+        with open(self.get_log_path(generation), 'a') as log:
+            log.write(''.join(f'{post_id}\n' for post_id in post_ids))
+            return log.tell()
+
+    def get_log_size(self):
+        generation = self.get_generation()
+        try:
+            return self.get_log_path(generation).stat().st_size if generation else 0
+        except FileNotFoundError:
+            return 0
+
+    def claim_generation(self, generation):
+        """ Return first generation after given one whose log is created by this call, so no other rebuild uses it """
+        while True:
+            generation += 1
+            try:
+                os.close(os.open(self.get_log_path(generation), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return generation
+            except FileExistsError:
+                pass
+
+    def rebuild(self, chunk_size=1000):
+        """ Index all posts into new generation and switch to it, return amount of indexed posts """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        old_generation = self.get_generation()
+        old_log_path = self.get_log_path(old_generation)
+        log_position = old_log_path.stat().st_size if old_generation and old_log_path.exists() else 0
+        generation = self.claim_generation(old_generation or 0)
+
+        indexed = write_segment(
+            self.directory / f'segment-{generation}.seg', iter_documents(self.weights, chunk_size=chunk_size)
+        )
+        self.switch_generation(old_generation, generation, log_position)
+        return indexed
+
+    def merge(self):
+        """
+        Write current segment with logged changes applied as new generation and switch to it,
+        return amount of documents. Changed posts are already read by refresh, so posts are not read again
+        """
+        with self._lock:
+            if not self.refresh():
+                return 0
+            segment, changed, changed_postings = self._segment, self._changed, self._changed_postings
+            generation = self.claim_generation(self._generation)
+
+            postings = {}
+            for word_index, word in enumerate(segment.words):
+                ids, weights = segment.get_postings(word_index)
+                word_postings = {post_id: weight for post_id, weight in zip(ids, weights) if post_id not in changed}
+                word_postings.update(changed_postings.get(word, {}))
+                if word_postings:
+                    postings[word] = word_postings
+            for word, word_postings in changed_postings.items():
+                if word_postings and word not in postings:
+                    postings[word] = word_postings
+
+            documents = {
+                post_id: category_id for post_id, category_id in zip(segment.doc_ids, segment.doc_categories)
+                if post_id not in changed
+            }
+            documents.update((post_id, document[0]) for post_id, document in changed.items() if document is not None)
+            doc_ids = sorted(documents)
+
+            def get_arrays(word_postings):
+                ids = sorted(word_postings)
+                return array.array(ID_TYPE, ids), array.array(WEIGHT_TYPE, [word_postings[post_id] for post_id in ids])
+
+            merged = write_postings(
+                self.directory / f'segment-{generation}.seg',
+                {word: get_arrays(word_postings) for word, word_postings in postings.items()},
+                array.array(ID_TYPE, doc_ids), array.array(ID_TYPE, [documents[post_id] for post_id in doc_ids])
+            )
+            self.switch_generation(self._generation, generation, self._log_position)
+            return merged
+
+    def switch_generation(self, old_generation, generation, log_position):
+        """
+        Make written segment of generation current, changes logged to old generation after log_position are
+        carried to the new one. Generation older than current one is deleted instead
+        """
+        old_log_path = self.get_log_path(old_generation)
+
+        def carry_changes():
+            """ Posts changed while segment was written could be missed by it, new generation checks them again """
+            nonlocal log_position
+            if old_generation and old_log_path.exists():
+                with open(old_log_path) as old_log:
+                    old_log.seek(log_position)
+                    changes = old_log.read()
+                    log_position = old_log.tell()
+                with open(self.get_log_path(generation), 'a') as log:
+                    log.write(changes)
+
+        carry_changes()
+        # Rebuild which started later finished first, its generation has the newer posts
+        if (self.get_generation() or 0) > generation:
+            self.delete_generations([generation])
+            return
+
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w') as file:
+            file.write(str(generation))
+        os.replace(temporary_path, self.directory / 'CURRENT')
+        # Writers which read old CURRENT right before the switch appended to old log
+        carry_changes()
+
+        self.delete_generations(range(1, generation))
+
+    def delete_generations(self, generations):
+        """ Processes keep reading mapped segments of deleted generations until their next refresh """
+        for path in self.directory.glob('segment-*.seg'):
+            if self.parse_generation(path) in generations:
+                path.unlink(missing_ok=True)
+        for path in self.directory.glob('changes-*.log'):
+            if self.parse_generation(path) in generations:
+                path.unlink(missing_ok=True)
+
+    @staticmethod
+    def parse_generation(path):
+        try:
+            return int(path.stem.split('-', 1)[1])
+        except ValueError:
+            return None
+
+    def refresh(self):
+        """ Map current segment and apply changes logged since last refresh, return False when index is not built """
+        generation = self.get_generation()
+        if generation is None:
+            logger.warning('Search index in %s is not built, run rebuild_search_index command', self.directory)
+            return False
+
+        if generation != self._generation:
+            self._segment = Segment(self.directory / f'segment-{generation}.seg')
+            self._generation = generation
+            self._log_position = 0
+            self._changed, self._changed_postings, self._changed_words = {}, {}, []
+            self._documents_count = len(self._segment)
+
+        try:
+            with open(self.get_log_path(generation), 'rb') as log:
+                log.seek(self._log_position)
+                data = log.read()
+        except FileNotFoundError:
+            return True
+
+        # Only complete lines are applied, the rest is read by next refresh
+        data = data[:data.rfind(b'\n') + 1]
+        if data:
+            self._log_position += len(data)
+            self.apply_changes({int(line) for line in data.split()})
+        return True
+
+    def apply_changes(self, post_ids):
+        documents = {
+            post_id: (category_id, get_word_weights(texts))
+            for post_id, category_id, texts in iter_documents(self.weights, post_ids=post_ids)
+        }
+
+        for post_id in post_ids:
+            old_document = self._changed.get(post_id)
+            if old_document is not None:
+                for word in old_document[1]:
+                    self._changed_postings[word].pop(post_id, None)
+
+            document = documents.get(post_id)
+            self._changed[post_id] = document
+            if document is not None:
+                for word, weight in document[1].items():
+                    self._changed_postings.setdefault(word, {})[post_id] = weight
+
+        self._changed_words = sorted(word for word, posts in self._changed_postings.items() if posts)
+        # Changed post replaces its segment document, deleted post is not counted
+        segment = self._segment
+        self._documents_count = len(segment) + sum(
+            (document is not None) - (segment.get_category(post_id) is not None)
+            for post_id, document in self._changed.items()
+        )
+
+    def search(self, query, category_id=None, limit=1000):
+        """ Return ids of posts containing every query word as prefix, ordered by relevance """
+        words = tokenize(query)
+        if not words:
+            return []
+
+        with self._lock:
+            if not self.refresh():
+                return []
+            return self._search(words, category_id, limit)
+
+    def _get_word_postings(self, query_word):
+        """
+        Return [(ids, weights, idf)] of indexed words starting with query word,
+        postings of changed posts are {post_id: weight} given as ids with None weights
+        """
+        segment = self._segment
+        documents_count = self._documents_count
+        postings = []
+
+        for word_index in segment.get_prefix_words(query_word):
+            ids, weights = segment.get_postings(word_index)
+            postings.append((ids, weights, math.log(1 + documents_count / len(ids))))
+
+        changed_words = self._changed_words
+        start = bisect.bisect_left(changed_words, query_word)
+        end = bisect.bisect_left(changed_words, query_word + PREFIX_END, start)
+        words = changed_words[start:end]
+        if len(words) > MAX_PREFIX_WORDS:
+            words = heapq.nlargest(MAX_PREFIX_WORDS, words, key=lambda word: len(self._changed_postings[word]))
+        for word in words:
+            changed = self._changed_postings[word]
+            postings.append((changed, None, math.log(1 + documents_count / len(changed))))
+
+        return postings
+
+    def _search(self, words, category_id, limit):
+        changed = self._changed
+        word_postings = sorted(
+            (self._get_word_postings(word) for word in dict.fromkeys(words)),
+            key=lambda postings: sum(len(ids) for ids, weights, idf in postings)
+        )
+        scores = None
+
+        # The rarest word goes first, so next words only check found candidates
+        for postings in word_postings:
+            word_scores = {}
+            for ids, weights, idf in postings:
+                # Segment postings of changed posts are outdated, changed postings are dicts without weights
+                from_segment = weights is not None
+
+                if scores is not None and len(ids) > len(scores) * LOOKUP_RATIO:
+                    for post_id in scores:
+                        if from_segment:
+                            i = bisect.bisect_left(ids, post_id)
+                            if i < len(ids) and ids[i] == post_id and post_id not in changed:
+                                word_scores[post_id] = word_scores.get(post_id, 0) + weights[i] * idf
+                        else:
+                            weight = ids.get(post_id)
+                            if weight is not None:
+                                word_scores[post_id] = word_scores.get(post_id, 0) + weight * idf
+                    continue
+
+                for post_id, weight in zip(ids, weights) if from_segment else ids.items():
+                    if from_segment and post_id in changed:
+                        continue
+                    if scores is None or post_id in scores:
+                        word_scores[post_id] = word_scores.get(post_id, 0) + weight * idf
+
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {post_id: score + word_scores[post_id] for post_id, score in scores.items() if post_id in word_scores}
+            if not scores:
+                return []
+
+        if category_id is not None:
+            scores = {
+                post_id: score for post_id, score in scores.items() if self.get_category(post_id) == category_id
+            }
+        return [post_id for post_id, score in heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))]
+
+    def get_category(self, post_id):
+        if post_id in self._changed:
+            document = self._changed[post_id]
+            return document[0] if document is not None else None
+        return self._segment.get_category(post_id)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from forum.models import Category
+from search import cache
+from search.backends import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Build search index of all posts from scratch, posts are read in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Amount of posts read by one query')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if not hasattr(backend, 'rebuild'):
+            raise CommandError(f'{type(backend).__name__} has no index to rebuild')
+
+        indexed = backend.rebuild(options['chunk_size'])
+        # Results cached before the index was built are empty
+        cache.invalidate(Category.objects.values_list('pk', flat=True))
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} posts'))
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# (table, index name, columns) of indexes used by search.backends.MySQLFulltextBackend
+FULLTEXT_INDEXES = [
+    ('posts', 'posts_title_content_fulltext', ['title', 'content']),
+    ('posts', 'posts_title_fulltext', ['title']),
+    ('comments', 'comments_text_fulltext', ['text']),
+]
+
+
+def create_fulltext_indexes(apps, schema_editor):
+    """ Only MySQL gets FULLTEXT indexes, other databases are searched by in-process inverted index """
+    if schema_editor.connection.vendor != 'mysql':
+        return
+
+    quote_name = schema_editor.quote_name
+    for table, name, columns in FULLTEXT_INDEXES:
+        schema_editor.execute(
+            f'ALTER TABLE {quote_name(table)} ADD FULLTEXT INDEX {quote_name(name)} '
+            f'({", ".join(quote_name(column) for column in columns)})'
+        )
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+
+    quote_name = schema_editor.quote_name
+    for table, name, columns in FULLTEXT_INDEXES:
+        schema_editor.execute(f'ALTER TABLE {quote_name(table)} DROP INDEX {quote_name(name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0007_post_comment_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_indexes, drop_fulltext_indexes),
+    ]
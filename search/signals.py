@@ -0,0 +1,35 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from forum.models import Post, Comment, Category
+from . import cache
+from .backends import get_search_backend
+from .suggestions import SuggestionIndex
+
+
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=Comment)
+def update_search_index(sender, instance, **kwargs):
+    """
+    Index reads changed posts from the database, so it is updated only after commit.
+    Cached results are dropped after the index is updated, otherwise they could be cached again from old index
+    """
+    post_id = instance.pk if sender is Post else instance.post_id
+    transaction.on_commit(lambda: get_search_backend().update([post_id]))
+
+    if sender is Post:
+        # Category before change is remembered by forum.signals
+        category_ids = [instance.category_id]
+        if getattr(instance, '_counted_fields', None):
+            category_ids.append(instance._counted_fields['category_id'])
+    elif Comment.post.is_cached(instance):
+        category_ids = [instance.post.category_id]
+    else:
+        category_ids = Post.objects.filter(pk=instance.post_id).values_list('category_id', flat=True)[:1]
+    cache.invalidate(list(category_ids))
+
+
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=Category)
+def update_suggestions(sender, instance, **kwargs):
+    SuggestionIndex.record_change('post' if sender is Post else 'category', instance.pk)
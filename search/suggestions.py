@@ -0,0 +1,172 @@
+import bisect
+import functools
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from forum.models import Post, Category
+from .index import tokenize
+
+VERSION_KEY = 'search:suggestions:version'
+# Changes older than this are dropped, processes which missed them load titles again
+CHANGES_TIMEOUT = 60 * 60
+# Process behind by more changes loads titles again instead of reading the changes
+MAX_READ_CHANGES = 1000
+
+
+class SuggestionIndex:
+    """
+    Post and category titles of the process memory, found by prefixes of their words.
+    Keys are kept as sorted array of (word, kind, pk), so prefix is a range found by binary search.
+
+    Saved and deleted titles are recorded in the cache as numbered changes. Process compares its version with
+    the cached one at most once per SEARCH_SUGGESTIONS_REFRESH_INTERVAL and reads only titles which changed.
+    Titles are loaded again without holding the lock, other threads search old titles meanwhile
+    """
+    models = {'category': Category, 'post': Post}
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._keys = []
+        self._titles = {}
+        self._version = None
+        self._loaded = False
+        self._checked_at = 0
+
+    def suggest(self, query, limit=None):
+        """ Return [(kind, pk, title)] of titles having every query word as word prefix, categories go first """
+        words = tokenize(query)
+        if not words:
+            return []
+        limit = limit or settings.SEARCH_SUGGESTIONS_LIMIT
+
+        self.refresh()
+        with self._lock:
+            # The last word is being typed, so it is looked up and the rest is checked in found titles
+            last_word, other_words = words[-1], words[:-1]
+            keys = self._keys
+            start = bisect.bisect_left(keys, (last_word,))
+            found = {}
+            # Scanned keys are limited, not found titles, so titles lacking other words do not make the walk longer
+            for i in range(start, min(start + settings.SEARCH_SUGGESTIONS_SCAN_LIMIT, len(keys))):
+                word, kind, pk = keys[i]
+                if not word.startswith(last_word):
+                    break
+                title = self._titles[(kind, pk)]
+                if (kind, pk) not in found and self.has_words(title, other_words):
+                    found[(kind, pk)] = title
+
+        # Titles starting with the query go before titles containing its words,
+        # categories are ordered by title and newer posts go first
+        query_prefix = ' '.join(words)
+        return sorted(
+            ((kind, pk, title) for (kind, pk), title in found.items()),
+            key=lambda item: (
+                item[0] != 'category', not ' '.join(tokenize(item[2])).startswith(query_prefix),
+                item[2] if item[0] == 'category' else '', -item[1]
+            )
+        )[:limit]
+
+    @staticmethod
+    def has_words(title, prefixes):
+        title_words = tokenize(title)
+        return all(any(word.startswith(prefix) for word in title_words) for prefix in prefixes)
+
+    def refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded and now - self._checked_at < settings.SEARCH_SUGGESTIONS_REFRESH_INTERVAL:
+                return
+            self._checked_at = now
+
+            version = cache.get(VERSION_KEY)
+            if version is None:
+                cache.add(VERSION_KEY, 0, None)
+                version = cache.get(VERSION_KEY, 0)
+
+            if self._loaded and self._version < version <= self._version + MAX_READ_CHANGES:
+                changes = cache.get_many(
+                    [self.get_change_key(number) for number in range(self._version + 1, version + 1)]
+                )
+                if len(changes) == version - self._version:
+                    self.apply(changes.values())
+                    self._version = version
+                    return
+            elif self._loaded and version == self._version:
+                return
+        self.load(version)
+
+    def load(self, version):
+        """
+        Version is read before titles, so changes made meanwhile are applied again by next refresh.
+        New arrays are built outside of the lock and replace old ones at once
+        """
+        with self._load_lock:
+            keys, titles = [], {}
+            for kind, model in self.models.items():
+                for pk, title in model.objects.order_by().values_list('pk', 'title').iterator():
+                    titles[(kind, pk)] = title
+                    keys.extend((word, kind, pk) for word in set(tokenize(title)))
+            keys.sort()
+
+            with self._lock:
+                self._keys, self._titles = keys, titles
+                self._version = version
+                self._loaded = True
+
+    def apply(self, changes):
+        pks = {}
+        for kind, pk in changes:
+            pks.setdefault(kind, set()).add(pk)
+
+        for kind, kind_pks in pks.items():
+            titles = dict(self.models[kind].objects.filter(pk__in=kind_pks).values_list('pk', 'title'))
+            for pk in kind_pks:
+                self.set_title(kind, pk, titles.get(pk))
+
+    def set_title(self, kind, pk, title):
+        """ Replace keys of title, None removes it """
+        old_title = self._titles.pop((kind, pk), None)
+        if old_title is not None:
+            for word in set(tokenize(old_title)):
+                i = bisect.bisect_left(self._keys, (word, kind, pk))
+                if i < len(self._keys) and self._keys[i] == (word, kind, pk):
+                    del self._keys[i]
+
+        if title is not None:
+            self._titles[(kind, pk)] = title
+            for word in set(tokenize(title)):
+                bisect.insort(self._keys, (word, kind, pk))
+
+    @staticmethod
+    def get_change_key(number):
+        return f'search:suggestions:change:{number}'
+
+    @classmethod
+    def record_change(cls, kind, pk):
+        """ Number the change after commit, processes read the changed title from the database """
+        def record():
+            try:
+                number = cache.incr(VERSION_KEY)
+            except ValueError:
+                # Version was evicted, processes with greater version load titles again
+                cache.add(VERSION_KEY, 0, None)
+                number = cache.incr(VERSION_KEY)
+            cache.set(cls.get_change_key(number), (kind, pk), CHANGES_TIMEOUT)
+
+        transaction.on_commit(record)
+
+
+@functools.lru_cache
+def get_suggestion_index():
+    return SuggestionIndex()
+
+
+@receiver(setting_changed)
+def reset_suggestion_index(setting, **kwargs):
+    if setting in ('CACHES', 'SEARCH_SUGGESTIONS_REFRESH_INTERVAL'):
+        get_suggestion_index.cache_clear()
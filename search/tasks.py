@@ -0,0 +1,20 @@
+from django.core.cache import cache
+from project.celery import app
+from .backends import get_search_backend
+from .index import MAX_LOG_SIZE
+
+MERGE_LOCK_KEY = 'locks:search:merge'
+MERGE_LOCK_TIMEOUT = 10 * 60
+
+
+@app.task(ignore_result=True)
+def merge_search_index():
+    """ Every update past MAX_LOG_SIZE queues the merge, so one worker merges and the rest find a short log """
+    backend = get_search_backend()
+    if not hasattr(backend, 'merge') or not cache.add(MERGE_LOCK_KEY, 1, MERGE_LOCK_TIMEOUT):
+        return
+    try:
+        if backend.index.get_log_size() >= MAX_LOG_SIZE:
+            backend.merge()
+    finally:
+        cache.delete(MERGE_LOCK_KEY)
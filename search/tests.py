@@ -0,0 +1,358 @@
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+from pathlib import Path
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from forum.models import Post
+from forum.tests import create_category, create_post, create_comment
+from users.tests import create_user
+from . import cache as search_cache
+from .backends import get_search_backend, tokenize, InvertedIndexBackend
+from .index import MAX_PREFIX_WORDS, Segment, write_segment
+from .suggestions import VERSION_KEY, SuggestionIndex
+from .tasks import merge_search_index
+
+
+class SearchTestMixin:
+    """
+    Every test gets empty cache and index built in new SEARCH_INDEX_DIR,
+    index and results of previous tests have flushed rows
+    """
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.index_dir = tempfile.mkdtemp()
+        self.index_dir_settings = override_settings(SEARCH_INDEX_DIR=Path(self.index_dir))
+        self.index_dir_settings.enable()
+        if hasattr(get_search_backend(), 'rebuild'):
+            get_search_backend().rebuild()
+        super(SearchTestMixin, self).setUp()
+
+    def tearDown(self) -> None:
+        super(SearchTestMixin, self).tearDown()
+        self.index_dir_settings.disable()
+        shutil.rmtree(self.index_dir)
+
+
+class SearchBackendTest(SearchTestMixin, TransactionTestCase):
+    """ MySQL full-text indexes see only committed rows """
+
+    def setUp(self) -> None:
+        super(SearchBackendTest, self).setUp()
+        self.user = create_user()
+        self.category = create_category('Category1')
+        self.other_category = create_category('Category2')
+
+    def search(self, query, **kwargs):
+        return get_search_backend().search(query, **kwargs)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('<p>Hello, <b>World</b>!</p> 2023'), ['hello', 'world', '2023'])
+
+    def test_relevance(self):
+        in_comment = create_post(author=self.user, category=self.category, title='First', content='Nothing')
+        create_comment(author=self.user, post=in_comment, text='Django is mentioned here')
+        in_content = create_post(
+            author=self.user, category=self.category, title='Second', content='<p>About django</p>'
+        )
+        in_title = create_post(author=self.user, category=self.category, title='Django tips', content='Text')
+        create_post(author=self.user, category=self.category, title='Unrelated', content='Text')
+
+        self.assertEqual(self.search('django'), [in_title.pk, in_content.pk, in_comment.pk])
+
+    def test_every_word_is_required_as_prefix(self):
+        both = create_post(author=self.user, category=self.category, title='Python decorators', content='Text')
+        create_post(author=self.user, category=self.category, title='Python generators', content='Text')
+
+        self.assertEqual(self.search('pyth decor'), [both.pk])
+        self.assertEqual(self.search('rust'), [])
+        self.assertEqual(self.search('  '), [])
+
+    def test_category_filter(self):
+        create_post(author=self.user, category=self.category, title='Search me', content='Text')
+        other = create_post(author=self.user, category=self.other_category, title='Search me too', content='Text')
+
+        self.assertEqual(self.search('search', category_id=self.other_category.pk), [other.pk])
+
+    def test_results_follow_changes(self):
+        post = create_post(author=self.user, category=self.category, title='Original', content='Text')
+        self.assertEqual(self.search('original'), [post.pk])
+
+        post.title = 'Changed'
+        post.save()
+        self.assertEqual(self.search('original'), [])
+        self.assertEqual(self.search('changed'), [post.pk])
+
+        post.delete()
+        self.assertEqual(self.search('changed'), [])
+
+
+class SearchIndexTest(SearchTestMixin, TransactionTestCase):
+    def setUp(self) -> None:
+        super(SearchIndexTest, self).setUp()
+        self.user = create_user()
+        self.category = create_category('Category1')
+
+    def get_backend(self):
+        """ New backend has nothing in memory, like backend of another process """
+        return InvertedIndexBackend(self.index_dir)
+
+    def test_segment(self):
+        path = Path(self.index_dir) / 'test.seg'
+        documents = [(1, 10, [('Alpha beta', 1.0)]), (5, 20, [('Beta', 2.0), ('beta gamma', 0.5)])]
+        self.assertEqual(write_segment(path, documents), 2)
+
+        segment = Segment(path)
+        self.assertEqual(len(segment), 2)
+        self.assertEqual(segment.words, ['alpha', 'beta', 'gamma'])
+        ids, weights = segment.get_postings(1)
+        self.assertEqual((list(ids), list(weights)), ([1, 5], [1.0, 2.5]))
+        self.assertEqual([segment.words[i] for i in segment.get_prefix_words('be')], ['beta'])
+        self.assertEqual((segment.get_category(5), segment.get_category(2)), (20, None))
+
+        self.assertEqual(write_segment(path, []), 0)
+        self.assertEqual(Segment(path).words, [])
+
+    def test_changes_reach_other_processes(self):
+        post = create_post(author=self.user, category=self.category, title='Original', content='Text')
+        backend, other_backend = self.get_backend(), self.get_backend()
+        self.assertEqual(backend.search('original'), [post.pk])
+        self.assertEqual(other_backend.search('original'), [post.pk])
+
+        post.title = 'Changed'
+        post.save()
+        backend.update([post.pk])
+        new_post = create_post(author=self.user, category=self.category, title='Changed too', content='Text')
+        backend.update([new_post.pk])
+
+        self.assertEqual(other_backend.search('original'), [])
+        self.assertEqual(other_backend.search('changed'), [new_post.pk, post.pk])
+        self.assertEqual(other_backend.search('changed too'), [new_post.pk])
+
+        comment = create_comment(author=self.user, post=post, text='Commented')
+        backend.update([comment.post_id])
+        self.assertEqual(other_backend.search('commented'), [post.pk])
+
+        post_id = post.pk
+        post.delete()
+        backend.update([post_id])
+        self.assertEqual(other_backend.search('changed'), [new_post.pk])
+
+    def test_rebuild_command(self):
+        posts = [create_post(author=self.user, category=self.category, title=f'Topic {i}') for i in range(5)]
+        backend = self.get_backend()
+        self.assertEqual(backend.search('topic', limit=2), [posts[4].pk, posts[3].pk])
+
+        Post.objects.filter(pk=posts[0].pk).update(title='Renamed')
+        output = StringIO()
+        call_command('rebuild_search_index', chunk_size=2, stdout=output)
+        self.assertIn('Indexed 5 posts', output.getvalue())
+
+        self.assertEqual(backend.search('renamed'), [posts[0].pk])
+        self.assertEqual(backend.search('topic'), [post.pk for post in reversed(posts[1:])])
+        self.assertEqual(len(list(Path(self.index_dir).glob('segment-*'))), 1)
+
+    def test_merge(self):
+        posts = [create_post(author=self.user, category=self.category, title=f'Topic {i}') for i in range(3)]
+        backend = self.get_backend()
+        backend.rebuild()
+        posts[0].title = 'Renamed'
+        posts[0].save()
+        deleted_id = posts[1].pk
+        posts[1].delete()
+        new_post = create_post(author=self.user, category=self.category, title='Topic new')
+        backend.update([posts[0].pk, deleted_id, new_post.pk])
+        self.assertEqual(backend.search('topic'), [new_post.pk, posts[2].pk])
+        # Candidates are looked up in segment and changed postings
+        with mock.patch('search.index.LOOKUP_RATIO', 0):
+            self.assertEqual(backend.search('topic new'), [new_post.pk])
+            self.assertEqual(backend.search('topic 2'), [posts[2].pk])
+        # Changed post replaces its document, deleted one is not counted
+        self.assertEqual(backend.index._documents_count, 3)
+
+        generation = backend.index.get_generation()
+        with mock.patch('search.tasks.MAX_LOG_SIZE', 1):
+            merge_search_index()
+        self.assertEqual(backend.index.get_generation(), generation + 1)
+        self.assertEqual(backend.index.get_log_size(), 0)
+
+        other_backend = self.get_backend()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(other_backend.search('topic'), [new_post.pk, posts[2].pk])
+            self.assertEqual(other_backend.search('renamed'), [posts[0].pk])
+        self.assertEqual(len(queries), 0)
+        self.assertEqual((other_backend.index._changed, other_backend.index._documents_count), ({}, 3))
+
+    def test_long_log_queues_merge(self):
+        post = create_post(author=self.user, category=self.category, title='Topic')
+        backend = self.get_backend()
+        with mock.patch('search.tasks.merge_search_index.delay') as delay:
+            backend.update([post.pk])
+            self.assertFalse(delay.called)
+            with mock.patch('search.backends.MAX_LOG_SIZE', 1):
+                backend.update([post.pk])
+        self.assertTrue(delay.called)
+
+    def test_search_does_not_build_index(self):
+        create_post(author=self.user, category=self.category, title='Topic')
+        backend = InvertedIndexBackend(Path(self.index_dir) / 'missing')
+        with self.assertLogs('search.index', 'WARNING') as logs:
+            self.assertEqual(backend.search('topic'), [])
+        self.assertIn('rebuild_search_index', logs.output[0])
+        self.assertFalse((Path(self.index_dir) / 'missing').exists())
+
+    def test_concurrent_rebuilds_use_own_generations(self):
+        post = create_post(author=self.user, category=self.category, title='Topic')
+        backend, other_backend = self.get_backend(), self.get_backend()
+        generation = backend.index.get_generation()
+        # Other rebuild claimed the next generation and is still writing it
+        claimed = other_backend.index.claim_generation(generation)
+        self.assertEqual(claimed, generation + 1)
+        backend.rebuild()
+        self.assertEqual(backend.index.get_generation(), generation + 2)
+
+        # Rebuild finished later does not switch back to its older generation
+        with mock.patch.object(other_backend.index, 'claim_generation', return_value=claimed):
+            other_backend.rebuild()
+        self.assertEqual(backend.index.get_generation(), generation + 2)
+        self.assertEqual(other_backend.search('topic'), [post.pk])
+        self.assertEqual(
+            [path.name for path in Path(self.index_dir).glob('segment-*')], [f'segment-{generation + 2}.seg']
+        )
+
+    def test_short_prefix_keeps_most_frequent_words(self):
+        path = Path(self.index_dir) / 'test.seg'
+        rare_words = [f'w{i:03}' for i in range(MAX_PREFIX_WORDS)]
+        documents = [(i, 10, [(word, 1.0)]) for i, word in enumerate(rare_words, 1)]
+        documents += [(len(documents) + i, 10, [('wz', 1.0)]) for i in range(1, 3)]
+        write_segment(path, documents)
+
+        segment = Segment(path)
+        words = [segment.words[i] for i in segment.get_prefix_words('w')]
+        self.assertEqual(len(words), MAX_PREFIX_WORDS)
+        self.assertEqual(words[-1], 'wz')
+        self.assertEqual(len(segment.get_prefix_words('w0')), MAX_PREFIX_WORDS)
+
+
+class SuggestionIndexTest(TransactionTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = create_user()
+        self.category = create_category('Python')
+        self.index = SuggestionIndex()
+
+    def suggest(self, query, index=None):
+        return [(kind, title) for kind, pk, title in (index or self.index).suggest(query)]
+
+    def test_suggest(self):
+        create_post(author=self.user, category=self.category, title='Learning python decorators')
+        create_post(author=self.user, category=self.category, title='Python generators')
+        create_post(author=self.user, category=self.category, title='Rust')
+
+        self.assertEqual(
+            self.suggest('py'),
+            [('category', 'Python'), ('post', 'Python generators'), ('post', 'Learning python decorators')]
+        )
+        self.assertEqual(self.suggest('python dec'), [('post', 'Learning python decorators')])
+        self.assertEqual(self.suggest('go'), [])
+        self.assertEqual(self.suggest(' '), [])
+
+    @override_settings(SEARCH_SUGGESTIONS_REFRESH_INTERVAL=0)
+    def test_changes_are_read_without_loading_titles(self):
+        post = create_post(author=self.user, category=self.category, title='Original title')
+        other_index = SuggestionIndex()
+        self.assertEqual(self.suggest('orig', other_index), [('post', 'Original title')])
+
+        post.title = 'Changed title'
+        post.save()
+        create_post(author=self.user, category=self.category, title='New title')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.suggest('title', other_index), [('post', 'New title'), ('post', 'Changed title')])
+        # Only changed posts are read
+        self.assertEqual(len(queries), 1)
+
+        post.delete()
+        self.category.title = 'Rust'
+        self.category.save()
+        self.assertEqual(self.suggest('title', other_index), [('post', 'New title')])
+        self.assertEqual(self.suggest('rust', other_index), [('category', 'Rust')])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.suggest('rust', other_index)
+        self.assertEqual(len(queries), 0)
+
+    @override_settings(SEARCH_SUGGESTIONS_SCAN_LIMIT=3)
+    def test_scan_is_limited_by_scanned_keys(self):
+        for i in range(5):
+            create_post(author=self.user, category=self.category, title=f'Anything {i}')
+        self.suggest('any')
+
+        with mock.patch.object(SuggestionIndex, 'has_words', return_value=False) as has_words:
+            self.assertEqual(self.suggest('qwxyz any'), [])
+        self.assertEqual(has_words.call_count, 3)
+
+    def test_titles_are_suggested_while_loading(self):
+        create_post(author=self.user, category=self.category, title='Python generators')
+        self.assertEqual(self.suggest('gen'), [('post', 'Python generators')])
+        # Change which is not in the cache any more makes the next refresh load titles again
+        cache.incr(VERSION_KEY)
+        self.index._checked_at = 0
+        found = []
+
+        def tokenize_title(text):
+            """ Other thread suggests while titles are loaded, it gets old titles without waiting for the load """
+            if threading.current_thread() is threading.main_thread() and text == 'Python generators' and not found:
+                thread = threading.Thread(target=lambda: found.append(self.suggest('gen')))
+                thread.start()
+                thread.join(5)
+            return tokenize(text)
+
+        with mock.patch('search.suggestions.tokenize', side_effect=tokenize_title):
+            self.assertEqual(self.suggest('gen'), [('post', 'Python generators')])
+        self.assertEqual(found, [[('post', 'Python generators')]])
+
+
+class SearchCacheTest(SearchTestMixin, TransactionTestCase):
+    def setUp(self) -> None:
+        super(SearchCacheTest, self).setUp()
+        self.user = create_user()
+        self.category = create_category('Category1')
+        self.other_category = create_category('Category2')
+        self.post = create_post(author=self.user, category=self.category, title='Cached words')
+
+    def test_normalize_query(self):
+        self.assertEqual(search_cache.normalize_query('Words  <b>cached</b> words'), 'cached words')
+
+    def test_results_are_cached(self):
+        self.assertEqual(search_cache.search('cached words'), [self.post.pk])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(search_cache.search('WORDS cached'), [self.post.pk])
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(search_cache.get_stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_changes_drop_results_of_their_category(self):
+        self.assertEqual(search_cache.search('cached', self.category.pk), [self.post.pk])
+        self.assertEqual(search_cache.search('cached', self.other_category.pk), [])
+        self.assertEqual(search_cache.search('cached'), [self.post.pk])
+
+        other_post = create_post(author=self.user, category=self.other_category, title='Cached too')
+        self.assertEqual(search_cache.search('cached', self.category.pk), [self.post.pk])
+        self.assertEqual(search_cache.search('cached', self.other_category.pk), [other_post.pk])
+        self.assertEqual(search_cache.search('cached'), [other_post.pk, self.post.pk])
+        self.assertEqual(search_cache.get_stats()['hits'], 1)
+
+        # Moved post leaves results of both categories
+        self.post.category = self.other_category
+        self.post.save()
+        self.assertEqual(search_cache.search('cached', self.category.pk), [])
+        self.assertEqual(search_cache.search('cached', self.other_category.pk), [other_post.pk, self.post.pk])
+
+        self.assertEqual(search_cache.search('commented', self.other_category.pk), [])
+        create_comment(author=self.user, post=other_post, text='Commented')
+        self.assertEqual(search_cache.search('commented', self.other_category.pk), [other_post.pk])
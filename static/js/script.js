@@ -31,6 +31,11 @@ $(document).ready(function(){
 
     const csrf = $('form[name=post_rating_form] > input[name=csrfmiddlewaretoken]').val()
 
+    function setVoteButtons(likeBtn, dislikeBtn, myVote){
+        likeBtn.toggleClass('btn-success', myVote == 'like').toggleClass('btn-outline-success', myVote != 'like')
+        dislikeBtn.toggleClass('btn-danger', myVote == 'dislike').toggleClass('btn-outline-danger', myVote != 'dislike')
+    }
+
     const postLikeBtn = $('input[name=post_like]')
     postLikeBtn.click(function(e){
         e.preventDefault()
@@ -46,6 +51,7 @@ $(document).ready(function(){
             success: function(data){
                 postDislikeBtn.attr({'value': `↓ ${data.dislikes}`})
                 postLikeBtn.attr({'value': `↑ ${data.likes}`})
+                setVoteButtons(postLikeBtn, postDislikeBtn, data.my_vote)
             },
             error: function(data){
                 loginURLRedirect(data.status)
@@ -68,6 +74,7 @@ $(document).ready(function(){
             success: function(data){
                 postLikeBtn.attr({'value': `↑ ${data.likes}`})
                 postDislikeBtn.attr({'value': `↓ ${data.dislikes}`})
+                setVoteButtons(postLikeBtn, postDislikeBtn, data.my_vote)
             },
             error: function(data){
                 loginURLRedirect(data.status)
@@ -92,6 +99,9 @@ $(document).ready(function(){
             success: function(data){
                 parent.children('input[name=comment_like]').attr({'value': `↑ ${data.likes}`})
                 parent.children('input[name=comment_dislike]').attr({'value': `↓ ${data.dislikes}`})
+                setVoteButtons(
+                    parent.children('input[name=comment_like]'), parent.children('input[name=comment_dislike]'), data.my_vote
+                )
             },
             error: function(data){
                 loginURLRedirect(data.status)
@@ -115,10 +125,56 @@ $(document).ready(function(){
             success: function(data){
                 parent.children('input[name=comment_like]').attr({'value': `↑ ${data.likes}`})
                 parent.children('input[name=comment_dislike]').attr({'value': `↓ ${data.dislikes}`})
+                setVoteButtons(
+                    parent.children('input[name=comment_like]'), parent.children('input[name=comment_dislike]'), data.my_vote
+                )
             },
             error: function(data){
                 window.location.replace(loginURL)
             }
         })
     })
+
+    // Search suggestions, request is sent after user stops typing and answers to old requests are dropped
+    const searchInput = $('input[data-suggest-url]')
+    const searchSuggestions = $('#search_suggestions')
+    let suggestTimer = null
+    let suggestRequest = 0
+
+    searchInput.on('input', function(){
+        clearTimeout(suggestTimer)
+        let query = searchInput.val().trim()
+        if (!query){
+            searchSuggestions.addClass('d-none').empty()
+            return
+        }
+
+        suggestTimer = setTimeout(function(){
+            let request = ++suggestRequest
+            $.ajax({
+                url: searchInput.data('suggest-url'),
+                data: {'q': query},
+                dataType: 'json',
+                success: function(data){
+                    if (request != suggestRequest){
+                        return
+                    }
+                    searchSuggestions.empty()
+                    for (let suggestion of data.results){
+                        $('<a class="list-group-item list-group-item-action"></a>')
+                            .attr('href', suggestion.url)
+                            .text(suggestion.title)
+                            .prepend(suggestion.type == 'category' ? '<span class="badge bg-secondary me-2">Category</span>' : '')
+                            .appendTo(searchSuggestions)
+                    }
+                    searchSuggestions.toggleClass('d-none', data.results.length == 0)
+                }
+            })
+        }, 150)
+    })
+
+    searchInput.on('blur', function(){
+        // Let click on suggestion open it before the list is hidden
+        setTimeout(function(){ searchSuggestions.addClass('d-none') }, 200)
+    })
 })
\ No newline at end of file
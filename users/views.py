@@ -1,6 +1,5 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.paginator import Paginator
 from django.http import HttpResponseRedirect, Http404
 from django.core.exceptions import PermissionDenied
 from django.urls import reverse_lazy, reverse
@@ -16,6 +15,9 @@ from .models import CustomUserModel, EmailCode
 from .utils import EmailConfirmationCode
 from django.contrib import messages
 from django.contrib.auth.tokens import default_token_generator
+from forum.counts import get_count_key
+from forum.models import Post
+from forum.pagination import KeysetPaginator
 
 
 class SignUpView(EmailConfirmationCode, CreateView):
@@ -116,12 +118,15 @@ class ProfileView(DetailView):
 	def get_context_data(self, **kwargs):
 		context = super(ProfileView, self).get_context_data(**kwargs)
 		context['title'] = self.request.user.username
-		context['paginator'] = Paginator(self.object.post_set.values('pk', 'title'), self.paginate_by)
-		context['page_obj'] = self.get_page_obj(context['paginator'], self.request.GET.get('page', 1))
+		context['paginator'] = KeysetPaginator(
+			self.object.post_set.values('pk', 'title'), self.paginate_by,
+			count_key=get_count_key(Post, author_id=self.object.pk)
+		)
+		context['page_obj'] = self.get_page_obj(context['paginator'], self.request.GET)
 		return context
 
-	def get_page_obj(self, paginator, page_number):
-		page_obj = paginator.page(page_number)
+	def get_page_obj(self, paginator, params):
+		page_obj = paginator.get_page_from_params(params)
 		return page_obj
 
 